@@ -0,0 +1,384 @@
+"""
+Offline end-to-end benchmark for the quiz solver.
+
+Starts a local quiz server and a mock OpenAI-compatible server in-process,
+launches the solver (main:app) as a subprocess pointed at both, runs N
+concurrent /solve-quiz chains and reports per-stage p50/p95/p99 (from the
+solver's span logs), chain latency, throughput and the solver's peak RSS.
+
+    python benchmark.py --chains 8 --output benchmark_baseline.json
+    python benchmark.py --chains 8 --compare benchmark_baseline.json
+
+With --scaling the same load is run once per uvicorn worker count, to show how
+throughput scales with cores (large downloads make the chains CPU bound):
+
+    python benchmark.py --chains 16 --rows 200000 --llm-latency "default=fixed:0.05" --scaling 1,2,4
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import asyncio
+import argparse
+import platform
+import shutil
+import tempfile
+import threading
+import subprocess
+import httpx
+import uvicorn
+from benchmark_servers import DEFAULT_STEPS, QuizChains, create_quiz_app, create_llm_app, parse_latencies
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_EMAIL = "bench@example.com"
+BENCH_SECRET = "bench-secret"
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(samples: list[float], q: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(samples: list[float]) -> dict:
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples) if samples else None,
+        **{f"p{int(q * 100)}": percentile(samples, q) for q in PERCENTILES},
+    }
+
+
+class BackgroundServer:
+    """Runs a FastAPI app with uvicorn on a daemon thread."""
+
+    def __init__(self, app, port: int):
+        self.port = port
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        deadline = time.time() + 10
+        while not self.server.started:
+            if time.time() > deadline:
+                raise RuntimeError(f"Server on port {self.port} did not start")
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+def process_tree(pid: int) -> list[int]:
+    """`pid` and all its live descendants (uvicorn workers, PDF pool processes), Linux only."""
+    pids = [pid]
+    for current in pids:
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def peak_rss_mb(pid: int) -> float | None:
+    """Sum of the peak resident set sizes (VmHWM) of a live process tree, Linux only."""
+    total = None
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total = (total or 0) + int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    return total
+
+
+def start_solver(port: int, llm_port: int, args, log_file, shared_dir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "STUDENT_EMAIL": BENCH_EMAIL,
+        "STUDENT_SECRET": BENCH_SECRET,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+        "LOG_FORMAT": "json",
+        "LOG_LEVEL": "INFO",
+        "TRACE_LOG_SPANS": "true",
+        "LLM_CACHE_ENABLED": "true" if args.llm_cache else "false",
+        "MAX_CONCURRENT_CHAINS": str(args.max_concurrent),
+        "WEB_CONCURRENCY": str(args.workers),
+        "GLOBAL_MAX_CHAINS": str(args.max_concurrent * args.workers),
+        # Fresh caches and locks for every run
+        "SHARED_STATE_DIR": shared_dir,
+        "JOB_QUEUE_SIZE": str(max(16, args.chains)),
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, solver: subprocess.Popen, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if solver.poll() is not None:
+            raise RuntimeError(f"Solver exited with code {solver.returncode} during startup")
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Solver did not become ready")
+
+
+async def run_chain(client: httpx.AsyncClient, url: str, timeout: float, profile: bool = False) -> dict:
+    response = await client.post(
+        "/solve-quiz", json={"email": BENCH_EMAIL, "secret": BENCH_SECRET, "url": url, "profile": profile}
+    )
+    if response.status_code != 200:
+        return {"status": "rejected", "http_status": response.status_code, "quizzes": []}
+    job_id = response.json()["job_id"]
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = (await client.get(f"/jobs/{job_id}")).json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        await asyncio.sleep(0.25)
+    return {"status": "timeout", "job_id": job_id, "quizzes": []}
+
+
+def stage_samples(log_path: str) -> tuple[dict[str, list[float]], dict[str, dict[str, int]]]:
+    """Span durations and outcome counts per stage, read from the solver's JSON log."""
+    durations: dict[str, list[float]] = {}
+    outcomes: dict[str, dict[str, int]] = {}
+    with open(log_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if not line.startswith("{"):
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            stage = entry.get("span")
+            if stage is None:
+                continue
+            outcome = entry.get("outcome", "ok")
+            outcomes.setdefault(stage, {})
+            outcomes[stage][outcome] = outcomes[stage].get(outcome, 0) + 1
+            if outcome == "ok":
+                durations.setdefault(stage, []).append(entry["duration"])
+    return durations, outcomes
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args) -> dict:
+    quiz_port, llm_port, solver_port = free_port(), free_port(), free_port()
+    chains = QuizChains(f"http://127.0.0.1:{quiz_port}", steps=args.steps, rows=args.rows, pdf_rows=args.pdf_rows)
+    quiz_server = BackgroundServer(create_quiz_app(chains), quiz_port)
+    llm_server = BackgroundServer(create_llm_app(parse_latencies(args.llm_latency)), llm_port)
+    quiz_server.start()
+    llm_server.start()
+
+    log_path = args.log or os.path.join(tempfile.gettempdir(), f"quiz_bench_{os.getpid()}.log")
+    shared_dir = tempfile.mkdtemp(prefix="quiz_bench_shared_")
+    with open(log_path, "w") as log_file:
+        solver = start_solver(solver_port, llm_port, args, log_file, shared_dir)
+    peak_rss = None
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{solver_port}", timeout=30) as client:
+            await wait_ready(client, solver)
+            started = time.time()
+            jobs = await asyncio.gather(*(
+                run_chain(client, chains.quiz_url(f"c{i}", 1), args.timeout, args.profile) for i in range(args.chains)
+            ))
+            wall = time.time() - started
+            peak_rss = peak_rss_mb(solver.pid)
+    finally:
+        solver.send_signal(signal.SIGINT)
+        try:
+            solver.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            solver.kill()
+            solver.wait()
+        quiz_server.stop()
+        llm_server.stop()
+        profiles_dir = None
+        if args.profile and os.path.isdir(os.path.join(shared_dir, "profiles")):
+            profiles_dir = os.path.join(tempfile.gettempdir(), f"quiz_bench_profiles_{os.getpid()}_{args.workers}")
+            shutil.rmtree(profiles_dir, ignore_errors=True)
+            shutil.move(os.path.join(shared_dir, "profiles"), profiles_dir)
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+    durations, outcomes = stage_samples(log_path)
+    quizzes = [q for job in jobs for q in job["quizzes"]]
+    chain_latency = [job["finished_at"] - job["created_at"] for job in jobs if job.get("finished_at")]
+    completed = sum(1 for job in jobs if job["status"] == "completed")
+    return {
+        "meta": {
+            "timestamp": time.time(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "chains": args.chains,
+            "max_concurrent": args.max_concurrent,
+            "workers": args.workers,
+            "cpu_count": os.cpu_count(),
+            "steps": args.steps,
+            "rows": args.rows,
+            "llm_latency": args.llm_latency,
+            "llm_cache": args.llm_cache,
+            "profile": args.profile,
+            "profiles_dir": profiles_dir,
+            "log": log_path,
+        },
+        "wall_seconds": wall,
+        "throughput": {
+            "chains_per_second": completed / wall if wall else 0.0,
+            "quizzes_per_second": len(quizzes) / wall if wall else 0.0,
+        },
+        "chains": {
+            "completed": completed,
+            "failed": len(jobs) - completed,
+            "latency": summarize(chain_latency),
+        },
+        "quizzes": {
+            "attempted": len(quizzes),
+            "correct": sum(1 for q in quizzes if q["status"] == "correct"),
+            "incorrect": sum(1 for q in quizzes if q["status"] == "incorrect"),
+            "failed": sum(1 for q in quizzes if q["status"] == "failed"),
+        },
+        "stages": {
+            stage: {**summarize(durations.get(stage, [])), "outcomes": outcomes[stage]}
+            for stage in sorted(outcomes)
+        },
+        "peak_rss_mb": peak_rss,
+        "quiz_server": chains.stats,
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Lines describing p95/throughput changes; regressions beyond `tolerance` are marked."""
+    lines = []
+
+    def check(label: str, current, previous, higher_is_worse: bool = True):
+        if current is None or not previous:
+            return
+        change = (current - previous) / previous
+        regressed = change > tolerance if higher_is_worse else change < -tolerance
+        lines.append(f"{'REGRESSION' if regressed else 'ok':>10}  {label:<32} {previous:10.3f} -> {current:10.3f} ({change:+.1%})")
+
+    check("chain p95 (s)", result["chains"]["latency"]["p95"], baseline["chains"]["latency"]["p95"])
+    for stage, stats in result["stages"].items():
+        if stage in baseline["stages"]:
+            check(f"{stage} p95 (s)", stats["p95"], baseline["stages"][stage]["p95"])
+    check("chains/s", result["throughput"]["chains_per_second"], baseline["throughput"]["chains_per_second"],
+          higher_is_worse=False)
+    check("peak RSS (MB)", result["peak_rss_mb"], baseline.get("peak_rss_mb"))
+    return lines
+
+
+def print_report(result: dict):
+    print(f"\nChains: {result['chains']['completed']}/{result['meta']['chains']} completed in {result['wall_seconds']:.2f}s")
+    quizzes = result["quizzes"]
+    print(f"Quizzes: {quizzes['attempted']} attempted, {quizzes['correct']} correct, "
+          f"{quizzes['incorrect']} incorrect, {quizzes['failed']} failed")
+    print(f"Throughput: {result['throughput']['chains_per_second']:.3f} chains/s, "
+          f"{result['throughput']['quizzes_per_second']:.3f} quizzes/s")
+    if result["peak_rss_mb"] is not None:
+        print(f"Peak RSS: {result['peak_rss_mb']:.1f} MB")
+    print(f"\n{'stage':<16}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}  outcomes")
+    rows = [("chain", result["chains"]["latency"], {})] + [(s, v, v["outcomes"]) for s, v in result["stages"].items()]
+    for stage, stats, outcomes in rows:
+        cells = "".join(f"{stats[p]:10.3f}" if stats[p] is not None else f"{'-':>10}" for p in ("p50", "p95", "p99"))
+        print(f"{stage:<16}{stats['count']:>7}{cells}  {outcomes or ''}")
+
+
+def print_scaling(results: list[dict]):
+    base = results[0]["throughput"]["chains_per_second"]
+    print(f"\n{'workers':>7}{'chains/s':>12}{'speedup':>10}{'efficiency':>12}{'chain p95':>11}{'peak RSS':>10}  correct")
+    for result in results:
+        workers = result["meta"]["workers"]
+        rate = result["throughput"]["chains_per_second"]
+        speedup = rate / base if base else 0.0
+        p95 = result["chains"]["latency"]["p95"]
+        rss = result["peak_rss_mb"]
+        print(f"{workers:>7}{rate:>12.3f}{speedup:>9.2f}x{speedup / workers:>11.0%}"
+              f"{p95 if p95 is not None else float('nan'):>11.2f}{rss or float('nan'):>10.0f}"
+              f"  {result['quizzes']['correct']}/{result['quizzes']['attempted']}")
+    print(f"(cpu count: {os.cpu_count()})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark for the quiz solver")
+    parser.add_argument("--chains", type=int, default=8, help="concurrent /solve-quiz chains")
+    parser.add_argument("--max-concurrent", type=int, default=4, help="solver MAX_CONCURRENT_CHAINS (per worker)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes (WEB_CONCURRENCY)")
+    parser.add_argument("--scaling", help="comma separated worker counts to run one after another, e.g. 1,2,4")
+    parser.add_argument("--steps", default=",".join(DEFAULT_STEPS),
+                        help="comma separated step kinds: static, atob, browser, csv, json, xlsx, pdf")
+    parser.add_argument("--rows", type=int, default=10000, help="rows per CSV/JSON/XLSX download")
+    parser.add_argument("--pdf-rows", type=int, default=30, help="table rows in PDF downloads")
+    parser.add_argument("--llm-latency", default="",
+                        help="per call type latency, e.g. 'plan=lognormal:-0.5,0.4;answer=uniform:0.2,1;default=fixed:0.5'")
+    parser.add_argument("--llm-cache", action="store_true", help="leave the solver's LLM cache enabled")
+    parser.add_argument("--profile", action="store_true", help="profile every chain (adds sampling overhead)")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for each chain")
+    parser.add_argument("--log", help="where to keep the solver log (default: a temp file)")
+    parser.add_argument("--output", help="write the result JSON here (e.g. a new baseline)")
+    parser.add_argument("--compare", help="baseline JSON to compare against; exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+    args.steps = [s.strip() for s in args.steps.split(",") if s.strip()]
+
+    if args.scaling:
+        results = []
+        for workers in [int(w) for w in args.scaling.split(",") if w.strip()]:
+            args.workers = workers
+            print(f"\n=== {workers} worker(s) ===")
+            results.append(asyncio.run(run_benchmark(args)))
+            print_report(results[-1])
+        print_scaling(results)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"scaling": results}, f, indent=2)
+            print(f"\nWrote {args.output}")
+        return
+
+    result = asyncio.run(run_benchmark(args))
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines = compare(result, baseline, args.tolerance)
+        print(f"\nCompared with {args.compare}:")
+        print("\n".join(lines))
+        if any(line.lstrip().startswith("REGRESSION") for line in lines):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
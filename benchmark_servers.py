@@ -0,0 +1,291 @@
+# Local stand-ins for the benchmark: a quiz server serving multi-step chains and
+# a mock OpenAI-compatible chat completions server with configurable latency.
+# Both are plain FastAPI apps so benchmark.py can run them in-process.
+
+import io
+import re
+import json
+import time
+import base64
+import random
+import asyncio
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+
+DEFAULT_STEPS = ["static", "atob", "csv", "json", "xlsx", "pdf"]
+STEP_KINDS = {"static", "atob", "browser", "csv", "json", "xlsx", "pdf"}
+FILE_STEPS = {"csv", "json", "xlsx", "pdf"}
+ANSWER_HINT = "BENCH-ANSWER"
+DEFAULT_LATENCY = "lognormal:-0.7,0.5"
+
+
+# --- Quiz server ---
+
+def make_pdf(lines: list[str]) -> bytes:
+    """Minimal single-page PDF with one line of Courier text per entry."""
+    def escape(text: str) -> str:
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    content = "BT /F1 10 Tf 12 TL 50 760 Td\n" + "".join(f"({escape(line)}) Tj T*\n" for line in lines) + "ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+        "/Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>",
+        f"<< /Length {len(content)} >>\nstream\n{content}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>",
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+class QuizChains:
+    """
+    Generates one deterministic chain per chain id. Every step has its own
+    expected answer; downloads are built lazily and kept for the run.
+    """
+
+    def __init__(self, base_url: str, steps: list[str] = DEFAULT_STEPS, rows: int = 10000, pdf_rows: int = 30):
+        unknown = set(steps) - STEP_KINDS
+        if unknown:
+            raise ValueError(f"Unknown step kinds: {sorted(unknown)}")
+        self.base_url = base_url.rstrip("/")
+        self.steps = steps
+        self.rows = rows
+        self.pdf_rows = pdf_rows
+        self._files: dict[tuple[str, int], tuple[bytes, str, int]] = {}
+        self.stats = {"pages": 0, "downloads": 0, "download_bytes": 0, "correct": 0, "incorrect": 0}
+
+    def quiz_url(self, chain: str, step: int) -> str:
+        return f"{self.base_url}/quiz/{chain}/{step}"
+
+    def _values(self, chain: str, step: int, count: int) -> list[int]:
+        rng = random.Random(f"{chain}:{step}")
+        return [rng.randint(1, 1000) for _ in range(count)]
+
+    def expected_answer(self, chain: str, step: int):
+        kind = self.steps[step - 1]
+        if kind in FILE_STEPS:
+            return self.file(chain, step)[2]
+        a, b = self._values(chain, step, 2)
+        return a + b
+
+    def file(self, chain: str, step: int) -> tuple[bytes, str, int]:
+        """(body, content type, sum of the value column) for a download step."""
+        key = (chain, step)
+        if key not in self._files:
+            self._files[key] = self._build_file(chain, step)
+        return self._files[key]
+
+    def _build_file(self, chain: str, step: int) -> tuple[bytes, str, int]:
+        kind = self.steps[step - 1]
+        count = self.pdf_rows if kind == "pdf" else self.rows
+        values = self._values(chain, step, count)
+        categories = ["alpha", "beta", "gamma", "delta"]
+        rows = [(i + 1, categories[i % 4], v) for i, v in enumerate(values)]
+        total = sum(values)
+        if kind == "csv":
+            body = "id,category,value\n" + "".join(f"{i},{c},{v}\n" for i, c, v in rows)
+            return body.encode(), "text/csv", total
+        if kind == "json":
+            body = json.dumps([{"id": i, "category": c, "value": v} for i, c, v in rows])
+            return body.encode(), "application/json", total
+        if kind == "xlsx":
+            from openpyxl import Workbook
+
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet()
+            sheet.append(["id", "category", "value"])
+            for row in rows:
+                sheet.append(list(row))
+            buffer = io.BytesIO()
+            workbook.save(buffer)
+            return buffer.getvalue(), "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", total
+        lines = [f"{'id':<8}{'category':<12}value"] + [f"{i:<8}{c:<12}{v}" for i, c, v in rows]
+        lines += ["", f"Checksum {ANSWER_HINT}: {total}"]
+        return make_pdf(lines), "application/pdf", total
+
+    def page(self, chain: str, step: int) -> str:
+        kind = self.steps[step - 1]
+        submit = f"Post your answer to {self.base_url}/submit with the url of this page."
+        if kind in FILE_STEPS:
+            link = f"{self.base_url}/files/{chain}/{step}/data.{kind}"
+            question = (
+                f"Quiz {chain}-{step}. Download <a href=\"{link}\">{link}</a>. "
+                f"What is the sum of the \"value\" column?"
+            )
+            return f"<html><body><h1>Quiz {step}</h1><p>{question}</p><p>{submit}</p></body></html>"
+
+        a, b = self._values(chain, step, 2)
+        question = f"Quiz {chain}-{step}. What is {a} + {b}? ({ANSWER_HINT}: {a + b})"
+        if kind == "static":
+            return f"<html><body><h1>Quiz {step}</h1><p>{question}</p><p>{submit}</p></body></html>"
+        if kind == "atob":
+            encoded = base64.b64encode(f"<p>{question}</p><p>{submit}</p>".encode()).decode()
+            return (
+                "<html><body><div id=\"result\"></div><script>"
+                f"document.querySelector(\"#result\").innerHTML = atob(`{encoded}`);"
+                "</script></body></html>"
+            )
+        # Only a real browser sees this text: it is assembled at runtime
+        parts = json.dumps([f"<p>{question}</p>", "<p>Post your answer", " to ", f"{self.base_url}/submit", "</p>"])
+        return (
+            "<html><body><div id=\"result\"></div><script>"
+            f"document.getElementById(\"result\").innerHTML = {parts}.join(\"\");"
+            "</script></body></html>"
+        )
+
+    def check(self, quiz_url: str, answer) -> dict:
+        match = re.search(r"/quiz/([^/]+)/(\d+)$", quiz_url or "")
+        if not match or not 0 < int(match.group(2)) <= len(self.steps):
+            return {"correct": False, "url": None, "reason": "unknown quiz url"}
+        chain, step = match.group(1), int(match.group(2))
+        expected = self.expected_answer(chain, step)
+        try:
+            correct = abs(float(answer) - expected) < 1e-6
+        except (TypeError, ValueError):
+            correct = False
+        self.stats["correct" if correct else "incorrect"] += 1
+        next_url = self.quiz_url(chain, step + 1) if step < len(self.steps) else None
+        return {"correct": correct, "url": next_url, "reason": None if correct else f"expected {expected}"}
+
+
+def create_quiz_app(chains: QuizChains) -> FastAPI:
+    app = FastAPI(title="Benchmark quiz server")
+
+    @app.get("/quiz/{chain}/{step}", response_class=HTMLResponse)
+    def quiz_page(chain: str, step: int):
+        if not 0 < step <= len(chains.steps):
+            raise HTTPException(status_code=404, detail="No such step")
+        chains.stats["pages"] += 1
+        return chains.page(chain, step)
+
+    @app.get("/files/{chain}/{step}/{name}")
+    def quiz_file(chain: str, step: int, name: str):
+        if not 0 < step <= len(chains.steps) or chains.steps[step - 1] not in FILE_STEPS:
+            raise HTTPException(status_code=404, detail="No such file")
+        body, content_type, _ = chains.file(chain, step)
+        chains.stats["downloads"] += 1
+        chains.stats["download_bytes"] += len(body)
+        return Response(content=body, media_type=content_type)
+
+    @app.post("/submit")
+    async def submit(request: Request):
+        payload = await request.json()
+        return chains.check(payload.get("url"), payload.get("answer"))
+
+    @app.get("/stats")
+    def stats():
+        return chains.stats
+
+    return app
+
+
+# --- Mock LLM server ---
+
+def parse_latency(spec: str):
+    """
+    Parses one distribution: fixed:S, uniform:LO,HI, normal:MU,SIGMA,
+    lognormal:MU,SIGMA (of the underlying normal) or exp:MEAN, all in seconds.
+    Returns a zero-argument sampler.
+    """
+    kind, _, args = spec.partition(":")
+    params = [float(p) for p in args.split(",") if p.strip()]
+    samplers = {
+        "fixed": lambda: params[0],
+        "uniform": lambda: random.uniform(params[0], params[1]),
+        "normal": lambda: max(0.0, random.gauss(params[0], params[1])),
+        "lognormal": lambda: random.lognormvariate(params[0], params[1]),
+        "exp": lambda: random.expovariate(1 / params[0]),
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution: {spec}")
+    samplers[kind]()  # Fail fast on missing parameters
+    return samplers[kind]
+
+
+def parse_latencies(spec: str) -> dict:
+    """`plan=uniform:0.2,1;answer=fixed:0.5` -> samplers per call type ("default" covers the rest)."""
+    samplers = {"default": parse_latency(DEFAULT_LATENCY)}
+    for part in filter(None, (p.strip() for p in spec.split(";"))):
+        name, _, distribution = part.rpartition("=")
+        samplers[name or "default"] = parse_latency(distribution)
+    return samplers
+
+
+def classify_call(messages: list[dict]) -> str:
+    system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    if "exact plan" in system:
+        return "plan"
+    if "operation spec" in system:
+        return "spec"
+    return "answer"
+
+
+def mock_reply(call_type: str, messages: list[dict]) -> str:
+    user = "\n".join(m.get("content", "") for m in messages if m.get("role") == "user")
+    if call_type == "plan":
+        task_type = "DOWNLOAD" if re.search(r"\.(?:csv|json|xlsx?|pdf)\b", user, re.IGNORECASE) else "ANALYZE"
+        return json.dumps({"task_type": task_type, "plan": ["Read the question", "Compute the answer"]})
+    if call_type == "spec":
+        return json.dumps({"aggregate": {"column": "value", "func": "sum"}})
+    hint = re.search(rf"{ANSWER_HINT}:\s*(-?[\d.]+)", user)
+    return hint.group(1) if hint else "0"
+
+
+def create_llm_app(latencies: dict) -> FastAPI:
+    app = FastAPI(title="Mock OpenAI-compatible server")
+    stats: dict[str, int] = {}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        call_type = classify_call(messages)
+        stats[call_type] = stats.get(call_type, 0) + 1
+        content = mock_reply(call_type, messages)
+        delay = latencies.get(call_type, latencies["default"])()
+        created = int(time.time())
+        model = body.get("model", "mock")
+        completion_id = f"chatcmpl-bench-{random.getrandbits(48):x}"
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+
+        async def events():
+            # Latency is time to first token; the rest arrives in small pieces
+            await asyncio.sleep(delay)
+            for i in range(0, len(content), 8):
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": content[i:i + 8]}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            done = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    def llm_stats():
+        return stats
+
+    return app
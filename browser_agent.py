@@ -1,63 +1,688 @@
+import os
 import re
+import base64
 import asyncio
-from playwright.async_api import async_playwright
+import httpx
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+from contextlib import asynccontextmanager
+from http_client import get_http_client, host_slot, request_with_retry, trace_extensions
+from telemetry import get_logger, span
+from recorder import intercept
+from shared_state import ARTIFACT_CACHE, copy_artifact, per_worker
 
-async def get_quiz_details(url: str) -> tuple[str, str]:
+logger = get_logger("browser_agent")
+
+# Concurrent browser contexts for the whole host, split evenly between uvicorn workers
+BROWSER_POOL_SIZE = per_worker(int(os.getenv("BROWSER_POOL_SIZE", "4")))
+BROWSER_CONTEXT_MAX_USES = int(os.getenv("BROWSER_CONTEXT_MAX_USES", "20"))
+STATIC_FETCH_ENABLED = os.getenv("STATIC_FETCH_ENABLED", "true").lower() == "true"
+
+SUBMIT_URL_PATTERN = re.compile(r"Post your answer to (https?://[^\s\"]+)", re.IGNORECASE)
+# `el.innerHTML = atob(`...`)` style injections can be decoded without a browser
+ATOB_INJECTION_PATTERN = re.compile(
+    r"(?:document\.(?:querySelector|getElementById)\(\s*(['\"`])[^'\"`]*\1\s*\)|\w+)"
+    r"\.(?:innerHTML|innerText|textContent)\s*=\s*atob\(\s*(['\"`])([A-Za-z0-9+/=\s]*)\2\s*\)\s*;?"
+)
+DOM_WRITE_PATTERN = re.compile(
+    r"innerHTML|outerHTML|innerText|textContent|document\.write|appendChild|insertAdjacent|"
+    r"createElement|replaceChildren|\.append\(|\.prepend\(|fetch\(|XMLHttpRequest"
+)
+
+PAGE_FETCH_STATS = {"http": 0, "browser": 0, "fallback_reasons": {}}
+
+# "lean" blocks unneeded resources and stops waiting once the quiz text is there; "full" loads everything
+RENDER_PROFILE = os.getenv("RENDER_PROFILE", "lean").lower()
+# Stylesheets are never blocked by default: inner_text() relies on them to leave out hidden text
+RENDER_BLOCKED_RESOURCES = set(os.getenv("RENDER_BLOCKED_RESOURCES", "image,media,font").split(","))
+RENDER_BLOCKED_HOSTS = tuple(h for h in os.getenv(
+    "RENDER_BLOCKED_HOSTS",
+    "google-analytics.com,googletagmanager.com,doubleclick.net,facebook.net,hotjar.com,segment.io,clarity.ms"
+).split(",") if h)
+# After domcontentloaded: wait for "networkidle" or for the body text to stop changing ("stable")
+RENDER_WAIT = os.getenv("RENDER_WAIT", "stable").lower()
+RENDER_STABLE_MS = int(os.getenv("RENDER_STABLE_MS", "300"))
+
+# "bytes" is measured from finished requests (headers and body as received)
+RENDER_STATS = {"pages": 0, "requests": 0, "bytes": 0, "requests_blocked": 0, "finished_on": {}}
+
+LINK_SELECTOR = "a[href], audio[src], video[src], source[src], embed[src], iframe[src]"
+LINK_TARGETS_SCRIPT = "els => els.map(e => e.getAttribute('href') || e.getAttribute('src'))"
+SUBMIT_TEXT_CHECK = "() => !!document.body && document.body.innerText.includes('Post your answer to')"
+CONTENT_STABLE_CHECK = """
+(ms) => new Promise(resolve => {
+    const size = () => document.body ? document.body.innerText.length : -1;
+    let last = size(), since = performance.now();
+    const tick = () => {
+        const current = size();
+        if (current !== last) { last = current; since = performance.now(); }
+        if (current > 0 && performance.now() - since >= ms) resolve(true);
+        else setTimeout(tick, 50);
+    };
+    tick();
+})
+"""
+
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+# An HTML page saying this instead of serving the file is worth retrying in the browser
+JS_REQUIRED_PATTERN = re.compile(r"enable javascript|javascript (?:is )?required|requires javascript", re.IGNORECASE)
+
+CONTENT_TYPE_FORMATS = {
+    "application/pdf": "pdf",
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/json": "json",
+    "application/x-ndjson": "json",
+    "text/tab-separated-values": "csv",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+    "application/vnd.ms-excel": "xls",
+    "text/plain": "txt",
+}
+
+
+class DownloadTooLargeError(Exception):
+    """Raised when a download exceeds DOWNLOAD_MAX_BYTES."""
+
+
+class BrowserRequiredError(Exception):
+    """Raised when a file is only served to a browser (auth cookies or JavaScript)."""
+
+
+class BrowserPool:
     """
-    Async version.
-    Loads the quiz page using Playwright async chromium,
-    extracts visible instructions + the submit URL.
+    Long-lived Chromium instance handing out isolated browser contexts.
+    At most `size` contexts are in use at once; idle contexts are reused
+    and recycled after `max_uses` or after any error raised while in use.
     """
-    print(f"-> Browser: Visiting quiz URL: {url}")
-    quiz_instructions = "ERROR: Could not retrieve quiz instructions."
-    submit_url = ""
 
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_uses: int = BROWSER_CONTEXT_MAX_USES):
+        self.size = size
+        self.max_uses = max_uses
+        self._playwright = None
+        self._browser = None
+        self._idle: list = []
+        self._uses: dict = {}
+        self._semaphore = asyncio.Semaphore(size)
+        self._lock = asyncio.Lock()
+        self._in_use = 0
+        self.launches = 0
+        self.crash_restarts = 0
+        self.contexts_recycled = 0
+
+    async def start(self):
+        """Starts Playwright and launches the shared browser."""
+        async with self._lock:
+            await self._ensure_browser()
+
+    async def stop(self):
+        """Closes every pooled context, the browser and Playwright."""
+        async with self._lock:
+            for context in self._idle:
+                await self._close_context(context)
+            self._idle.clear()
+            self._uses.clear()
+            if self._browser is not None:
+                try:
+                    await self._browser.close()
+                except Exception as e:
+                    logger.warning("Error closing browser: %s", e)
+                self._browser = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+        logger.info("Pool shut down")
+
+    async def _ensure_browser(self):
+        # Caller must hold self._lock
+        if self._browser is not None and self._browser.is_connected():
+            return
+        if self._browser is not None:
+            # The browser died underneath us; its contexts are unusable
+            logger.warning("Browser disconnected, relaunching")
+            self.crash_restarts += 1
+            self._idle.clear()
+            self._uses.clear()
+        if self._playwright is None:
+            # Imported here: playwright is only needed once a page has to be rendered
+            from playwright.async_api import async_playwright
+            self._playwright = await async_playwright().start()
+        with span("browser_launch"):
+            self._browser = await self._playwright.chromium.launch(headless=True)
+        self.launches += 1
+        logger.info("Launched Chromium (launch #%d)", self.launches)
+
+    async def _close_context(self, context):
+        self._uses.pop(context, None)
+        try:
+            await context.close()
+        except Exception:
+            pass
+
+    async def _acquire_context(self):
+        async with self._lock:
+            await self._ensure_browser()
+            while self._idle:
+                context = self._idle.pop()
+                if self._browser.is_connected():
+                    return context
+            context = await self._browser.new_context(accept_downloads=True)
+            self._uses[context] = 0
+            return context
+
+    async def _release_context(self, context, failed: bool):
+        self._uses[context] = self._uses.get(context, 0) + 1
+        if failed or self._uses[context] >= self.max_uses or not self._browser or not self._browser.is_connected():
+            self.contexts_recycled += 1
+            await self._close_context(context)
+            return
+        # Drop pages left behind so the next user starts from a clean context
+        for page in list(context.pages):
+            try:
+                await page.close()
+            except Exception:
+                pass
+        self._idle.append(context)
+
+    @asynccontextmanager
+    async def context(self):
+        """Yields a pooled browser context, waiting for a free slot if needed."""
+        async with self._semaphore:
+            context = await self._acquire_context()
+            self._in_use += 1
+            failed = False
+            try:
+                yield context
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                self._in_use -= 1
+                await self._release_context(context, failed)
+
+    @asynccontextmanager
+    async def page(self):
+        """Yields a fresh page inside a pooled browser context."""
+        async with self.context() as context:
+            page = await context.new_page()
+            try:
+                yield page
+            finally:
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "in_use": self._in_use,
+            "idle": len(self._idle),
+            "launches": self.launches,
+            "crash_restarts": self.crash_restarts,
+            "contexts_recycled": self.contexts_recycled,
+            "browser_connected": bool(self._browser and self._browser.is_connected()),
+        }
+
+
+BROWSER_POOL = BrowserPool()
+
+
+class _VisibleTextParser(HTMLParser):
+    """Approximates `inner_text("body")` for static HTML and collects inline scripts."""
+
+    HIDDEN_TAGS = {"script", "style", "noscript", "template", "head", "title", "svg"}
+    BLOCK_TAGS = {
+        "p", "div", "br", "li", "ul", "ol", "tr", "table", "section", "article",
+        "header", "footer", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote",
+        "form", "hr", "dl", "dt", "dd",
+    }
+    # Elements whose target may be a file or sub-page the quiz refers to
+    LINK_ATTRS = {"a": "href", "audio": "src", "video": "src", "source": "src", "embed": "src", "iframe": "src"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self.scripts: list[str] = []
+        self.external_scripts: list[str] = []
+        self.links: list[str] = []
+        self._hidden_depth = 0
+        self._in_script = False
+        self._pre_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.LINK_ATTRS:
+            target = dict(attrs).get(self.LINK_ATTRS[tag])
+            if target:
+                self.links.append(target)
+        if tag == "script":
+            self._in_script = True
+            if dict(attrs).get("src"):
+                self.external_scripts.append(dict(attrs)["src"])
+            self.scripts.append("")
+        if tag in self.HIDDEN_TAGS:
+            self._hidden_depth += 1
+        elif tag == "pre":
+            self._pre_depth += 1
+        if tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+        elif tag in ("td", "th"):
+            self.parts.append("\t")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in ("br", "hr"):
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "script":
+            self._in_script = False
+        if tag in self.HIDDEN_TAGS:
+            self._hidden_depth = max(0, self._hidden_depth - 1)
+        elif tag == "pre":
+            self._pre_depth = max(0, self._pre_depth - 1)
+        if tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_script:
+            self.scripts[-1] += data
+        elif not self._hidden_depth:
+            self.parts.append(data if self._pre_depth else re.sub(r"\s+", " ", data))
+
+    def text(self) -> str:
+        lines = (line.strip(" ") for line in "".join(self.parts).split("\n"))
+        return "\n".join(line for line in lines if line.strip()).strip()
+
+
+def _html_to_text(html: str) -> tuple[str, list[str], list[str], list[str]]:
+    parser = _VisibleTextParser()
+    parser.feed(html)
+    parser.close()
+    return parser.text(), parser.scripts, parser.external_scripts, parser.links
+
+
+def _render_static(html: str, url: str = "") -> tuple[str | None, str, list[str]]:
+    """
+    Extracts the visible text and link targets of a static page, decoding simple
+    atob() injections. Returns (text, "", links) on success or (None, reason, [])
+    when a real browser is needed.
+    """
+    text, scripts, external_scripts, links = _html_to_text(html)
+    # A script loaded from elsewhere may write the question in; only trackers the
+    # browser would block anyway are ignored
+    hosts = (urlsplit(urljoin(url, src)).hostname or "" for src in external_scripts)
+    if any(not host.endswith(RENDER_BLOCKED_HOSTS) for host in hosts):
+        return None, "external scripts", []
+    decoded_parts = []
+
+    for script in scripts:
+        for match in ATOB_INJECTION_PATTERN.finditer(script):
+            try:
+                payload = base64.b64decode(re.sub(r"\s+", "", match.group(3))).decode("utf-8")
+            except Exception:
+                return None, "undecodable atob payload", []
+            decoded_text, _, _, decoded_links = _html_to_text(payload)
+            decoded_parts.append(decoded_text)
+            links.extend(decoded_links)
+        remainder = ATOB_INJECTION_PATTERN.sub("", script)
+        if DOM_WRITE_PATTERN.search(remainder):
+            return None, "script writes to the DOM", []
+
+    text = "\n".join(part for part in [text, *decoded_parts] if part)
+    if not text.strip():
+        return None, "empty body", []
+    return text, "", links
+
+
+async def _fetch_static(url: str, timeout: float = 15) -> tuple[str | None, str, list[str]]:
+    """
+    Fetches a page over plain HTTP.
+    Returns (text, "", links) or (None, fallback reason, []).
+    """
+    try:
+        response = await request_with_retry("GET", url, timeout=timeout, retries=1)
+    except Exception as e:
+        return None, f"http error: {type(e).__name__}", []
+    if response.status_code >= 400:
+        return None, f"http status {response.status_code}", []
+
+    content_type = response.headers.get("content-type", "")
+    if "html" in content_type or not content_type:
+        return _render_static(response.text, str(response.url))
+    if content_type.startswith("text/"):
+        return (response.text, "", []) if response.text.strip() else (None, "empty body", [])
+    return None, f"unsupported content type {content_type}", []
+
+
+def _record_fetch_path(path: str, reason: str = ""):
+    PAGE_FETCH_STATS[path] += 1
+    if reason:
+        reasons = PAGE_FETCH_STATS["fallback_reasons"]
+        reasons[reason] = reasons.get(reason, 0) + 1
+
+
+def page_fetch_stats() -> dict:
+    total = PAGE_FETCH_STATS["http"] + PAGE_FETCH_STATS["browser"]
+    return {
+        **PAGE_FETCH_STATS,
+        "http_hit_rate": PAGE_FETCH_STATS["http"] / total if total else 0.0,
+        "render_profile": RENDER_PROFILE,
+        "render": RENDER_STATS,
+    }
+
+
+def _blocked(request) -> bool:
+    if request.resource_type in RENDER_BLOCKED_RESOURCES:
+        return True
+    host = urlsplit(request.url).hostname or ""
+    return any(host == h or host.endswith("." + h) for h in RENDER_BLOCKED_HOSTS)
+
+
+async def _first_of(*coros):
+    """Runs the waits side by side and returns the index of the first to succeed, or None."""
+    tasks = [asyncio.ensure_future(c) for c in coros]
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return tasks.index(task)
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _render_lean(page, url: str, timeout: float) -> tuple[str, dict]:
+    """
+    Loads the page with unneeded resources blocked, waits for domcontentloaded and
+    then for whichever comes first: the submit instruction appearing, network idle
+    or stable body text. Returns the body text and this page's request stats.
+    """
+    stats = {"requests": 0, "bytes": 0, "requests_blocked": 0}
+
+    async def route(route):
+        if _blocked(route.request):
+            stats["requests_blocked"] += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def on_finished(request):
+        stats["requests"] += 1
+        try:
+            sizes = await request.sizes()
+        except Exception:
+            # The page may be closed before the sizes are in
+            return
+        stats["bytes"] += sizes["responseHeadersSize"] + sizes["responseBodySize"]
+
+    await page.route("**/*", route)
+    page.on("requestfinished", on_finished)
+    await page.goto(url, wait_until="domcontentloaded", timeout=timeout * 1000)
+
+    wait_ms = min(30, timeout) * 1000
+    settle = (
+        page.wait_for_load_state("networkidle", timeout=wait_ms) if RENDER_WAIT == "networkidle"
+        else asyncio.wait_for(page.evaluate(CONTENT_STABLE_CHECK, RENDER_STABLE_MS), wait_ms / 1000)
+    )
+    winner = await _first_of(page.wait_for_function(SUBMIT_TEXT_CHECK, timeout=wait_ms), settle)
+    stats["finished_on"] = {0: "submit_text", 1: RENDER_WAIT}.get(winner, "timeout")
+    return await page.inner_text("body"), stats
+
+
+def _record_render(stats: dict):
+    RENDER_STATS["pages"] += 1
+    for key in ("requests", "bytes", "requests_blocked"):
+        RENDER_STATS[key] += stats[key]
+    finished = RENDER_STATS["finished_on"]
+    finished[stats["finished_on"]] = finished.get(stats["finished_on"], 0) + 1
+
+
+def _absolute_links(base_url: str, links: list[str]) -> list[str]:
+    """Resolves link targets against the page URL, dropping fragments and duplicates."""
+    resolved = []
+    for link in links:
+        if not link or link.startswith(("#", "javascript:", "mailto:", "data:")):
+            continue
+        absolute = urljoin(base_url, link.strip()).split("#", 1)[0]
+        if absolute not in resolved:
+            resolved.append(absolute)
+    return resolved
+
 
-            await page.goto(url, timeout=60000)
-            await page.wait_for_selector("body", state="visible", timeout=30000)
+async def _render_in_browser(url: str, timeout: float) -> tuple[str, list[str]]:
+    """Renders a page in a pooled browser context and returns its body text and link targets."""
+    async with BROWSER_POOL.page() as page:
+        with span("page_load", path="browser", profile=RENDER_PROFILE) as tags:
+            if RENDER_PROFILE == "lean":
+                text, render_stats = await _render_lean(page, url, timeout)
+                _record_render(render_stats)
+                tags.update(render_stats)
+                logger.info(
+                    "Rendered with %d requests (%d bytes); blocked %d; finished on %s",
+                    render_stats["requests"], render_stats["bytes"], render_stats["requests_blocked"],
+                    render_stats["finished_on"]
+                )
+            else:
+                await page.goto(url, timeout=timeout * 1000)
+                await page.wait_for_selector("body", state="visible", timeout=min(30, timeout) * 1000)
+                text = await page.inner_text("body")
+        links = await page.eval_on_selector_all(LINK_SELECTOR, LINK_TARGETS_SCRIPT)
+    return text, links
 
-            quiz_instructions = await page.inner_text("body")
 
-            submit_match = re.search(
-                r"Post your answer to (https?://[^\s\"]+)",
-                quiz_instructions,
-                re.IGNORECASE
-            )
+async def get_quiz_details(url: str, timeout: float = 60) -> tuple[str, str, list[str]]:
+    """
+    Fetches the quiz page's instructions, submit URL and absolute link targets
+    (recorded/replayed by recorder).
+    """
+    result = await intercept("page", url, lambda: _get_quiz_details(url, timeout))
+    return result[0], result[1], list(result[2])
+
+
+async def _get_quiz_details(url: str, timeout: float = 60) -> tuple[str, str, list[str]]:
+    """
+    Async version.
+    Tries a plain HTTP fetch first and only loads the quiz page in a pooled
+    Playwright chromium context when the page needs JavaScript rendering.
+    Extracts visible instructions + the submit URL + the links on the page.
+    """
+    logger.info("Visiting quiz URL: %s", url)
+    quiz_instructions = "ERROR: Could not retrieve quiz instructions."
+    submit_url = ""
+    links = []
+
+    if STATIC_FETCH_ENABLED:
+        with span("page_load", path="http"):
+            text, reason, links = await _fetch_static(url, timeout=min(15, timeout))
+        if text is not None:
+            submit_match = SUBMIT_URL_PATTERN.search(text)
             if submit_match:
-                submit_url = submit_match.group(1).strip()
+                _record_fetch_path("http")
+                logger.info("Fast path (HTTP) hit, no rendering needed")
+                return text, submit_match.group(1).strip(), _absolute_links(url, links)
+            reason = "no submit URL found"
+        _record_fetch_path("browser", reason)
+        logger.info("Falling back to Playwright (%s)", reason)
 
-            await browser.close()
+    try:
+        quiz_instructions, links = await _render_in_browser(url, timeout)
+        submit_match = SUBMIT_URL_PATTERN.search(quiz_instructions)
+        if submit_match:
+            submit_url = submit_match.group(1).strip()
 
     except Exception as e:
-        print(f"Browser Agent Error: {e}")
+        logger.error("Browser error: %s", e)
         quiz_instructions = f"ERROR during browser operation: {e}"
 
-    return quiz_instructions, submit_url
+    return quiz_instructions, submit_url, _absolute_links(url, links)
 
 
-async def download_file(url: str, save_path: str) -> bool:
-    """Async version of file downloader."""
-    print(f"-> Browser: Downloading file from: {url}")
+async def get_page_text(url: str, timeout: float = 30) -> tuple[str, list[str]]:
+    """
+    Fetches a linked sub-page's visible text and absolute link targets, over plain
+    HTTP when possible (recorded/replayed by recorder). Raises if it can't be loaded.
+    """
+    async def fetch() -> tuple[str, list[str]]:
+        if STATIC_FETCH_ENABLED:
+            text, _, links = await _fetch_static(url, timeout=min(15, timeout))
+            if text is not None:
+                return text, _absolute_links(url, links)
+        text, links = await _render_in_browser(url, timeout)
+        return text, _absolute_links(url, links)
 
-    try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
+    result = await intercept("subpage", url, fetch)
+    return result[0], list(result[1])
 
-            # Start download listener BEFORE navigation
-            async with page.expect_download() as download_info:
-                await page.goto(url, timeout=60000)
 
-            download = await download_info.value
-            await download.save_as(save_path)
+def sniff_file_format(head: bytes, content_type: str = "", url: str = "") -> str:
+    """Picks the file format from magic bytes, then Content-Type, then the URL extension."""
+    if head.startswith(b"%PDF"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "xlsx"
+    if head.startswith(b"\xd0\xcf\x11\xe0"):
+        return "xls"
 
-            await browser.close()
-            return True
+    mime = content_type.split(";")[0].strip().lower()
+    if mime in CONTENT_TYPE_FORMATS and CONTENT_TYPE_FORMATS[mime] != "txt":
+        return CONTENT_TYPE_FORMATS[mime]
 
+    ext_match = re.search(r"\.([A-Za-z0-9]+)(?:[?#]|$)", url)
+    extension = ext_match.group(1).lower() if ext_match else ""
+    if extension in ("pdf", "csv", "json", "xlsx", "xls", "txt"):
+        return extension
+    # The CSV reader sniffs the delimiter, and NDJSON is read by the JSON path
+    if extension in ("tsv", "ndjson"):
+        return "csv" if extension == "tsv" else "json"
+
+    stripped = head.lstrip()
+    if stripped[:1] in (b"{", b"["):
+        return "json"
+    return "txt"
+
+
+async def _stream_download(url: str, save_path: str, timeout: float = 60) -> str:
+    """
+    Streams `url` to `save_path` in chunks and returns the sniffed file format.
+    Dropped connections are resumed with a Range request when the server allows it.
+    """
+    client = get_http_client()
+    written = 0
+    head = b""
+    content_type = ""
+    attempt = 0
+
+    with open(save_path, "wb") as f:
+        while True:
+            headers = {"Range": f"bytes={written}-"} if written else {}
+            try:
+                async with host_slot(url), client.stream(
+                    "GET", url, headers=headers, timeout=timeout, extensions=trace_extensions()
+                ) as response:
+                    if response.status_code in (401, 403):
+                        raise BrowserRequiredError(f"HTTP {response.status_code}")
+                    response.raise_for_status()
+
+                    if written and response.status_code != 206:
+                        # Server ignored the Range header, start over
+                        f.seek(0)
+                        f.truncate()
+                        written = 0
+                        head = b""
+                    if not written:
+                        content_type = response.headers.get("content-type", "")
+                        if "text/html" in content_type:
+                            page = b""
+                            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                                page += chunk
+                                break
+                            if JS_REQUIRED_PATTERN.search(page.decode("utf-8", errors="replace")):
+                                raise BrowserRequiredError("page needs JavaScript to serve the file")
+                            raise ValueError("got an HTML page instead of a file")
+
+                    declared = int(response.headers.get("content-length") or 0)
+                    if declared + written > DOWNLOAD_MAX_BYTES:
+                        raise DownloadTooLargeError(f"{declared + written} bytes exceeds {DOWNLOAD_MAX_BYTES}")
+
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        written += len(chunk)
+                        if written > DOWNLOAD_MAX_BYTES:
+                            raise DownloadTooLargeError(f"download exceeds {DOWNLOAD_MAX_BYTES} bytes")
+                        if len(head) < 512:
+                            head += chunk[:512 - len(head)]
+                        f.write(chunk)
+                break
+            except httpx.TransportError as e:
+                attempt += 1
+                if attempt > DOWNLOAD_RETRIES:
+                    raise
+                logger.warning("Connection dropped at %d bytes (%s), resuming (attempt %d)", written, e, attempt)
+                await asyncio.sleep(0.5 * attempt)
+
+    logger.info("Streamed %d bytes over HTTP", written, extra={"bytes": written})
+    return sniff_file_format(head, content_type, url)
+
+
+async def _browser_download(url: str, save_path: str, timeout: float = 60) -> str:
+    async with BROWSER_POOL.page() as page:
+        # Start download listener BEFORE navigation
+        async with page.expect_download(timeout=timeout * 1000) as download_info:
+            await page.goto(url, timeout=timeout * 1000)
+
+        download = await download_info.value
+        await download.save_as(save_path)
+
+    with open(save_path, "rb") as f:
+        head = f.read(512)
+    return sniff_file_format(head, url=download.suggested_filename or url)
+
+
+async def download_file(url: str, save_path: str, timeout: float = 60) -> str | None:
+    """
+    Downloads `url` to `save_path` and returns its format. Files are shared with
+    other chains and workers through ARTIFACT_CACHE; cache hits are recorded and
+    replayed by recorder like real downloads.
+    """
+    return await intercept("download", url, lambda: _cached_download(url, save_path, timeout), file_path=save_path)
+
+
+async def _cached_download(url: str, save_path: str, timeout: float) -> str | None:
+    cached = await asyncio.to_thread(ARTIFACT_CACHE.get, url)
+    if cached is not None:
+        await asyncio.to_thread(copy_artifact, cached[0], save_path)
+        return cached[1]["format"]
+    file_format = await _download_file(url, save_path, timeout)
+    if file_format:
+        await asyncio.to_thread(ARTIFACT_CACHE.put, url, save_path, {"format": file_format})
+    return file_format
+
+
+async def _download_file(url: str, save_path: str, timeout: float = 60) -> str | None:
+    """
+    Async version of file downloader.
+    Streams the file over HTTP and only drives the browser for URLs that need
+    cookies or JavaScript (401/403, or an HTML page asking for JavaScript).
+    Other failures such as 404, 5xx or an HTML page return at once: the browser
+    would get no download either and wait out the whole timeout.
+    Returns the detected file format, or None on failure.
+    """
+    logger.info("Downloading file from: %s", url)
+
+    try:
+        return await _stream_download(url, save_path, timeout)
+    except BrowserRequiredError as e:
+        logger.warning("HTTP download refused (%s), falling back to Playwright", e)
+    except Exception as e:
+        logger.error("Download failed: %s", e)
+        return None
+
+    try:
+        return await _browser_download(url, save_path, timeout)
     except Exception as e:
-        print(f"Download Error: {e}")
-        return False
+        logger.error("Download failed: %s", e)
+        return None
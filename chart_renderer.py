@@ -0,0 +1,157 @@
+# Draws chart specs locally for VISUALIZE quizzes. The table is reduced to the
+# plotted values in-process (compute_engine.chart_data); matplotlib then renders
+# them in a small process pool, off the event loop, into a base64 data URI that
+# fits the submit payload. Renders are cached by spec and data hash.
+
+import io
+import os
+import json
+import base64
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from shared_state import ARTIFACT_CACHE, per_worker
+from telemetry import get_logger
+
+logger = get_logger("chart_renderer")
+
+CHART_FORMAT = os.getenv("CHART_FORMAT", "png").lower()  # png | svg
+CHART_WIDTH = float(os.getenv("CHART_WIDTH", "6.4"))  # inches
+CHART_HEIGHT = float(os.getenv("CHART_HEIGHT", "4.0"))
+CHART_DPI = int(os.getenv("CHART_DPI", "100"))
+# Longest data URI to submit; PNGs are re-rendered at lower resolution until they fit
+CHART_MAX_URI_CHARS = int(os.getenv("CHART_MAX_URI_CHARS", str(500 * 1024)))
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", str(min(2, per_worker(os.cpu_count() or 1)))))
+CHART_STYLE_KEYS = ("type", "title", "xlabel", "ylabel", "x", "y")
+MIME_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+_CHART_POOL: ProcessPoolExecutor | None = None
+_STATS = {"renders": 0, "cache_hits": 0, "failures": 0}
+
+
+class ChartError(Exception):
+    """Raised when a chart cannot be drawn within the size limit."""
+
+
+def _draw(ax, chart: dict, data: dict):
+    chart_type = chart.get("type") or "bar"
+    series = data["series"]
+    if chart_type == "hist":
+        edges = data["edges"]
+        for name, counts in series.items():
+            ax.stairs(counts, edges, fill=len(series) == 1, label=name, alpha=0.8)
+        return
+    labels = data["labels"]
+    if chart_type == "pie":
+        name, values = next(iter(series.items()))
+        ax.pie(values, labels=[str(label) for label in labels], autopct="%1.1f%%")
+        ax.axis("equal")
+        return
+    categorical = chart_type in ("bar", "barh") or any(isinstance(label, str) for label in labels)
+    positions = list(range(len(labels))) if categorical else labels
+    width = 0.8 / len(series)
+    for i, (name, values) in enumerate(series.items()):
+        if chart_type == "bar":
+            ax.bar([p + (i - (len(series) - 1) / 2) * width for p in positions], values, width=width, label=name)
+        elif chart_type == "barh":
+            ax.barh([p + (i - (len(series) - 1) / 2) * width for p in positions], values, height=width, label=name)
+        elif chart_type == "scatter":
+            ax.scatter(positions, values, label=name, s=12)
+        else:
+            ax.plot(positions, values, label=name, marker="o" if len(values) <= 50 else None)
+    if categorical:
+        ticks = [str(label) for label in labels]
+        if chart_type == "barh":
+            ax.set_yticks(positions, ticks)
+        else:
+            ax.set_xticks(positions, ticks, rotation=45 if len(ticks) > 6 else 0, ha="right" if len(ticks) > 6 else "center")
+
+
+def _render(chart: dict, data: dict, fmt: str) -> str:
+    # Runs in a worker process: matplotlib is only ever imported there
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    for dpi in (CHART_DPI, int(CHART_DPI * 0.75), CHART_DPI // 2):
+        fig, ax = plt.subplots(figsize=(CHART_WIDTH, CHART_HEIGHT))
+        try:
+            _draw(ax, chart, data)
+            ax.set_title(chart.get("title") or "")
+            if chart.get("type") != "pie":
+                ax.set_xlabel(chart.get("xlabel") or (chart.get("x") if isinstance(chart.get("x"), str) else "") or "")
+                ax.set_ylabel(chart.get("ylabel") or (chart.get("y") if isinstance(chart.get("y"), str) else "") or "")
+            if len(data["series"]) > 1:
+                ax.legend()
+            fig.tight_layout()
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format=fmt, dpi=dpi)
+        finally:
+            plt.close(fig)
+        uri = f"data:{MIME_TYPES[fmt]};base64,{base64.b64encode(buffer.getvalue()).decode('ascii')}"
+        if len(uri) <= CHART_MAX_URI_CHARS or fmt == "svg":
+            break
+    if len(uri) > CHART_MAX_URI_CHARS:
+        raise ChartError(f"Rendered chart is {len(uri)} characters, over the {CHART_MAX_URI_CHARS} limit")
+    return uri
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _CHART_POOL
+    if _CHART_POOL is None:
+        _CHART_POOL = ProcessPoolExecutor(max_workers=max(1, CHART_WORKERS))
+    return _CHART_POOL
+
+
+def shutdown_chart_pool():
+    global _CHART_POOL
+    if _CHART_POOL is not None:
+        _CHART_POOL.shutdown(cancel_futures=True)
+        _CHART_POOL = None
+
+
+def _cache_key(chart: dict, data: dict, fmt: str) -> str:
+    payload = json.dumps({"chart": chart, "data": data, "format": fmt,
+                          "size": [CHART_WIDTH, CHART_HEIGHT, CHART_DPI]}, sort_keys=True, default=str)
+    return "chart:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def render_chart(df, spec: dict) -> str:
+    """Renders a chart spec over `df` (or the spec's inline data) into a data URI."""
+    from compute_engine import chart_data
+    data = await asyncio.to_thread(chart_data, df, spec)
+    chart = {key: spec.get(key) for key in CHART_STYLE_KEYS}
+    fmt = (spec.get("format") or CHART_FORMAT).lower()
+    if fmt not in MIME_TYPES:
+        fmt = CHART_FORMAT
+
+    key = _cache_key(chart, data, fmt)
+    cached = await asyncio.to_thread(ARTIFACT_CACHE.get, key)
+    if cached is not None:
+        try:
+            with open(cached[0], encoding="ascii") as f:
+                _STATS["cache_hits"] += 1
+                return f.read()
+        except OSError:
+            pass
+
+    try:
+        uri = await asyncio.get_running_loop().run_in_executor(_get_pool(), _render, chart, data, fmt)
+    except Exception:
+        _STATS["failures"] += 1
+        raise
+    _STATS["renders"] += 1
+    logger.info("Rendered %s chart (%d characters)", chart.get("type") or "bar", len(uri))
+    await asyncio.to_thread(ARTIFACT_CACHE.put_bytes, key, uri.encode("ascii"), {"format": fmt})
+    return uri
+
+
+async def warm_chart_pool():
+    """Starts a renderer process and imports matplotlib in it."""
+    await asyncio.get_running_loop().run_in_executor(
+        _get_pool(), _render, {"type": "bar"}, {"labels": ["a"], "series": {"v": [1]}}, "png"
+    )
+
+
+def chart_stats() -> dict:
+    return {**_STATS, "workers": CHART_WORKERS, "format": CHART_FORMAT}
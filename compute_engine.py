@@ -0,0 +1,262 @@
+# Executes small structured operation specs over a parsed table with pandas,
+# so the LLM only has to describe the computation instead of doing the arithmetic.
+
+import numpy as np
+import pandas as pd
+
+SAMPLE_ROWS = 5
+
+FILTER_OPS = {
+    "==": lambda s, v: s == v,
+    "!=": lambda s, v: s != v,
+    ">": lambda s, v: s > v,
+    ">=": lambda s, v: s >= v,
+    "<": lambda s, v: s < v,
+    "<=": lambda s, v: s <= v,
+    "in": lambda s, v: s.isin(v if isinstance(v, list) else [v]),
+    "not_in": lambda s, v: ~s.isin(v if isinstance(v, list) else [v]),
+    "contains": lambda s, v: s.astype(str).str.contains(str(v), case=False, regex=False),
+    "startswith": lambda s, v: s.astype(str).str.startswith(str(v)),
+    "isnull": lambda s, v: s.isna(),
+    "notnull": lambda s, v: s.notna(),
+}
+AGG_FUNCS = {"sum", "mean", "median", "min", "max", "count", "nunique", "std", "var", "first", "last"}
+CHART_TYPES = {"bar", "barh", "line", "scatter", "pie", "hist"}
+# Points per series handed to the renderer; more would not be readable anyway
+CHART_MAX_POINTS = 2000
+
+
+class SpecError(Exception):
+    """Raised when an operation spec is malformed or refers to unknown columns."""
+
+
+def execute_spec_on_profiles(profiles: dict, spec: dict):
+    """
+    Answers a plain whole-column aggregate (no filters or grouping) from the
+    running aggregates computed during ingestion. Returns None if it can't.
+    """
+    aggregate = spec.get("aggregate") if isinstance(spec, dict) else None
+    if not aggregate or spec.get("filters") or spec.get("group_by"):
+        return None
+    func = aggregate.get("func", "sum")
+    column = aggregate.get("column")
+    if column is None:
+        return None if func != "count" else _to_python(max(p.count for p in profiles.values()))
+    matches = {str(name).strip().lower(): p for name, p in profiles.items()}
+    profile = profiles.get(column) or matches.get(str(column).strip().lower())
+    if profile is None:
+        return None
+    value = profile.aggregate(func)
+    return None if value is None else _to_python(value)
+
+
+def table_from_rows(rows: list[list[str]]) -> pd.DataFrame:
+    """Builds a DataFrame from extracted table rows (header first), typing numeric columns."""
+    header = [str(h) for h in rows[0]]
+    df = pd.DataFrame(rows[1:], columns=header)
+    for column in df.columns:
+        df[column] = _coerce_numeric(df, column)
+    return df
+
+
+def describe_table(df: pd.DataFrame) -> str:
+    """Compact schema plus a few sample rows, the only part of the file sent to the LLM."""
+    lines = [f"ROWS: {len(df)}", "COLUMNS:"]
+    for column in df.columns:
+        series = df[column]
+        line = f"- {column} ({series.dtype}, {series.notna().sum()} non-null"
+        if pd.api.types.is_numeric_dtype(series) and series.notna().any():
+            line += f", min={series.min()}, max={series.max()}"
+        elif series.nunique() <= 10:
+            line += f", values={sorted(map(str, series.dropna().unique()))}"
+        lines.append(line + ")")
+    lines.append(f"SAMPLE ({min(SAMPLE_ROWS, len(df))} rows):")
+    lines.append(df.head(SAMPLE_ROWS).to_csv(index=False).strip())
+    return "\n".join(lines)
+
+
+def _column(df: pd.DataFrame, name) -> str:
+    if name in df.columns:
+        return name
+    # Tolerate case/whitespace differences in column names from the LLM
+    normalized = {str(c).strip().lower(): c for c in df.columns}
+    key = str(name).strip().lower()
+    if key in normalized:
+        return normalized[key]
+    raise SpecError(f"Unknown column: {name}")
+
+
+def _coerce_numeric(df: pd.DataFrame, column: str) -> pd.Series:
+    series = df[column]
+    if not pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        cleaned = pd.to_numeric(series.astype(str).str.replace(r"[,$%\s]", "", regex=True), errors="coerce")
+        if cleaned.notna().sum() >= series.notna().sum() * 0.9:
+            return cleaned
+    return series
+
+
+def _to_python(value):
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (np.floating, float)):
+        value = float(value)
+        return int(value) if value.is_integer() else round(value, 10)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {str(k): _to_python(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_python(v) for v in value]
+    return value
+
+
+def _apply_filters(df: pd.DataFrame, filters: list | None) -> pd.DataFrame:
+    for condition in filters or []:
+        column = _column(df, condition.get("column"))
+        op = condition.get("op", "==")
+        if op not in FILTER_OPS:
+            raise SpecError(f"Unknown filter op: {op}")
+        value = condition.get("value")
+        series = df[column]
+        if op in (">", ">=", "<", "<=") or isinstance(value, (int, float)):
+            series = _coerce_numeric(df, column)
+        df = df[FILTER_OPS[op](series, value).fillna(False)]
+    return df
+
+
+def execute_spec(df: pd.DataFrame, spec: dict):
+    """
+    Runs an operation spec of the form:
+        {"filters": [{"column", "op", "value"}], "group_by": [...],
+         "aggregate": {"column", "func"}, "sort": {"by", "ascending"},
+         "limit": N, "return": "value" | "column" | "rows" | "key", "select": column}
+    and returns a plain Python value ready to submit.
+    """
+    if not isinstance(spec, dict):
+        raise SpecError("Spec must be a JSON object")
+    df = _apply_filters(df.copy(), spec.get("filters"))
+
+    aggregate = spec.get("aggregate")
+    group_by = [_column(df, c) for c in (spec.get("group_by") or [])]
+    result_kind = spec.get("return", "value")
+
+    if aggregate:
+        func = aggregate.get("func", "sum")
+        if func not in AGG_FUNCS:
+            raise SpecError(f"Unknown aggregate func: {func}")
+        agg_column = aggregate.get("column")
+        if agg_column is None and func == "count":
+            values = df.groupby(group_by).size() if group_by else len(df)
+        else:
+            agg_column = _column(df, agg_column)
+            df[agg_column] = _coerce_numeric(df, agg_column) if func not in ("first", "last", "nunique", "count") else df[agg_column]
+            values = df.groupby(group_by)[agg_column].agg(func) if group_by else df[agg_column].agg(func)
+
+        if not group_by:
+            return _to_python(values)
+
+        values = values.rename("value").reset_index()
+        sort = spec.get("sort")
+        if sort:
+            by = sort.get("by", "value")
+            by = "value" if by in ("value", agg_column) else _column(values, by)
+            values = values.sort_values(by, ascending=sort.get("ascending", True), kind="mergesort")
+        if spec.get("limit"):
+            values = values.head(int(spec["limit"]))
+        if result_kind == "key":
+            keys = values[group_by[0]].tolist() if len(group_by) == 1 else values[group_by].values.tolist()
+            return _to_python(keys[0] if spec.get("limit") == 1 else keys)
+        if result_kind == "value" and len(values) == 1:
+            return _to_python(values["value"].iloc[0])
+        if len(group_by) == 1:
+            return _to_python(dict(zip(values[group_by[0]], values["value"])))
+        return _to_python(values.to_dict(orient="records"))
+
+    sort = spec.get("sort")
+    if sort:
+        df = df.sort_values(_column(df, sort.get("by")), ascending=sort.get("ascending", True), kind="mergesort")
+    if spec.get("limit"):
+        df = df.head(int(spec["limit"]))
+
+    select = spec.get("select")
+    if result_kind == "rows":
+        columns = [_column(df, c) for c in select] if isinstance(select, list) else list(df.columns)
+        return _to_python(df[columns].to_dict(orient="records"))
+    if select is None:
+        if result_kind == "value" and len(df) == 1 and len(df.columns) == 1:
+            return _to_python(df.iloc[0, 0])
+        return len(df)
+    values = df[_column(df, select)].tolist()
+    if result_kind == "value" and len(values) == 1:
+        return _to_python(values[0])
+    return _to_python(values)
+
+
+def chart_data(df: pd.DataFrame | None, spec: dict) -> dict:
+    """
+    Reduces a table to the values a chart spec plots:
+        {"type", "x", "y": column or list, "filters": [...], "aggregate": func,
+         "sort": {"by": "x" | "y", "ascending"}, "limit": N, "bins": N,
+         "data": {"columns": [...], "rows": [[...]]}}
+    `aggregate` groups by `x` (with no `y` it counts rows); "hist" bins the `y`
+    columns. Without a table, values come from the spec's own "data".
+    Returns {"labels": [...], "series": {name: [values]}} ("edges" instead of
+    "labels" for histograms), small enough to send to a renderer process.
+    """
+    if not isinstance(spec, dict):
+        raise SpecError("Chart spec must be a JSON object")
+    chart_type = spec.get("type", "bar")
+    if chart_type not in CHART_TYPES:
+        raise SpecError(f"Unknown chart type: {chart_type}")
+    if df is None:
+        inline = spec.get("data") or {}
+        if not inline.get("columns") or not inline.get("rows"):
+            raise SpecError("No table to chart and no inline data in the spec")
+        df = table_from_rows([inline["columns"]] + inline["rows"])
+    df = _apply_filters(df.copy(), spec.get("filters"))
+
+    y = spec.get("y")
+    ys = [_column(df, c) for c in ([y] if isinstance(y, str) else (y or []))]
+    if chart_type == "hist":
+        if not ys:
+            raise SpecError("A histogram needs a y column")
+        values = {c: _coerce_numeric(df, c).dropna().to_numpy(dtype=float) for c in ys}
+        edges = np.histogram_bin_edges(np.concatenate(list(values.values())), bins=int(spec.get("bins") or 10))
+        return {
+            "edges": _to_python(edges.tolist()),
+            "series": {str(c): _to_python(np.histogram(v, bins=edges)[0].tolist()) for c, v in values.items()},
+        }
+
+    x = _column(df, spec["x"]) if spec.get("x") is not None else None
+    func = spec.get("aggregate")
+    if func:
+        if func not in AGG_FUNCS:
+            raise SpecError(f"Unknown aggregate func: {func}")
+        if x is None:
+            raise SpecError("Aggregating needs an x column to group by")
+        if not ys:
+            table = df.groupby(x).size().rename("count").reset_index()
+            ys = ["count"]
+        else:
+            for c in ys:
+                if func not in ("first", "last", "nunique", "count"):
+                    df[c] = _coerce_numeric(df, c)
+            table = df.groupby(x)[ys].agg(func).reset_index()
+    else:
+        if not ys:
+            raise SpecError("A chart needs a y column")
+        table = df[([x] if x else []) + ys].copy()
+        for c in ys:
+            table[c] = _coerce_numeric(table, c)
+
+    sort = spec.get("sort")
+    if sort:
+        by = sort.get("by", "y")
+        column = x if by == "x" and x else ys[0] if by in ("y", "value") else _column(table, by)
+        table = table.sort_values(column, ascending=sort.get("ascending", True), kind="mergesort")
+    table = table.head(min(int(spec.get("limit") or CHART_MAX_POINTS), CHART_MAX_POINTS))
+
+    labels = table[x].tolist() if x else list(range(1, len(table) + 1))
+    return {"labels": _to_python(labels), "series": {str(c): _to_python(table[c].tolist()) for c in ys}}
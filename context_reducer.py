@@ -0,0 +1,140 @@
+# Shrinks large data blobs to a token budget before they are pasted into a prompt.
+# Chunks are ranked against the instruction with BM25, and chunks holding the
+# numbers or quoted terms the question mentions are always kept.
+
+import os
+import re
+import math
+from collections import Counter
+from telemetry import get_logger
+
+logger = get_logger("context_reducer")
+
+LLM_CONTEXT_TOKEN_BUDGET = int(os.getenv("LLM_CONTEXT_TOKEN_BUDGET", "6000"))
+CHUNK_TOKENS = int(os.getenv("CONTEXT_CHUNK_TOKENS", "200"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _ENCODING = None
+
+WORD_PATTERN = re.compile(r"[A-Za-z0-9_]+(?:\.[0-9]+)?")
+NUMBER_PATTERN = re.compile(r"-?\d[\d,]*(?:\.\d+)?")
+QUOTED_PATTERN = re.compile(r"[\"“'‘]([^\"”'’]{2,60})[\"”'’]")
+STOPWORDS = {
+    "the", "a", "an", "of", "in", "on", "to", "and", "or", "is", "are", "what", "which",
+    "for", "with", "by", "as", "at", "from", "this", "that", "be", "it", "your", "you",
+    "answer", "output", "only", "value", "final", "based", "provided", "data",
+}
+
+REDUCER_STATS = {"calls": 0, "reduced_calls": 0, "tokens_sent": 0, "tokens_saved": 0}
+
+
+def estimate_tokens(text: str) -> int:
+    """Exact count with tiktoken when installed, otherwise ~4 characters per token."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def _terms(text: str) -> list[str]:
+    return [t for t in (w.lower() for w in WORD_PATTERN.findall(text)) if t not in STOPWORDS]
+
+
+def _chunks(data: str, chunk_tokens: int) -> list[str]:
+    """Splits on lines, packing consecutive lines into chunks of about `chunk_tokens`."""
+    chunks, current, size = [], [], 0
+    for line in data.splitlines(keepends=True):
+        line_tokens = estimate_tokens(line)
+        if current and size + line_tokens > chunk_tokens:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += line_tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def _bm25_scores(chunks: list[str], query_terms: list[str]) -> list[float]:
+    docs = [Counter(_terms(chunk)) for chunk in chunks]
+    lengths = [sum(doc.values()) for doc in docs]
+    average = (sum(lengths) / len(lengths)) or 1.0
+    n = len(docs)
+    query = set(query_terms)
+    doc_freq = Counter(term for doc in docs for term in query if term in doc)
+    idf = {term: math.log(1 + (n - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5)) for term in query}
+    scores = []
+    for doc, length in zip(docs, lengths):
+        score = 0.0
+        for term in query:
+            tf = doc.get(term, 0)
+            if not tf:
+                continue
+            score += idf[term] * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average))
+        scores.append(score)
+    return scores
+
+
+def _pinned_patterns(instruction: str) -> list[re.Pattern]:
+    """Numbers and quoted phrases from the question that must survive the reduction."""
+    numbers = [n.replace(",", "") for n in NUMBER_PATTERN.findall(instruction)]
+    quoted = [q.strip().lower() for q in QUOTED_PATTERN.findall(instruction)]
+    patterns = [re.compile(rf"(?<![\d.]){re.escape(n)}(?![\d])") for n in numbers if n.strip("-")]
+    patterns += [re.compile(re.escape(q)) for q in quoted if q]
+    return patterns
+
+
+def reduce_context(data: str, instruction: str, budget: int = LLM_CONTEXT_TOKEN_BUDGET) -> tuple[str, dict]:
+    """
+    Returns `data` unchanged if it fits `budget` tokens, otherwise the most
+    relevant chunks in their original order. Also returns per-call token stats.
+    """
+    total = estimate_tokens(data)
+    REDUCER_STATS["calls"] += 1
+    if total <= budget:
+        REDUCER_STATS["tokens_sent"] += total
+        return data, {"tokens_sent": total, "tokens_saved": 0}
+
+    chunks = _chunks(data, CHUNK_TOKENS)
+    sizes = [estimate_tokens(chunk) for chunk in chunks]
+    scores = _bm25_scores(chunks, _terms(instruction))
+
+    pinned = _pinned_patterns(instruction)
+    lowered = [chunk.lower().replace(",", "") for chunk in chunks]
+    is_pinned = [any(p.search(text) for p in pinned) for text in lowered]
+
+    # The first chunk usually carries titles or table headers, so it ranks with the pinned ones
+    order = sorted(
+        range(len(chunks)),
+        key=lambda i: (not is_pinned[i], i != 0, -scores[i], i)
+    )
+    selected, used = set(), 0
+    for i in order:
+        if used + sizes[i] > budget:
+            continue
+        selected.add(i)
+        used += sizes[i]
+
+    if not selected:
+        # Even the best chunk is over budget on its own: send a truncated slice of it
+        best = order[0]
+        reduced = chunks[best][:budget * 4]
+    else:
+        reduced = "".join(
+            chunks[i] if i in selected else ("[...]\n" if i - 1 in selected else "")
+            for i in range(len(chunks))
+        )
+    sent = estimate_tokens(reduced)
+    REDUCER_STATS["reduced_calls"] += 1
+    REDUCER_STATS["tokens_sent"] += sent
+    REDUCER_STATS["tokens_saved"] += total - sent
+    logger.info("Kept %d/%d chunks, %d of %d tokens", len(selected), len(chunks), sent, total)
+    return reduced, {"tokens_sent": sent, "tokens_saved": total - sent}
+
+
+def reducer_stats() -> dict:
+    return dict(REDUCER_STATS)
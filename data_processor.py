@@ -1,16 +1,162 @@
 # A simple utility for PDF extraction, a common task in such projects
 # Requires: pip install pypdf
 
-from pypdf import PdfReader
+import io
+import os
+import re
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from telemetry import get_logger
+from shared_state import per_worker
 
-def extract_text_from_pdf(filepath: str) -> str:
-    """Extracts text from all pages of a PDF and returns it as a single string."""
-    print(f"-> Processor: Extracting text from PDF: {filepath}")
-    text = ""
+logger = get_logger("data_processor")
+
+PAGE_SEPARATOR = "\n---\n"
+# Documents with more selected pages than this are extracted in a process pool
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+# Each uvicorn worker gets its own pool, sized from its share of the cores
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, per_worker(os.cpu_count() or 1)))))
+
+_PDF_POOL: ProcessPoolExecutor | None = None
+
+PAGE_RANGE_PATTERN = re.compile(
+    r"\bpages?\s+(\d+(?:\s*(?:-|–|to|through|,|and|&)\s*\d+)*)",
+    re.IGNORECASE
+)
+
+
+def parse_page_selection(instructions: str) -> list[int] | None:
+    """
+    Finds page references like "page 3", "pages 2-4" or "pages 1 and 5" in the
+    instructions. Returns sorted 1-based page numbers, or None for all pages.
+    """
+    pages = set()
+    for match in PAGE_RANGE_PATTERN.finditer(instructions):
+        for part in re.split(r"\s*(?:,|and|&)\s*", match.group(1)):
+            bounds = re.split(r"\s*(?:-|–|to|through)\s*", part.strip())
+            if len(bounds) == 2 and bounds[0].isdigit() and bounds[1].isdigit():
+                start, end = int(bounds[0]), int(bounds[1])
+                pages.update(range(min(start, end), max(start, end) + 1))
+            elif bounds[0].isdigit():
+                pages.add(int(bounds[0]))
+    pages.discard(0)
+    return sorted(pages) or None
+
+
+def _open_source(source) -> tuple[object, object | None]:
+    """Returns a seekable stream for a path, bytes or file object, plus anything to close."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source), None
+    if isinstance(source, str):
+        f = open(source, "rb")
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        return mapped, mapped
+    return source, None
+
+
+def _extract_pages(data: bytes, indices: list[int], layout: bool) -> list[str]:
+    # Runs in a worker process: each worker parses its own reader over the shared bytes
+    from pypdf import PdfReader
+    reader = PdfReader(io.BytesIO(data))
+    mode = {"extraction_mode": "layout"} if layout else {}
+    return [reader.pages[i].extract_text(**mode) or "" for i in indices]
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _PDF_POOL
+    if _PDF_POOL is None:
+        _PDF_POOL = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+    return _PDF_POOL
+
+
+def shutdown_pdf_pool():
+    global _PDF_POOL
+    if _PDF_POOL is not None:
+        _PDF_POOL.shutdown(cancel_futures=True)
+        _PDF_POOL = None
+
+
+def _page_texts(source, pages: list[int] | None, layout: bool = False) -> list[tuple[int, str]]:
+    # pypdf is imported on first use (or by the startup warm-up), not at startup
+    from pypdf import PdfReader
+    stream, closer = _open_source(source)
+    try:
+        reader = PdfReader(stream)
+        total = len(reader.pages)
+        indices = [p - 1 for p in pages if 0 < p <= total] if pages else list(range(total))
+        if pages and not indices:
+            # Selection didn't match this document, fall back to every page
+            indices = list(range(total))
+
+        if len(indices) < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS <= 1:
+            mode = {"extraction_mode": "layout"} if layout else {}
+            texts = [reader.pages[i].extract_text(**mode) or "" for i in indices]
+        else:
+            stream.seek(0)
+            data = stream.read()
+            chunk = -(-len(indices) // PDF_WORKERS)
+            batches = [indices[i:i + chunk] for i in range(0, len(indices), chunk)]
+            texts = []
+            for batch_texts in _get_pool().map(_extract_pages, [data] * len(batches), batches, [layout] * len(batches)):
+                texts.extend(batch_texts)
+        return [(i + 1, text) for i, text in zip(indices, texts)]
+    finally:
+        if closer is not None:
+            closer.close()
+
+
+def _table_rows(text: str) -> list[list[list[str]]]:
+    """Groups consecutive layout lines with the same number of 2+-space separated cells into tables."""
+    tables, current = [], []
+    for line in text.splitlines():
+        cells = [c.strip() for c in re.split(r"\s{2,}|\t", line.strip()) if c.strip()]
+        if len(cells) >= 2 and (not current or len(cells) == len(current[0])):
+            current.append(cells)
+            continue
+        if len(current) >= 2:
+            tables.append(current)
+        current = [cells] if len(cells) >= 2 else []
+    if len(current) >= 2:
+        tables.append(current)
+    return tables
+
+
+def extract_tables_from_pdf(source, pages: list[int] | None = None) -> list[dict]:
+    """
+    Detects simple tables from layout-preserving extraction.
+    Returns [{"page": n, "rows": [[cell, ...], ...]}] with the header as the first row.
+    """
+    logger.info("Extracting tables from PDF")
+    try:
+        return [
+            {"page": page, "rows": rows}
+            for page, text in _page_texts(source, pages, layout=True)
+            for rows in _table_rows(text)
+        ]
+    except Exception as e:
+        logger.warning("Table extraction failed: %s", e)
+        return []
+
+
+def extract_text_from_pdf(source, pages: list[int] | None = None, tables: bool = False) -> str:
+    """
+    Extracts text from a PDF given as a path (memory-mapped), bytes or a file object
+    and returns it as a single string. `pages` limits extraction to those 1-based
+    pages; `tables` appends detected tables as tab-separated blocks.
+    """
+    label = source if isinstance(source, str) else "<memory>"
+    logger.info("Extracting text from PDF: %s%s", label, f" (pages {pages})" if pages else "")
     try:
-        reader = PdfReader(filepath)
-        for page in reader.pages:
-            text += page.extract_text() + "\n---\n" # Separator for page breaks
-        return text
+        page_texts = _page_texts(source, pages)
+        parts = [f"[Page {page}]\n{text}" if pages else text for page, text in page_texts]
+        if tables:
+            for table in extract_tables_from_pdf(source, pages):
+                block = "\n".join("\t".join(row) for row in table["rows"])
+                parts.append(f"[Table on page {table['page']}]\n{block}")
+        # Separator for page breaks
+        return PAGE_SEPARATOR.join(parts) + PAGE_SEPARATOR
     except Exception as e:
-        return f"ERROR: Could not process PDF at {filepath}. Reason: {e}"
\ No newline at end of file
+        return f"ERROR: Could not process PDF at {label}. Reason: {e}"
@@ -0,0 +1,88 @@
+import os
+import time
+import asyncio
+from telemetry import get_logger, span
+
+logger = get_logger("deadline")
+
+QUIZ_TIME_BUDGET = float(os.getenv("QUIZ_TIME_BUDGET", "180"))
+# Time kept back from every pre-submission stage so a best-effort answer can still be posted
+SUBMIT_RESERVE = float(os.getenv("SUBMIT_RESERVE", "10"))
+MIN_STAGE_TIMEOUT = 1.0
+
+STAGE_STATS: dict[str, dict] = {}
+
+
+class StageTimeout(asyncio.TimeoutError):
+    """Raised when a stage is cut short because its share of the budget ran out."""
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"{stage} cut short after {timeout:.1f}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+def _record_stage(stage: str, duration: float, timeout: float, cut_short: bool):
+    stats = STAGE_STATS.setdefault(stage, {
+        "count": 0, "cut_short": 0, "total_seconds": 0.0,
+        "max_seconds": 0.0, "max_budget_used": 0.0,
+    })
+    stats["count"] += 1
+    stats["total_seconds"] += duration
+    stats["max_seconds"] = max(stats["max_seconds"], duration)
+    stats["max_budget_used"] = max(stats["max_budget_used"], duration / timeout if timeout else 0.0)
+    if cut_short:
+        stats["cut_short"] += 1
+
+
+def stage_stats() -> dict:
+    return {
+        stage: {
+            **stats,
+            "mean_seconds": stats["total_seconds"] / stats["count"] if stats["count"] else 0.0,
+            "overrun_rate": stats["cut_short"] / stats["count"] if stats["count"] else 0.0,
+        }
+        for stage, stats in STAGE_STATS.items()
+    }
+
+
+class Deadline:
+    """
+    Time budget for one quiz chain. Every stage asks it for a timeout taken
+    from what is left, so no single stage can consume the whole budget.
+    """
+
+    def __init__(self, budget: float = QUIZ_TIME_BUDGET, start: float | None = None):
+        self.budget = budget
+        self.start = start if start is not None else time.time()
+
+    def elapsed(self) -> float:
+        return time.time() - self.start
+
+    def remaining(self) -> float:
+        return max(0.0, self.budget - self.elapsed())
+
+    def timeout(self, cap: float | None = None, reserve: float = SUBMIT_RESERVE) -> float:
+        """Seconds a stage may take: what's left minus `reserve`, at most `cap`."""
+        available = self.remaining() - reserve
+        if cap is not None:
+            available = min(available, cap)
+        return max(MIN_STAGE_TIMEOUT, available)
+
+    async def run(self, stage: str, coro, cap: float | None = None, reserve: float = SUBMIT_RESERVE):
+        """Awaits `coro` within its share of the budget, raising StageTimeout if it overruns."""
+        timeout = self.timeout(cap, reserve)
+        started = time.time()
+        try:
+            with span(stage):
+                try:
+                    result = await asyncio.wait_for(coro, timeout)
+                except asyncio.TimeoutError:
+                    raise StageTimeout(stage, timeout)
+        except StageTimeout:
+            _record_stage(stage, time.time() - started, timeout, cut_short=True)
+            logger.warning("%s cut short after %.1fs (%.1fs left)", stage, timeout, self.remaining(),
+                           extra={"stage": stage, "timeout": timeout})
+            raise
+        _record_stage(stage, time.time() - started, timeout, cut_short=False)
+        return result
@@ -0,0 +1,137 @@
+import os
+import random
+import asyncio
+from urllib.parse import urlsplit
+from contextlib import asynccontextmanager
+import httpx
+from telemetry import get_logger
+
+logger = get_logger("http_client")
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "8"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "5"))
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_CLIENT: httpx.AsyncClient | None = None
+_HOST_SLOTS: dict[str, asyncio.Semaphore] = {}
+
+HTTP_STATS = {
+    "requests": 0,
+    "new_connections": 0,
+    "tls_handshakes": 0,
+    "http2_requests": 0,
+    "retries": 0,
+    "failures": 0,
+}
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared keep-alive client for outbound HTTP, creating it on first use."""
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS // 2,
+            ),
+            event_hooks={"response": [_count_response]},
+        )
+    return _CLIENT
+
+
+async def start_http_client():
+    get_http_client()
+    logger.info("Shared client ready (http2=%s, per-host limit %d)", HTTP2_AVAILABLE, HTTP_MAX_PER_HOST)
+
+
+async def close_http_client():
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+
+
+async def _count_response(response: httpx.Response):
+    HTTP_STATS["requests"] += 1
+    if response.http_version == "HTTP/2":
+        HTTP_STATS["http2_requests"] += 1
+
+
+async def _trace(event_name: str, info: dict):
+    # httpcore trace events reveal whether a request opened a new connection or reused one
+    if event_name == "connection.connect_tcp.complete":
+        HTTP_STATS["new_connections"] += 1
+    elif event_name == "connection.start_tls.complete":
+        HTTP_STATS["tls_handshakes"] += 1
+
+
+def trace_extensions() -> dict:
+    return {"trace": _trace}
+
+
+@asynccontextmanager
+async def host_slot(url: str):
+    """Bounds concurrent requests to any single host to HTTP_MAX_PER_HOST."""
+    host = urlsplit(url).netloc
+    slot = _HOST_SLOTS.get(host)
+    if slot is None:
+        slot = _HOST_SLOTS[host] = asyncio.Semaphore(HTTP_MAX_PER_HOST)
+    async with slot:
+        yield
+
+
+async def request_with_retry(method: str, url: str, deadline=None, timeout: float = HTTP_TIMEOUT,
+                             retries: int = HTTP_RETRIES, **kwargs) -> httpx.Response:
+    """
+    Sends a request on the shared client, retrying 5xx responses and connection
+    errors with jittered exponential backoff while the deadline allows.
+    """
+    client = get_http_client()
+    attempt = 0
+    while True:
+        attempt_timeout = deadline.timeout(timeout, reserve=0) if deadline else timeout
+        try:
+            async with host_slot(url):
+                response = await client.request(
+                    method, url, timeout=attempt_timeout, extensions=trace_extensions(), **kwargs
+                )
+            if response.status_code < 500 or attempt >= retries:
+                return response
+            reason = f"HTTP {response.status_code}"
+        except httpx.TransportError as e:
+            if attempt >= retries:
+                HTTP_STATS["failures"] += 1
+                raise
+            reason = f"{type(e).__name__}: {e}"
+
+        attempt += 1
+        delay = min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+        if deadline is not None and deadline.remaining() < delay + 1:
+            HTTP_STATS["failures"] += 1
+            raise httpx.TimeoutException(f"No time left to retry {method} {url} after {reason}")
+        HTTP_STATS["retries"] += 1
+        logger.warning("%s %s failed (%s), retry %d/%d in %.2fs", method, url, reason, attempt, retries, delay)
+        await asyncio.sleep(delay)
+
+
+def http_stats() -> dict:
+    requests = HTTP_STATS["requests"]
+    return {
+        **HTTP_STATS,
+        "connection_reuse_rate": 1 - HTTP_STATS["new_connections"] / requests if requests else 0.0,
+        "http2_available": HTTP2_AVAILABLE,
+    }
@@ -0,0 +1,310 @@
+# Streaming ingestion for downloaded CSV/JSON/NDJSON/XLSX files.
+# Files are read in fixed-size chunks so parsing memory stays flat; each chunk is
+# profiled on the fly and folded into compact per-column arrays.
+
+import os
+import csv
+import json
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from telemetry import get_logger
+
+logger = get_logger("ingest")
+
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "50000"))
+# Beyond this many rows only the running aggregates keep counting
+INGEST_MAX_ROWS = int(os.getenv("INGEST_MAX_ROWS", "5000000"))
+JSON_READ_BLOCK = 64 * 1024
+PROFILE_SAMPLE_VALUES = 10
+
+
+class ColumnProfile:
+    """Running schema and aggregates for one column, updated chunk by chunk."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.nulls = 0
+        self.numeric_count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.samples: list = []
+        self._numeric_possible = True
+
+    def update(self, series: pd.Series):
+        nulls = int(series.isna().sum())
+        self.count += len(series)
+        self.nulls += nulls
+        if not self._numeric_possible:
+            numeric = series.iloc[:0]
+        elif pd.api.types.is_numeric_dtype(series):
+            numeric = series.dropna()
+        else:
+            numeric = pd.to_numeric(series, errors="coerce").dropna()
+        if len(numeric) < len(series) - nulls:
+            # One non-numeric value settles it; skip numeric parsing for later chunks
+            self._numeric_possible = False
+        elif len(numeric):
+            self.numeric_count += len(numeric)
+            self.sum += float(numeric.sum())
+            low, high = float(numeric.min()), float(numeric.max())
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+        if len(self.samples) < PROFILE_SAMPLE_VALUES:
+            for value in series.dropna().unique()[:PROFILE_SAMPLE_VALUES]:
+                if value not in self.samples and len(self.samples) < PROFILE_SAMPLE_VALUES:
+                    self.samples.append(value)
+
+    @property
+    def is_numeric(self) -> bool:
+        non_null = self.count - self.nulls
+        return non_null > 0 and self._numeric_possible and self.numeric_count == non_null
+
+    def aggregate(self, func: str):
+        """Exact whole-file value for sum/min/max/count/mean, or None if not tracked."""
+        if func == "count":
+            return self.count - self.nulls
+        if not self.is_numeric:
+            return None
+        if func == "sum":
+            return self.sum
+        if func == "mean":
+            return self.sum / self.numeric_count
+        if func == "min":
+            return self.min
+        if func == "max":
+            return self.max
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "nulls": self.nulls,
+            "numeric": self.is_numeric,
+            "sum": self.sum if self.is_numeric else None,
+            "min": self.min,
+            "max": self.max,
+            "samples": [str(v) for v in self.samples],
+        }
+
+
+class IngestResult:
+    """Compact columnar view of an ingested file plus its running profiles."""
+
+    def __init__(self, columns: dict[str, np.ndarray | pd.Categorical], profiles: dict[str, ColumnProfile],
+                 rows: int, truncated: bool):
+        self.columns = columns
+        self.profiles = profiles
+        self.rows = rows
+        self.truncated = truncated
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        The retained rows as a DataFrame. String columns are decoded back to plain
+        objects: the merged categoricals are unordered, with categories in order of
+        first appearance, so they would sort wrongly and refuse min/max.
+        """
+        return pd.DataFrame({name: _decode(values) for name, values in self.columns.items()}, copy=False)
+
+
+def _compact(series: pd.Series):
+    """Downcasts numbers and dictionary-encodes strings to keep retained chunks small."""
+    if pd.api.types.is_bool_dtype(series):
+        return series.to_numpy()
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast="integer").to_numpy()
+    if pd.api.types.is_numeric_dtype(series):
+        # Floats stay float64 so computed answers are exact
+        return series.to_numpy()
+    return pd.Categorical(series.astype("string"))
+
+
+def _decode(values):
+    if not isinstance(values, pd.Categorical):
+        return values
+    decoded = np.asarray(values.categories, dtype=object).take(values.codes)
+    decoded[values.codes == -1] = np.nan
+    return decoded
+
+
+def _merge(parts: list):
+    if all(isinstance(p, np.ndarray) for p in parts):
+        try:
+            return np.concatenate(parts)
+        except (TypeError, ValueError):
+            pass
+    categoricals = [p if isinstance(p, pd.Categorical) else pd.Categorical(pd.Series(p).astype("string")) for p in parts]
+    return union_categoricals(categoricals, ignore_order=True)
+
+
+def _fill(f, buffer: str, strip: str = "") -> str:
+    """Drops leading whitespace and `strip` characters, reading more of `f` while nothing else is left."""
+    while True:
+        buffer = buffer.lstrip(" \t\r\n" + strip)
+        if buffer:
+            return buffer
+        buffer = f.read(JSON_READ_BLOCK)
+        if not buffer:
+            return ""
+
+
+def _read_value(f, buffer: str, decoder: json.JSONDecoder):
+    """Decodes the JSON value at the start of `buffer`, reading more of `f` until it is complete."""
+    while True:
+        try:
+            value, end = decoder.raw_decode(buffer)
+            # A number or literal ending exactly at the buffer edge may continue in the next block
+            if end < len(buffer):
+                return value, buffer[end:]
+        except ValueError:
+            pass
+        more = f.read(JSON_READ_BLOCK)
+        if not more:
+            value, end = decoder.raw_decode(buffer)
+            return value, buffer[end:]
+        buffer += more
+
+
+def _iter_json_array(f, buffer: str, decoder: json.JSONDecoder, chunk_rows: int):
+    """Yields DataFrames from the records of an array whose "[" has just been consumed."""
+    batch = []
+    while True:
+        buffer = _fill(f, buffer, ",")
+        if not buffer:
+            raise ValueError("JSON array is not terminated")
+        if buffer.startswith("]"):
+            break
+        record, buffer = _read_value(f, buffer, decoder)
+        batch.append(record)
+        if len(batch) >= chunk_rows:
+            yield pd.json_normalize(batch)
+            batch = []
+    if batch:
+        yield pd.json_normalize(batch)
+
+
+def _iter_json_records(filepath: str, chunk_rows: int):
+    """
+    Yields DataFrames from a JSON array, an object wrapping one (its first array
+    value is streamed, as in {"data": [...]}) or NDJSON, without loading it whole.
+    """
+    decoder = json.JSONDecoder()
+    with open(filepath, "r", encoding="utf-8") as f:
+        buffer = _fill(f, f.read(JSON_READ_BLOCK))
+        if buffer.startswith("{"):
+            lines = [line for line in buffer.split("\n", 2)[:2] if line.strip()]
+            try:
+                json.loads(lines[0])
+                is_ndjson = len(lines) > 1 and lines[1].lstrip().startswith("{")
+            except ValueError:
+                is_ndjson = False
+            if is_ndjson:
+                for chunk in pd.read_json(filepath, lines=True, chunksize=chunk_rows):
+                    yield chunk
+                return
+
+            # A single object: stream its first array value, or treat the object as one record
+            buffer = buffer[1:]
+            fields = {}
+            while True:
+                buffer = _fill(f, buffer, ",")
+                if not buffer or buffer.startswith("}"):
+                    break
+                key, buffer = _read_value(f, buffer, decoder)
+                buffer = _fill(f, buffer, ":")
+                if buffer.startswith("["):
+                    yield from _iter_json_array(f, buffer[1:], decoder, chunk_rows)
+                    return
+                fields[key], buffer = _read_value(f, buffer, decoder)
+            yield pd.json_normalize([fields])
+            return
+
+        if not buffer.startswith("["):
+            raise ValueError("JSON file is neither an array, an object nor NDJSON")
+        yield from _iter_json_array(f, buffer[1:], decoder, chunk_rows)
+
+
+def _iter_xlsx_rows(filepath: str, chunk_rows: int):
+    """Yields DataFrames from the first sheet, reading rows lazily."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(h) if h is not None else f"column_{i + 1}" for i, h in enumerate(header)]
+        batch = []
+        for row in rows:
+            if row is None or all(v is None for v in row):
+                continue
+            row = tuple(row[:len(header)])
+            batch.append(row + (None,) * (len(header) - len(row)))
+            if len(batch) >= chunk_rows:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+def _sniff_delimiter(filepath: str) -> str:
+    with open(filepath, "r", encoding="utf-8", errors="replace", newline="") as f:
+        sample = f.read(JSON_READ_BLOCK)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return ","
+
+
+def iter_chunks(filepath: str, file_format: str, chunk_rows: int = INGEST_CHUNK_ROWS):
+    """Yields the file as a sequence of DataFrames of at most `chunk_rows` rows."""
+    file_format = file_format.lower()
+    if file_format == "csv":
+        # Sniff once, then let the C parser stream the rest
+        yield from pd.read_csv(filepath, sep=_sniff_delimiter(filepath), chunksize=chunk_rows)
+    elif file_format == "json":
+        yield from _iter_json_records(filepath, chunk_rows)
+    elif file_format == "xlsx":
+        yield from _iter_xlsx_rows(filepath, chunk_rows)
+    else:
+        raise ValueError(f"Unsupported format for streaming ingestion: {file_format}")
+
+
+def ingest_file(filepath: str, file_format: str, chunk_rows: int = INGEST_CHUNK_ROWS,
+                max_rows: int = INGEST_MAX_ROWS) -> IngestResult:
+    """Streams a file into compact column arrays while profiling every column."""
+    logger.info("Streaming %s from %s", file_format.upper(), filepath)
+    profiles: dict[str, ColumnProfile] = {}
+    parts: dict[str, list] = {}
+    rows = 0
+    kept = 0
+
+    for chunk in iter_chunks(filepath, file_format, chunk_rows):
+        chunk.columns = [str(c) for c in chunk.columns]
+        for column in chunk.columns:
+            if column not in profiles:
+                profiles[column] = ColumnProfile(column)
+                # Columns first seen in a later chunk are null for the earlier rows
+                parts[column] = [np.full(kept, np.nan)] if kept else []
+            profiles[column].update(chunk[column])
+
+        keep = min(len(chunk), max(0, max_rows - kept))
+        if keep:
+            for column in profiles:
+                if column in chunk.columns:
+                    parts[column].append(_compact(chunk[column].iloc[:keep]))
+                else:
+                    parts[column].append(np.full(keep, np.nan))
+            kept += keep
+        rows += len(chunk)
+
+    columns = {name: _merge(chunks) if chunks else np.array([]) for name, chunks in parts.items()}
+    truncated = rows > kept
+    logger.info("%d rows, %d columns%s", rows, len(columns), f" (kept first {kept})" if truncated else "",
+                extra={"rows": rows, "columns": len(columns), "truncated": truncated})
+    return IngestResult(columns, profiles, rows, truncated)
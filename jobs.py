@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import contextlib
+from collections import OrderedDict
+from telemetry import get_logger
+from shared_state import write_atomic
+
+logger = get_logger("jobs")
+
+MAX_CONCURRENT_CHAINS = int(os.getenv("MAX_CONCURRENT_CHAINS", "4"))
+# With several uvicorn workers: chains running at once across all of them
+GLOBAL_MAX_CHAINS = int(os.getenv("GLOBAL_MAX_CHAINS", str(MAX_CONCURRENT_CHAINS)))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "16"))
+# Assumed chain duration until real ones have been measured; used to estimate queue waits
+JOB_EXPECTED_SECONDS = float(os.getenv("JOB_EXPECTED_SECONDS", "60"))
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "200"))
+# Published job states older than this are removed at startup
+JOB_STATE_TTL = float(os.getenv("JOB_STATE_TTL", str(24 * 3600)))
+
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be admitted: the queue is full or the wait too long."""
+
+
+class Job:
+    """State of one quiz chain, updated by the worker as it progresses."""
+
+    def __init__(self, url: str, profile: bool = False):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.profile = profile
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.quizzes: list[dict] = []
+        self.result = None
+        self.error = None
+
+    def add_quiz(self, quiz_url: str) -> dict:
+        entry = {"number": len(self.quizzes) + 1, "url": quiz_url, "status": "running"}
+        self.quizzes.append(entry)
+        return entry
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "url": self.url,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_seconds": (self.started_at or time.time()) - self.created_at,
+            "quizzes": self.quizzes,
+            "result": self.result,
+            "error": self.error,
+            "profile": f"/profiles/{self.id}" if self.profile else None,
+        }
+
+
+class JobManager:
+    """
+    Bounded queue of quiz chains served by a fixed pool of worker tasks.
+    `runner` is an async callable taking the Job and returning its result dict.
+    With `slots` (a ProcessSemaphore) a job also needs one of its slots to run,
+    which caps running chains across processes; with `state_dir` job states are
+    published there so any process can answer lookups for them. With `max_wait`,
+    jobs expected to queue longer than that are refused, and jobs that still
+    waited longer fail without running.
+    """
+
+    def __init__(self, runner, workers: int = MAX_CONCURRENT_CHAINS, queue_size: int = JOB_QUEUE_SIZE,
+                 slots=None, state_dir: str | None = None, max_wait: float | None = None):
+        self.runner = runner
+        self.workers = workers
+        self.queue_size = queue_size
+        self.slots = slots
+        self.state_dir = state_dir
+        self.max_wait = max_wait
+        self._queue = None
+        self._tasks: list[asyncio.Task] = []
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self.active = 0
+        self.rejected = 0
+        self.expired = 0
+        self.job_seconds = JOB_EXPECTED_SECONDS
+
+    async def start(self):
+        if self.state_dir:
+            await asyncio.to_thread(self._prune_published)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info("Started %d workers (queue size %d)", self.workers, self.queue_size)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, url: str, profile: bool = False) -> Job:
+        """Admits a new job or raises QueueFullError."""
+        if self._queue is None:
+            raise RuntimeError("JobManager has not been started")
+        if self.max_wait is not None:
+            wait = self.expected_wait()
+            if wait > self.max_wait:
+                self.rejected += 1
+                raise QueueFullError(f"Expected wait of {wait:.0f}s is over the {self.max_wait:.0f}s a job may queue")
+        job = Job(url, profile=profile)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"Job queue is full ({self.queue_size} waiting)")
+        self._jobs[job.id] = job
+        self._prune()
+        self.publish(job)
+        return job
+
+    def expected_wait(self) -> float:
+        """Seconds a job admitted now would queue, as if the running chains had just started."""
+        ahead = self.active + (self._queue.qsize() if self._queue else 0)
+        if ahead < self.workers:
+            return 0.0
+        return ((ahead - self.workers) // self.workers + 1) * self.job_seconds
+
+    def lookup(self, job_id: str) -> dict | None:
+        """State of a job run by this process or, when states are published, by any other."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if not self.state_dir or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        try:
+            with open(os.path.join(self.state_dir, f"{job_id}.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def publish(self, job: Job):
+        """Writes the job's current state for other processes (no-op without `state_dir`)."""
+        if not self.state_dir:
+            return
+        try:
+            write_atomic(os.path.join(self.state_dir, f"{job.id}.json"), json.dumps(job.to_dict(), default=str).encode("utf-8"))
+        except OSError as e:
+            logger.warning("Could not publish state of job %s: %s", job.id, e)
+
+    def _prune_published(self):
+        cutoff = time.time() - JOB_STATE_TTL
+        try:
+            names = os.listdir(self.state_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.state_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _prune(self):
+        # Forget the oldest finished jobs once the history is over its limit
+        excess = len(self._jobs) - JOB_HISTORY_SIZE
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].status in ("completed", "failed"):
+                del self._jobs[job_id]
+                excess -= 1
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                async with self.slots.slot() if self.slots else contextlib.nullcontext():
+                    await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job):
+        waited = time.time() - job.created_at
+        if self.max_wait is not None and waited > self.max_wait:
+            self.expired += 1
+            logger.warning("Job %s expired after %.0fs in the queue", job.id, waited, extra={"job_id": job.id})
+            job.status = "failed"
+            job.error = f"expired after {waited:.0f}s in the queue"
+            job.finished_at = time.time()
+            self.publish(job)
+            return
+        self.active += 1
+        job.status = "running"
+        job.started_at = time.time()
+        self.publish(job)
+        try:
+            job.result = await self.runner(job)
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = "cancelled"
+            raise
+        except Exception as e:
+            logger.error("Job %s failed: %s", job.id, e, extra={"job_id": job.id})
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            self.active -= 1
+            # Moving average of chain durations, for expected_wait()
+            self.job_seconds += 0.2 * (job.finished_at - job.started_at - self.job_seconds)
+            self.publish(job)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "queue_size": self.queue_size,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "expected_wait_seconds": round(self.expected_wait(), 1),
+            "global_slots": self.slots.stats() if self.slots else None,
+        }
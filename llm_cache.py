@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from telemetry import get_logger
+from shared_state import SHARED_STATE_DIR, WORKER_COUNT
+
+logger = get_logger("llm_cache")
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+# The SQLite tier is shared by all uvicorn workers on the host
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(SHARED_STATE_DIR, "llm_cache.sqlite3"))
+# A per-process memory tier would keep serving entries another worker invalidated,
+# so with several workers it is off unless sized explicitly
+LLM_CACHE_MEMORY_BYTES = int(os.getenv("LLM_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024 if WORKER_COUNT == 1 else 0)))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+
+
+def make_cache_key(model: str, messages: list[dict], temperature: float, **params) -> str:
+    """Content hash of everything that determines the completion."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Two-tier cache of LLM responses: an in-memory LRU bounded by total size,
+    backed by a SQLite table that survives restarts. Entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, memory_bytes: int = LLM_CACHE_MEMORY_BYTES, ttl: float = LLM_CACHE_TTL):
+        self.path = path
+        self.memory_bytes = memory_bytes
+        self.ttl = ttl
+        self._memory: OrderedDict[str, tuple[str, float, float]] = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+    def _conn(self) -> sqlite3.Connection | None:
+        if self._db is None and self.path:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                    "created_at REAL NOT NULL, latency REAL NOT NULL)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning("SQLite tier disabled: %s", e)
+                self.path = ""
+                self._db = None
+        return self._db
+
+    def _remember(self, key: str, response: str, created_at: float, latency: float):
+        # Caller must hold self._lock
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key)[0])
+        self._memory[key] = (response, created_at, latency)
+        self._memory_size += len(response)
+        while self._memory_size > self.memory_bytes and self._memory:
+            _, (evicted, _, _) = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[1] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self.latency_saved += entry[2]
+                return entry[0]
+            if entry:
+                self._memory_size -= len(self._memory.pop(key)[0])
+
+            db = self._conn()
+            if db is not None:
+                row = db.execute(
+                    "SELECT response, created_at, latency FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and now - row[1] <= self.ttl:
+                    self._remember(key, *row)
+                    self.disk_hits += 1
+                    self.latency_saved += row[2]
+                    return row[0]
+                if row:
+                    db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    db.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, response: str, latency: float):
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now, latency)
+            db = self._conn()
+            if db is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, response, created_at, latency) VALUES (?, ?, ?, ?)",
+                    (key, response, now, latency),
+                )
+                db.commit()
+
+    def invalidate(self, key: str) -> bool:
+        """Drops one entry from both tiers. Returns True if it existed."""
+        with self._lock:
+            existed = False
+            if key in self._memory:
+                self._memory_size -= len(self._memory.pop(key)[0])
+                existed = True
+            db = self._conn()
+            if db is not None:
+                existed = db.execute("DELETE FROM llm_cache WHERE key = ?", (key,)).rowcount > 0 or existed
+                db.commit()
+            return existed
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            db = self._conn()
+            if db is not None:
+                db.execute("DELETE FROM llm_cache")
+                db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "enabled": LLM_CACHE_ENABLED,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_size,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+        }
+
+
+LLM_CACHE = LLMCache()
@@ -0,0 +1,137 @@
+import os
+import time
+import asyncio
+from collections import deque
+from telemetry import get_logger
+
+logger = get_logger("llm_hedging")
+
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "true").lower() == "true"
+# Fire a duplicate once a call is slower than this percentile of recent calls of its type
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# At most this fraction of calls may be hedged, so extra cost stays bounded
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+HISTOGRAM_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60)
+
+
+class LatencyTracker:
+    """Rolling window of observed latencies for one call type (plan, answer, ...)."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples: deque[float] = deque(maxlen=window)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_delay(self) -> float | None:
+        """Seconds to wait before hedging, or None if hedging isn't allowed right now."""
+        if len(self.samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        if self.hedged >= LLM_HEDGE_BUDGET * self.calls:
+            return None
+        return self.percentile(LLM_HEDGE_PERCENTILE)
+
+    def histogram(self) -> dict:
+        counts = {f"le_{bound}": 0 for bound in HISTOGRAM_BUCKETS}
+        counts["le_inf"] = 0
+        for sample in self.samples:
+            bucket = next((f"le_{b}" for b in HISTOGRAM_BUCKETS if sample <= b), "le_inf")
+            counts[bucket] += 1
+        return counts
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "histogram": self.histogram(),
+        }
+
+
+TRACKERS: dict[str, LatencyTracker] = {}
+
+
+def _tracker(call_type: str) -> LatencyTracker:
+    if call_type not in TRACKERS:
+        TRACKERS[call_type] = LatencyTracker()
+    return TRACKERS[call_type]
+
+
+async def _timed(factory):
+    started = time.time()
+    result = await factory()
+    return result, time.time() - started
+
+
+async def hedged_call(call_type: str, factory):
+    """
+    Awaits `factory()`; if it hasn't returned within the hedge delay for
+    `call_type`, starts a second `factory()` and returns whichever succeeds first.
+    The slower request is cancelled.
+    """
+    tracker = _tracker(call_type)
+    tracker.calls += 1
+    primary = asyncio.create_task(_timed(factory))
+    delay = tracker.hedge_delay() if LLM_HEDGING_ENABLED else None
+
+    if delay is None:
+        result, latency = await primary
+        tracker.record(latency)
+        return result
+
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            result, latency = primary.result()
+            tracker.record(latency)
+            return result
+
+        tracker.hedged += 1
+        logger.info("%s call slower than p%d (%.1fs), hedging", call_type, int(LLM_HEDGE_PERCENTILE * 100), delay)
+        hedge = asyncio.create_task(_timed(factory))
+        tasks.append(hedge)
+        pending = {primary, hedge}
+        last_error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                    continue
+                result, latency = task.result()
+                if task is hedge:
+                    tracker.hedge_wins += 1
+                # A winning hedge started `delay` seconds late; count that wait as well
+                tracker.record(latency + (delay if task is hedge else 0))
+                for other in pending:
+                    other.cancel()
+                return result
+        raise last_error
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+def hedging_stats() -> dict:
+    return {
+        "enabled": LLM_HEDGING_ENABLED,
+        "percentile": LLM_HEDGE_PERCENTILE,
+        "budget": LLM_HEDGE_BUDGET,
+        "by_call_type": {name: tracker.stats() for name, tracker in TRACKERS.items()},
+    }
@@ -1,11 +1,74 @@
 import os
 import json
-from openai import OpenAI
+import time
+import asyncio
+import httpx
 from dotenv import load_dotenv
+from llm_cache import LLM_CACHE, LLM_CACHE_ENABLED, make_cache_key
+from context_reducer import reduce_context
+from llm_hedging import hedged_call
+from stream_parser import IncrementalAnswerParser
+from recorder import intercept
+from shared_state import per_worker
+from telemetry import get_logger
+
+logger = get_logger("llm_solver")
 
 load_dotenv()
-CLIENT = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 LLM_MODEL = os.getenv("LLM_MODEL", "gpt-5-nano")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# In-flight LLM requests for the whole host, split evenly between uvicorn workers
+LLM_MAX_CONCURRENCY = per_worker(int(os.getenv("LLM_MAX_CONCURRENCY", "8")))
+# Stream completions and close them as soon as one complete value has been parsed
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() == "true"
+
+# How long a warmed-up connection to the LLM API is kept open while idle
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+
+# The openai package takes a large share of startup time, so clients are built on first use
+_CLIENT = None
+_ASYNC_CLIENT = None
+_ASYNC_HTTP = None
+LLM_SEMAPHORE = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+def get_client():
+    global _CLIENT
+    if _CLIENT is None:
+        from openai import OpenAI
+        _CLIENT = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _CLIENT
+
+def get_async_client():
+    """Async client sharing one keep-alive connection pool across all quiz chains."""
+    global _ASYNC_CLIENT, _ASYNC_HTTP
+    if _ASYNC_CLIENT is None:
+        from openai import AsyncOpenAI
+        _ASYNC_HTTP = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONCURRENCY * 2,
+                max_keepalive_connections=LLM_MAX_CONCURRENCY,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=LLM_TIMEOUT,
+        )
+        _ASYNC_CLIENT = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=_ASYNC_HTTP)
+    return _ASYNC_CLIENT
+
+async def warm_llm_client(timeout: float = 10) -> int:
+    """
+    Builds the async client and opens a connection to the API host (DNS, TCP
+    and TLS) so the first completion doesn't pay for it. Returns the HTTP
+    status of the probe; any status means the connection is up.
+    """
+    client = get_async_client()
+    response = await _ASYNC_HTTP.head(str(client.base_url), timeout=timeout)
+    return response.status_code
+
+async def close_llm_client():
+    global _ASYNC_CLIENT, _ASYNC_HTTP
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT.close()
+        _ASYNC_CLIENT = _ASYNC_HTTP = None
 
 SYSTEM_PROMPT = """
 You are an expert Data Scientist. Your task is to analyze a raw quiz description 
@@ -14,48 +77,236 @@ The 'plan' should be a concise, sequential list of steps needed.
 The 'task_type' must be 'DOWNLOAD', 'SCRAPE', 'ANALYZE', or 'VISUALIZE'.
 """
 
+ANSWER_SYSTEM_PROMPT = "You are a calculation and analysis assistant. Solve the user's request based ONLY on the provided data. Output ONLY the final answer as a single value."
+
+OPERATION_SPEC_PROMPT = """
+You translate a data question into an operation spec that a pandas engine will run.
+You see only the table schema and a few sample rows, never the full data.
+Respond with ONLY a single JSON object with these optional keys:
+"filters": list of {"column", "op", "value"} where op is one of
+  ==, !=, >, >=, <, <=, in, not_in, contains, startswith, isnull, notnull;
+"group_by": list of column names;
+"aggregate": {"column", "func"} where func is one of
+  sum, mean, median, min, max, count, nunique, std, var, first, last;
+"sort": {"by", "ascending"} ("by" may be "value" after aggregation);
+"limit": integer;
+"select": a column name (or list of names for "rows");
+"return": "value" (single scalar, default), "key" (group label), "column" (list) or "rows".
+Use the exact column names from the schema.
+"""
+
+CHART_SPEC_PROMPT = """
+You design a chart that answers a data visualization question. A plotting engine
+draws it from the full table; you see only the table schema and a few sample rows.
+Respond with ONLY a single JSON object with these keys:
+"type": one of bar, barh, line, scatter, pie, hist;
+"x": column for the categories or x axis (omit for hist);
+"y": column (or list of columns) to plot;
+"aggregate": optional func to apply to "y" per "x" value, one of
+  sum, mean, median, min, max, count, nunique (count with no "y" counts rows);
+"filters": optional list of {"column", "op", "value"} where op is one of
+  ==, !=, >, >=, <, <=, in, not_in, contains, startswith, isnull, notnull;
+"sort": optional {"by": "x" or "y", "ascending"}; "limit": optional integer;
+"bins": optional integer for hist;
+"title", "xlabel", "ylabel": optional labels;
+"format": "png" or "svg", only if the question asks for one.
+If there is no table, add "data": {"columns": [...], "rows": [[...], ...]} with
+the values from the question, and use those column names.
+Use the exact column names from the schema.
+"""
+
+def _plan_messages(quiz_text: str) -> list[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"The quiz instructions are:\n\n---\n{quiz_text}\n---"}
+    ]
+
+def _answer_messages(data: str, instruction: str) -> list[dict]:
+    return [
+        {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
+        {"role": "user", "content": f"DATA:\n{data}\n\nINSTRUCTION: {instruction}"}
+    ]
+
+def _chat(messages: list[dict], temperature: float, json_mode: bool = False) -> str:
+    """Blocking chat completion, served from LLM_CACHE when an identical request was seen."""
+    params = {"response_format": {"type": "json_object"}} if json_mode else {}
+    key = make_cache_key(LLM_MODEL, messages, temperature, **params)
+    if LLM_CACHE_ENABLED:
+        cached = LLM_CACHE.get(key)
+        if cached is not None:
+            logger.info("Cache hit (%s)", key)
+            return cached
+
+    started = time.time()
+    response = get_client().chat.completions.create(
+        model=LLM_MODEL,
+        messages=messages,
+        temperature=temperature,
+        **params
+    )
+    content = response.choices[0].message.content
+    if json_mode:
+        json.loads(content)  # Never cache a malformed JSON reply
+    if LLM_CACHE_ENABLED:
+        LLM_CACHE.set(key, content, time.time() - started)
+    return content
+
+async def _chat_async(messages: list[dict], temperature: float, timeout: float, json_mode: bool = False,
+                      call_type: str = "answer") -> str:
+    """
+    Async counterpart of _chat, bounded by LLM_SEMAPHORE. Slow calls are hedged
+    against the recent latency of the same `call_type`.
+    """
+    params = {"response_format": {"type": "json_object"}} if json_mode else {}
+    key = make_cache_key(LLM_MODEL, messages, temperature, **params)
+    # Recorded chains capture the exchange here, cache hits included, so replay needs no cache
+    return await intercept(
+        "llm", key, lambda: _complete_async(key, messages, temperature, timeout, params, json_mode, call_type)
+    )
+
+async def _complete_async(key: str, messages: list[dict], temperature: float, timeout: float, params: dict,
+                          json_mode: bool, call_type: str) -> str:
+    if LLM_CACHE_ENABLED:
+        # The SQLite tier may wait on other workers' locks; keep that off the event loop
+        cached = await asyncio.to_thread(LLM_CACHE.get, key)
+        if cached is not None:
+            logger.info("Cache hit (%s)", key)
+            return cached
+
+    async def request() -> str:
+        async with LLM_SEMAPHORE:
+            if not LLM_STREAMING:
+                response = await get_async_client().chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=messages,
+                    temperature=temperature,
+                    timeout=timeout,
+                    **params
+                )
+                return response.choices[0].message.content
+            return await _stream_value(messages, temperature, timeout, params)
+
+    started = time.time()
+    content = await hedged_call(call_type, request)
+    if json_mode:
+        json.loads(content)
+    if LLM_CACHE_ENABLED:
+        await asyncio.to_thread(LLM_CACHE.set, key, content, time.time() - started)
+    return content
+
+async def _stream_value(messages: list[dict], temperature: float, timeout: float, params: dict) -> str:
+    """Streams a completion and stops reading once the answer value is complete."""
+    stream = await get_async_client().chat.completions.create(
+        model=LLM_MODEL,
+        messages=messages,
+        temperature=temperature,
+        timeout=timeout,
+        stream=True,
+        **params
+    )
+    parser = IncrementalAnswerParser()
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta and parser.feed(delta):
+                logger.debug("Answer value complete, closing stream early")
+                break
+    finally:
+        await stream.close()
+    return parser.value_text()
+
 def get_solution_plan(quiz_text: str) -> dict:
     """Uses GPT-5-nano to create a structured plan from the quiz instructions."""
-    print("-> LLM: Generating solution plan...")
+    logger.info("Generating solution plan")
     
     # Use a low temperature for deterministic, factual output
     
     try:
-        response = CLIENT.chat.completions.create(
-            model=LLM_MODEL,
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": f"The quiz instructions are:\n\n---\n{quiz_text}\n---"}
-            ],
-            temperature=0.1
-        )
+        content = _chat(_plan_messages(quiz_text), temperature=0.1, json_mode=True)
         
         # The model is instructed to return only a JSON object
-        return json.loads(response.choices[0].message.content)
+        return json.loads(content)
 
     except Exception as e:
-        print(f"LLM Error: {e}")
+        logger.error("Plan generation failed: %s", e)
         # Return a fail-safe structure
         return {"task_type": "ERROR", "plan": [f"LLM failed to generate plan: {e}"]}
 
-def process_data_with_llm(data: str, instruction: str) -> str:
-    """Uses GPT-5-nano to perform the analysis (e.g., calculation, summary)."""
-    print("-> LLM: Processing data and generating answer...")
+def process_data_with_llm(data: str, instruction: str, reduce: bool = True) -> str:
+    """
+    Uses GPT-5-nano to perform the analysis (e.g., calculation, summary).
+    Oversized `data` is reduced to the chunks most relevant to `instruction`;
+    pass reduce=False when `data` is the quiz text itself, which holds the question.
+    """
+    logger.info("Processing data and generating answer")
     
     # The instruction here comes from the generated plan.
     try:
-        response = CLIENT.chat.completions.create(
-            model=LLM_MODEL,
-            messages=[
-                {"role": "system", "content": f"You are a calculation and analysis assistant. Solve the user's request based ONLY on the provided data. Output ONLY the final answer as a single value."},
-                {"role": "user", "content": f"DATA:\n{data}\n\nINSTRUCTION: {instruction}"}
-            ],
-            temperature=0.0
-        )
-        return response.choices[0].message.content.strip()
+        if reduce:
+            data, token_stats = reduce_context(data, instruction)
+            logger.info("Sending %d data tokens (%d saved)", token_stats["tokens_sent"], token_stats["tokens_saved"], extra=token_stats)
+        return _chat(_answer_messages(data, instruction), temperature=0.0).strip()
+    except Exception as e:
+        logger.error("Answer generation failed: %s", e)
+        return f"ERROR: {e}"
+
+async def get_solution_plan_async(quiz_text: str, timeout: float = LLM_TIMEOUT) -> dict:
+    """Non-blocking version of get_solution_plan for use inside the event loop."""
+    logger.info("Generating solution plan")
+
+    try:
+        content = await _chat_async(_plan_messages(quiz_text), temperature=0.1, timeout=timeout, json_mode=True, call_type="plan")
+        return json.loads(content)
+
+    except Exception as e:
+        logger.error("Plan generation failed: %s", e)
+        return {"task_type": "ERROR", "plan": [f"LLM failed to generate plan: {e}"]}
+
+async def get_operation_spec_async(schema: str, instruction: str, timeout: float = LLM_TIMEOUT) -> dict | None:
+    """Asks the LLM for a structured operation spec over a table it only sees the schema of."""
+    logger.info("Generating operation spec")
+
+    try:
+        messages = [
+            {"role": "system", "content": OPERATION_SPEC_PROMPT},
+            {"role": "user", "content": f"TABLE SCHEMA:\n{schema}\n\nQUESTION:\n{instruction}"}
+        ]
+        content = await _chat_async(messages, temperature=0.0, timeout=timeout, json_mode=True, call_type="spec")
+        return json.loads(content)
+    except Exception as e:
+        logger.error("Operation spec failed: %s", e)
+        return None
+
+async def get_chart_spec_async(schema: str, instruction: str, timeout: float = LLM_TIMEOUT) -> dict | None:
+    """Asks the LLM for a compact chart spec over a table it only sees the schema of."""
+    logger.info("Generating chart spec")
+
+    try:
+        messages = [
+            {"role": "system", "content": CHART_SPEC_PROMPT},
+            {"role": "user", "content": f"TABLE SCHEMA:\n{schema}\n\nQUESTION:\n{instruction}"}
+        ]
+        content = await _chat_async(messages, temperature=0.0, timeout=timeout, json_mode=True, call_type="chart")
+        return json.loads(content)
+    except Exception as e:
+        logger.error("Chart spec failed: %s", e)
+        return None
+
+async def process_data_with_llm_async(data: str, instruction: str, timeout: float = LLM_TIMEOUT,
+                                      reduce: bool = True) -> str:
+    """Non-blocking version of process_data_with_llm for use inside the event loop."""
+    logger.info("Processing data and generating answer")
+
+    try:
+        if reduce:
+            data, token_stats = await asyncio.to_thread(reduce_context, data, instruction)
+            logger.info("Sending %d data tokens (%d saved)", token_stats["tokens_sent"], token_stats["tokens_saved"], extra=token_stats)
+        content = await _chat_async(_answer_messages(data, instruction), temperature=0.0, timeout=timeout)
+        return content.strip()
     except Exception as e:
-        print(f"LLM Processing Error: {e}")
+        logger.error("Answer generation failed: %s", e)
         return f"ERROR: {e}"
 
 if __name__ == '__main__':
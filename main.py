@@ -2,27 +2,102 @@ import os
 import json
 import re
 import time
-import requests
-from fastapi import FastAPI, HTTPException, Request, status
+import secrets
+_IMPORTS_STARTED = time.perf_counter()
+import asyncio
+import httpx
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response, status
+from fastapi.responses import JSONResponse, FileResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
 # Import our custom modules
-from llm_solver import get_solution_plan, process_data_with_llm
-from browser_agent import get_quiz_details, download_file
-from data_processor import extract_text_from_pdf
+from llm_solver import (
+    get_solution_plan_async, process_data_with_llm_async, get_operation_spec_async, get_chart_spec_async,
+    warm_llm_client, close_llm_client, LLM_TIMEOUT
+)
+from browser_agent import get_quiz_details, page_fetch_stats, BROWSER_POOL
+from http_client import start_http_client, close_http_client, request_with_retry, http_stats
+from jobs import Job, JobManager, QueueFullError, GLOBAL_MAX_CHAINS
+from data_processor import extract_text_from_pdf, extract_tables_from_pdf, parse_page_selection, shutdown_pdf_pool
+from llm_cache import LLM_CACHE
+from deadline import Deadline, StageTimeout, stage_stats, QUIZ_TIME_BUDGET
+from context_reducer import reducer_stats
+from llm_hedging import hedging_stats
+from recorder import intercept, record_chains
+from resources import Resource, ResourceCache, extract_links, fetch_resources
+from chart_renderer import render_chart, warm_chart_pool, shutdown_chart_pool, chart_stats
+from profiler import profile_chains, should_profile, profile_path, list_profiles
+from warmup import Warmup
+from shared_state import WORKER_COUNT, SHARED_STATE_DIR, ARTIFACT_CACHE, ProcessSemaphore, make_scratch_dir
+from telemetry import (
+    get_logger, span, start_trace, bind_trace, register_gauge, metrics_text, METRICS_CONTENT_TYPE,
+    QUIZZES_ATTEMPTED, QUIZZES_CORRECT, QUIZZES_INCORRECT, QUIZZES_FAILED
+)
+
+# The table parsers (pandas) are imported where they are used, or by the warm-up
+IMPORT_SECONDS = round(time.perf_counter() - _IMPORTS_STARTED, 3)
 
 load_dotenv()
+logger = get_logger("main")
 
 # --- Configuration & Setup ---
-app = FastAPI(title="LLM Analysis Quiz Solver")
+async def warm_browser():
+    # Launch the shared browser and leave one context idle in the pool
+    async with BROWSER_POOL.context():
+        pass
+
+def warm_parsers():
+    import pypdf  # noqa: F401
+    from compute_engine import table_from_rows, describe_table
+    describe_table(table_from_rows([["name", "value"], ["a", "1"]]))
+
+WARMUP = Warmup({
+    "browser": warm_browser,
+    "llm_connection": warm_llm_client,
+    "parsers": lambda: asyncio.to_thread(warm_parsers),
+    "charts": warm_chart_pool,
+})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_http_client()
+    await asyncio.to_thread(ARTIFACT_CACHE.prune)
+    await JOB_MANAGER.start()
+    await WARMUP.start()
+    yield
+    await WARMUP.stop()
+    await JOB_MANAGER.stop()
+    await BROWSER_POOL.stop()
+    await close_llm_client()
+    await close_http_client()
+    shutdown_pdf_pool()
+    shutdown_chart_pool()
+
+app = FastAPI(title="LLM Analysis Quiz Solver", lifespan=lifespan)
 STUDENT_EMAIL = os.getenv("STUDENT_EMAIL")
 STUDENT_SECRET = os.getenv("STUDENT_SECRET")
+# Required (X-Admin-Token header) to clear caches; defaults to the student secret
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Legacy .xls is not one: openpyxl only reads .xlsx
+TABLE_FORMATS = ['csv', 'json', 'xlsx']
+# Files below this size may still be pasted into the prompt if the compute engine fails
+RAW_DATA_FALLBACK_MAX_CHARS = int(os.getenv("RAW_DATA_FALLBACK_MAX_CHARS", "20000"))
+# Don't start another quiz with less than this much of the budget left
+NEW_QUIZ_MIN_REMAINING = float(os.getenv("NEW_QUIZ_MIN_REMAINING", "30"))
+# Submitted when the answering stages were cut short, so the chain can still move on
+BEST_EFFORT_ANSWER = os.getenv("BEST_EFFORT_ANSWER", "0")
+# Start the direct answer and file prefetch alongside planning instead of after it
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "true").lower() == "true"
+DIRECT_ANSWER_INSTRUCTION = "Solve the quiz based on the provided instructions. Output ONLY the final answer value."
 
 class QuizTask(BaseModel):
     email: str
     secret: str
     url: str
+    # Profile this chain (also requested with an "X-Profile: 1" header)
+    profile: bool = False
     
 class QuizSubmission(BaseModel):
     email: str
@@ -35,149 +110,466 @@ class QuizSubmission(BaseModel):
 @app.post("/solve-quiz", status_code=status.HTTP_200_OK)
 async def solve_quiz_task(task: QuizTask, request: Request):
     """
-    Receives a quiz URL and orchestrates the agent to solve and submit the answer.
+    Receives a quiz URL, verifies the credentials and queues the quiz chain
+    as a background job. Progress is available at /jobs/{job_id}.
     """
-    start_time = time.time()
-    print(f"\n{'='*60}")
-    print(f"NEW TASK RECEIVED")
-    print(f"URL: {task.url}")
-    print(f"Email: {task.email}")
-    print(f"{'='*60}\n")
-    
+    logger.info("New task received: %s", task.url, extra={"url": task.url, "email": task.email})
+
     # 1. Verification (HTTP 403 / HTTP 400)
     if task.email != STUDENT_EMAIL or task.secret != STUDENT_SECRET:
-        print(f"❌ Authentication failed!")
+        logger.warning("Authentication failed", extra={"email": task.email})
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, 
             detail="Invalid email or secret provided."
         )
     
-    print("✅ Authentication successful")
-    
-    current_quiz_url = task.url
+    # 2. Admission control: refuse instead of queueing chains that would miss their deadline
+    try:
+        profile = should_profile(task.profile or request.headers.get("x-profile", "").lower() in ("1", "true"))
+        job = JOB_MANAGER.submit(task.url, profile=profile)
+    except QueueFullError as e:
+        logger.warning("Rejected: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "10"}
+        )
+
+    logger.info("Queued job %s", job.id, extra={"job_id": job.id})
+    return {
+        "status": "queued",
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}"
+    }
+
+async def discard_task(task: asyncio.Task | None):
+    """Cancels a speculative task that lost and waits for it to unwind."""
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+
+async def post_answer(submit_url: str, payload: dict, deadline: Deadline) -> dict:
+    """Posts the answer and returns the parsed response (recorded/replayed by recorder)."""
+    async def send() -> dict:
+        response = await request_with_retry(
+            "POST",
+            submit_url,
+            json=payload,
+            headers={'Content-Type': 'application/json'},
+            deadline=deadline,
+            timeout=30
+        )
+        return response.json()
+    return await intercept("submit", f"{submit_url} {payload['url']}", send)
+
+async def answer_from_table(file_path: str, file_format: str, instructions: str, deadline: Deadline):
+    """
+    Streams a tabular file into compact columns, asks the LLM for an operation spec
+    using only its schema and a sample, then computes the exact answer locally.
+    Returns (answer or None, schema text).
+    """
+    from ingest import ingest_file
+    with span("parse", format=file_format):
+        ingested = await asyncio.to_thread(ingest_file, file_path, file_format)
+        df = ingested.to_dataframe()
+    logger.info("Parsed %d rows x %d columns from %s", ingested.rows, len(df.columns), file_format.upper())
+    # Whole-file aggregates stay exact even when only the first rows were kept
+    profiles = ingested.profiles if ingested.truncated else None
+    return await answer_from_dataframe(df, instructions, deadline, profiles=profiles, total_rows=ingested.rows)
+
+async def answer_from_dataframe(df, instructions: str, deadline: Deadline, profiles: dict | None = None,
+                                total_rows: int | None = None):
+    """Runs the spec-then-compute path over an already parsed table."""
+    from compute_engine import describe_table, execute_spec, execute_spec_on_profiles
+    schema = describe_table(df)
+    if total_rows is not None and total_rows > len(df):
+        schema = f"ROWS IN FILE: {total_rows} (schema and columns below cover the first {len(df)})\n" + schema
+
+    spec = await deadline.run(
+        "llm_spec",
+        get_operation_spec_async(schema, instructions, timeout=deadline.timeout(LLM_TIMEOUT)),
+        cap=LLM_TIMEOUT
+    )
+    if not spec:
+        return None, schema
+    logger.info("Operation spec: %s", json.dumps(spec))
+
+    if profiles is not None:
+        answer = execute_spec_on_profiles(profiles, spec)
+        if answer is not None:
+            logger.info("Computed answer from running aggregates: %s", answer)
+            return answer, schema
+        # Anything else would be computed over the first rows only and come out wrong
+        logger.warning("Spec needs all %d rows but only %d were kept, leaving it to the LLM", total_rows, len(df))
+        return None, schema
+
+    try:
+        with span("compute"):
+            answer = await asyncio.to_thread(execute_spec, df, spec)
+    except Exception as e:
+        logger.warning("Compute engine failed: %s", e)
+        return None, schema
+    logger.info("Computed answer: %s", answer)
+    return answer, schema
+
+async def compute_from_file(resource: Resource, instructions: str, deadline: Deadline, pdf_pages: list[int] | None):
+    """
+    Runs the compute engine over a downloaded table or PDF table.
+    Returns (answer or None, the table's schema text if it was parsed).
+    """
+    file_ext = resource.format.lower()
+    if file_ext == 'pdf':
+        # Only extract the pages the question mentions, and compute over tables when possible
+        with span("parse", format="pdf"):
+            pdf_tables = await asyncio.to_thread(extract_tables_from_pdf, resource.path, pdf_pages)
+        if pdf_tables:
+            from compute_engine import table_from_rows
+            largest = max(pdf_tables, key=lambda t: len(t["rows"]))
+            logger.info("Found %d table(s) in PDF, largest on page %d", len(pdf_tables), largest["page"])
+            try:
+                answer, _ = await answer_from_dataframe(table_from_rows(largest["rows"]), instructions, deadline)
+                return answer, None
+            except StageTimeout:
+                raise
+            except Exception as e:
+                logger.warning("Could not compute over PDF table: %s", e)
+    elif file_ext in TABLE_FORMATS:
+        try:
+            return await answer_from_table(resource.path, file_ext, instructions, deadline)
+        except StageTimeout:
+            raise
+        except Exception as e:
+            logger.warning("Could not parse %s as a table: %s", file_ext.upper(), e)
+    return None, None
+
+async def resource_text(resource: Resource, pdf_pages: list[int] | None, schema: str | None = None) -> str:
+    """Text of one fetched resource for the LLM: page text, PDF text, small files raw, big tables as a schema."""
+    if resource.kind == "page":
+        return resource.text
+    file_ext = resource.format.lower()
+    if file_ext == 'pdf':
+        with span("parse", format="pdf_text"):
+            text = await asyncio.to_thread(extract_text_from_pdf, resource.path, pdf_pages, True)
+        logger.info("Extracted %d characters from PDF", len(text))
+        return text
+    if file_ext in ['csv', 'json', 'txt'] and os.path.getsize(resource.path) <= RAW_DATA_FALLBACK_MAX_CHARS:
+        with open(resource.path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        logger.info("Read %d characters from %s", len(text), file_ext.upper())
+        return text
+    if schema:
+        return schema
+    if file_ext in TABLE_FORMATS:
+        from ingest import ingest_file
+        from compute_engine import describe_table
+        with span("parse", format=file_ext):
+            ingested = await asyncio.to_thread(ingest_file, resource.path, file_ext)
+        return f"ROWS IN FILE: {ingested.rows}\n" + describe_table(ingested.to_dataframe())
+    text = f"File downloaded but format {file_ext} needs manual parsing."
+    logger.warning(text)
+    return text
+
+async def answer_from_resources(resources: list[Resource], instructions: str, deadline: Deadline):
+    """
+    Computes the answer locally when the quiz links exactly one data file (a table
+    or a PDF), whatever else it links; otherwise, or if that fails, sends every
+    fetched resource to the LLM as one bundle, so questions spanning several
+    data files see all of them.
+    """
+    pdf_pages = parse_page_selection(instructions)
+    data_files = [r for r in resources if r.kind == "file" and (r.format in TABLE_FORMATS or r.format == "pdf")]
+    schemas = {}
+    if len(data_files) == 1:
+        answer, schemas[data_files[0].url] = await compute_from_file(data_files[0], instructions, deadline, pdf_pages)
+        if answer is not None:
+            return answer
+
+    async def text_of(resource: Resource) -> str:
+        # One unreadable resource must not sink the rest of the bundle
+        try:
+            return await resource_text(resource, pdf_pages, schemas.get(resource.url))
+        except Exception as e:
+            logger.warning("Could not read %s: %s", resource.url, e)
+            return f"Could not read this {resource.format} file: {type(e).__name__}"
+
+    texts = await asyncio.gather(*(text_of(r) for r in resources))
+    if len(resources) == 1:
+        raw_data = texts[0]
+    else:
+        raw_data = "\n\n".join(f"[RESOURCE {r.url} ({r.format})]\n{text}" for r, text in zip(resources, texts))
+
+    # Use LLM to perform the calculation based on the raw data
+    logger.info("Processing %d resource(s) with LLM", len(resources))
+    answer = await deadline.run(
+        "llm_answer",
+        process_data_with_llm_async(raw_data, instructions, timeout=deadline.timeout(LLM_TIMEOUT)),
+        cap=LLM_TIMEOUT
+    )
+    logger.info("Generated answer: %s", answer)
+    return answer
+
+async def table_from_resources(resources: list[Resource], instructions: str):
+    """The first linked table file (or the largest PDF table) as a DataFrame, or None."""
+    for resource in resources:
+        file_ext = (resource.format or "").lower()
+        if resource.kind != "file":
+            continue
+        if file_ext in TABLE_FORMATS:
+            from ingest import ingest_file
+            with span("parse", format=file_ext):
+                ingested = await asyncio.to_thread(ingest_file, resource.path, file_ext)
+            if ingested.truncated:
+                logger.warning("Charting the first %d of %d rows", len(ingested.to_dataframe()), ingested.rows)
+            return ingested.to_dataframe()
+        if file_ext == 'pdf':
+            with span("parse", format="pdf"):
+                pdf_tables = await asyncio.to_thread(extract_tables_from_pdf, resource.path, parse_page_selection(instructions))
+            if pdf_tables:
+                from compute_engine import table_from_rows
+                return table_from_rows(max(pdf_tables, key=lambda t: len(t["rows"]))["rows"])
+    return None
+
+async def answer_with_chart(resources: list[Resource], instructions: str, deadline: Deadline) -> str | None:
+    """
+    Asks the LLM for a chart spec over the linked table (or data quoted in the
+    question) and draws it locally; the answer is the chart as a data URI.
+    """
+    from compute_engine import describe_table
+    df = await table_from_resources(resources, instructions)
+    schema = describe_table(df) if df is not None else "NO TABLE FILE: take the values from the question."
+    spec = await deadline.run(
+        "llm_spec",
+        get_chart_spec_async(schema, instructions, timeout=deadline.timeout(LLM_TIMEOUT)),
+        cap=LLM_TIMEOUT
+    )
+    if not spec:
+        return None
+    logger.info("Chart spec: %s", json.dumps(spec))
+    return await deadline.run("render", render_chart(df, spec), cap=60)
+
+async def run_quiz_chain(job: Job) -> dict:
+    """
+    Orchestrates the agent to solve and submit the answer for every quiz in the chain.
+    The 3-minute budget is counted from when the job was received, not when it started.
+    Linked files and pages are cached for the whole chain and removed when it ends.
+    """
+    resource_cache = ResourceCache(make_scratch_dir(job.id))
+    try:
+        return await _run_quiz_chain(job, resource_cache)
+    finally:
+        resource_cache.cleanup()
+
+async def _run_quiz_chain(job: Job, resource_cache: ResourceCache) -> dict:
+    start_time = job.created_at
+    deadline = Deadline(start=start_time)
+    current_quiz_url = job.url
     quiz_count = 0
+    start_trace(job_id=job.id)
     
     while current_quiz_url:
-        quiz_count += 1
-        print(f"\n{'─'*60}")
-        print(f"🔍 Quiz #{quiz_count}: {current_quiz_url}")
-        print(f"{'─'*60}")
-        
         # Check remaining time before starting a new cycle
-        elapsed_time = time.time() - start_time
-        if elapsed_time > (3 * 60 - 30):  # 2:30 buffer
-            print("⏰ Time limit approaching (2:30 elapsed). Aborting new quiz cycle.")
+        elapsed_time = deadline.elapsed()
+        if deadline.remaining() < NEW_QUIZ_MIN_REMAINING:
+            logger.warning("Time limit approaching (%.0fs elapsed). Aborting new quiz cycle.", elapsed_time)
+            if not quiz_count:
+                # Nothing was attempted: report the job as failed rather than completed
+                raise TimeoutError(f"Budget ran out before the first quiz ({elapsed_time:.0f}s elapsed)")
             break
-        
-        print(f"⏱️  Elapsed time: {elapsed_time:.1f}s / 180s")
+
+        quiz_count += 1
+        # Spans and log lines from here on (and tasks started for this quiz) carry its number
+        bind_trace(quiz=quiz_count, task_type="unknown")
+        logger.info("Quiz #%d: %s", quiz_count, current_quiz_url, extra={"url": current_quiz_url})
+        logger.info("Elapsed time: %.1fs / %.0fs", elapsed_time, deadline.budget)
+        quiz_entry = job.add_quiz(current_quiz_url)
+        JOB_MANAGER.publish(job)
+        cut_short = False
         
         # --- A. Fetch Quiz Instructions (Headless Browser) ---
         try:
-            instructions, submit_url = await get_quiz_details(current_quiz_url)
+            fetch_timeout = deadline.timeout(60)
+            instructions, submit_url, page_links = await deadline.run(
+                "fetch", get_quiz_details(current_quiz_url, timeout=fetch_timeout), cap=fetch_timeout + 5
+            )
         except Exception as e:
-            print(f"❌ Failed to fetch quiz details: {e}")
+            logger.error("Failed to fetch quiz details: %s", e)
+            quiz_entry.update(status="failed", error=f"fetch failed: {e}")
+            QUIZZES_FAILED.labels("fetch").inc()
             break
         
         if "ERROR" in instructions or not submit_url:
-            print(f"❌ Failed to retrieve valid quiz details or submit URL.")
-            print(f"Instructions preview: {instructions[:200]}...")
+            logger.error("Failed to retrieve valid quiz details or submit URL", extra={"preview": instructions[:200]})
+            quiz_entry.update(status="failed", error="no quiz details or submit URL")
+            QUIZZES_FAILED.labels("fetch").inc()
             break
 
-        print(f"✅ Retrieved quiz instructions ({len(instructions)} chars)")
-        print(f"📤 Submit URL: {submit_url}\n")
+        logger.info("Retrieved quiz instructions (%d chars), submit URL: %s", len(instructions), submit_url)
+        links = extract_links(instructions, page_links, current_quiz_url, exclude={submit_url})
+        if links:
+            logger.info("Found %d linked resource(s)", len(links), extra={"links": links})
+
+        def fetch_links():
+            return deadline.run(
+                "download", fetch_resources(links, resource_cache, deadline), cap=deadline.timeout(60) + 5
+            )
 
         # --- B. LLM Plan Generation ---
+        # In speculative mode the direct answer and the linked resources start now,
+        # and whichever the plan doesn't need is cancelled once it arrives.
+        speculative_answer = None
+        prefetch = None
+        if SPECULATIVE_MODE:
+            speculative_answer = asyncio.create_task(deadline.run(
+                "llm_answer",
+                process_data_with_llm_async(instructions, DIRECT_ANSWER_INSTRUCTION, timeout=deadline.timeout(LLM_TIMEOUT), reduce=False),
+                cap=LLM_TIMEOUT
+            ))
+            if links:
+                logger.info("Prefetching %d resource(s)", len(links))
+                prefetch = asyncio.create_task(fetch_links())
+
         try:
-            plan_data = get_solution_plan(instructions)
+            try:
+                plan_data = await deadline.run(
+                    "llm_plan",
+                    get_solution_plan_async(instructions, timeout=deadline.timeout(LLM_TIMEOUT)),
+                    cap=LLM_TIMEOUT
+                )
+            except StageTimeout as e:
+                # Still try a direct answer rather than giving up on the quiz
+                plan_data = {"task_type": "ERROR", "plan": [str(e)]}
             task_type = plan_data.get('task_type', 'ANALYZE')
             steps = plan_data.get('plan', [])
             
-            print(f"🎯 Task Type: {task_type}")
-            print(f"📋 Plan: {json.dumps(steps, indent=2)}\n")
+            quiz_entry["task_type"] = task_type
+            bind_trace(task_type=task_type)
+            QUIZZES_ATTEMPTED.labels(task_type).inc()
+            logger.info("Task type: %s", task_type, extra={"plan": steps})
         except Exception as e:
-            print(f"❌ LLM planning failed: {e}")
+            logger.error("LLM planning failed: %s", e)
+            quiz_entry.update(status="failed", error=f"planning failed: {e}")
+            QUIZZES_FAILED.labels("plan").inc()
+            await discard_task(speculative_answer)
+            await discard_task(prefetch)
             break
+
+        # SCRAPE quizzes that link elsewhere are answered from what they link to
+        uses_resources = task_type == 'DOWNLOAD' or (task_type == 'SCRAPE' and bool(links))
+        if uses_resources:
+            await discard_task(speculative_answer)
+            speculative_answer = None
+        elif prefetch is not None and task_type != 'VISUALIZE':
+            # Charts are drawn from the linked data; their speculative text answer stays as a fallback
+            await discard_task(prefetch)
+            prefetch = None
         
         final_answer = None
         
         # --- C. Execute Plan (Data Sourcing & Analysis) ---
         
-        if task_type == 'DOWNLOAD':
-            # Look for a download link in the instructions
-            download_match = re.search(r"href=['\"]([^'\"]+\.(?:pdf|csv|json|xlsx?))['\"]", instructions, re.IGNORECASE)
-            if not download_match:
-                download_match = re.search(r"(https?://[^\s\"'<>]+\.(?:pdf|csv|json|xlsx?))", instructions, re.IGNORECASE)
-            
-            if download_match:
-                file_url = download_match.group(1)
-                print(f"📥 Downloading file: {file_url}")
-                
-                # Determine file extension
-                file_ext = re.search(r'\.([^.]+)$', file_url)
-                file_ext = file_ext.group(1) if file_ext else 'pdf'
-                temp_file_path = f"/tmp/quiz_data_{os.getpid()}.{file_ext}"
-                
-                try:
-                    if await download_file(file_url, temp_file_path):
-                        print(f"✅ File downloaded to {temp_file_path}")
-                        
-                        if file_ext.lower() == 'pdf':
-                            raw_data = extract_text_from_pdf(temp_file_path)
-                            print(f"📄 Extracted {len(raw_data)} characters from PDF")
-                        elif file_ext.lower() in ['csv', 'json', 'txt']:
-                            with open(temp_file_path, 'r', encoding='utf-8') as f:
-                                raw_data = f.read()
-                            print(f"📄 Read {len(raw_data)} characters from {file_ext.upper()}")
-                        else:
-                            raw_data = f"File downloaded but format {file_ext} needs manual parsing."
-                            print(f"⚠️  {raw_data}")
-
-                        # Use LLM to perform the calculation based on the raw data
-                        print("🤖 Processing data with LLM...")
-                        final_answer = process_data_with_llm(raw_data, instructions)
-                        print(f"💡 Generated answer: {final_answer}")
-                    else:
-                        print("❌ File download failed")
-                        
-                except Exception as e:
-                    print(f"❌ Error processing file: {e}")
-                finally:
-                    # Clean up the file
-                    if os.path.exists(temp_file_path):
-                        os.remove(temp_file_path)
-                        print(f"🗑️  Cleaned up temp file")
-            else:
-                print("❌ No download URL found in instructions")
+        if task_type == 'VISUALIZE':
+            try:
+                resources = []
+                if prefetch is not None:
+                    resources = await prefetch
+                elif links:
+                    resources = await fetch_links()
+                final_answer = await answer_with_chart([r for r in resources if r.ok], instructions, deadline)
+            except StageTimeout:
+                cut_short = True
+            except Exception as e:
+                logger.warning("Could not render a chart, answering with text: %s", e)
+
+        if uses_resources and links:
+            try:
+                if prefetch is not None:
+                    logger.info("Waiting for prefetched resources")
+                    resources = await prefetch
+                else:
+                    logger.info("Fetching %d resource(s)", len(links))
+                    resources = await fetch_links()
+                fetched = [r for r in resources if r.ok]
+                if fetched:
+                    final_answer = await answer_from_resources(fetched, instructions, deadline)
+                else:
+                    logger.error("File download failed")
+            except StageTimeout:
+                cut_short = True
+            except Exception as e:
+                logger.error("Error processing file: %s", e)
+
+        elif task_type == 'DOWNLOAD':
+            logger.error("No download URL found in instructions")
         
         elif task_type == 'SCRAPE':
             # For complex scraping tasks, pass the page content to the LLM
-            print("🤖 Processing scraped content with LLM...")
-            final_answer = process_data_with_llm(instructions, "Extract and calculate the final answer based on these instructions.")
+            logger.info("Processing scraped content with LLM")
+            try:
+                if speculative_answer is not None:
+                    # The speculative direct answer already has the page content
+                    final_answer = await speculative_answer
+                else:
+                    final_answer = await deadline.run(
+                    "llm_answer",
+                        process_data_with_llm_async(instructions, "Extract and calculate the final answer based on these instructions.",
+                                                    timeout=deadline.timeout(LLM_TIMEOUT), reduce=False),
+                        cap=LLM_TIMEOUT
+                    )
+            except StageTimeout:
+                cut_short = True
+
+        elif task_type in ['ANALYZE', 'VISUALIZE', 'ERROR'] and final_answer is None and (
+                not cut_short or speculative_answer is not None):
+            # Use LLM to solve analytical questions directly from instructions. A chart
+            # that ran out of time still falls back to the speculative answer, which is
+            # bounded by its own stage timeout and may already be done.
+            logger.info("Analyzing with LLM")
+            try:
+                if speculative_answer is not None:
+                    final_answer = await speculative_answer
+                else:
+                    final_answer = await deadline.run(
+                        "llm_answer",
+                        process_data_with_llm_async(instructions, DIRECT_ANSWER_INSTRUCTION, timeout=deadline.timeout(LLM_TIMEOUT), reduce=False),
+                        cap=LLM_TIMEOUT
+                    )
+            except StageTimeout:
+                cut_short = True
 
-        elif task_type in ['ANALYZE', 'VISUALIZE', 'ERROR']:
-            # Use LLM to solve analytical questions directly from instructions
-            print("🤖 Analyzing with LLM...")
-            final_answer = process_data_with_llm(instructions, "Solve the quiz based on the provided instructions. Output ONLY the final answer value.")
+        # Nothing speculative may outlive its quiz (no-op for tasks already awaited)
+        await discard_task(speculative_answer)
+        await discard_task(prefetch)
+
+        if cut_short and (final_answer is None or final_answer == ""):
+            # Post something before the hard limit; a wrong answer may still unlock the next URL
+            logger.warning("Answering was cut short, submitting best-effort answer: %s", BEST_EFFORT_ANSWER)
+            final_answer = BEST_EFFORT_ANSWER
         
         # --- D. Submit Answer ---
         
-        if final_answer:
+        if final_answer is not None and final_answer != "":
             # Attempt to convert answer to the required type
+            # (answers computed locally are already typed)
             original_answer = final_answer
-            try:
-                # Remove common text artifacts
-                final_answer = final_answer.strip().strip('"\'')
-                
-                # Try to convert to a number if it looks like one
-                if re.match(r'^-?\d+$', final_answer):
-                    final_answer = int(final_answer)
-                elif re.match(r'^-?\d+\.\d+$', final_answer):
-                    final_answer = float(final_answer)
-                elif final_answer.lower() in ['true', 'false']:
-                    final_answer = final_answer.lower() == 'true'
-            except Exception as e:
-                print(f"⚠️  Could not convert answer type: {e}")
-                final_answer = original_answer
+            if isinstance(final_answer, str):
+                try:
+                    # Remove common text artifacts
+                    final_answer = final_answer.strip().strip('"\'')
+                    
+                    # Try to convert to a number if it looks like one
+                    if re.match(r'^-?\d+$', final_answer):
+                        final_answer = int(final_answer)
+                    elif re.match(r'^-?\d+\.\d+$', final_answer):
+                        final_answer = float(final_answer)
+                    elif final_answer.lower() in ['true', 'false']:
+                        final_answer = final_answer.lower() == 'true'
+                except Exception as e:
+                    logger.warning("Could not convert answer type: %s", e)
+                    final_answer = original_answer
 
             submission_payload = {
                 "email": STUDENT_EMAIL,
@@ -186,59 +578,60 @@ async def solve_quiz_task(task: QuizTask, request: Request):
                 "answer": final_answer
             }
 
-            print(f"\n📤 Submitting answer: {final_answer} (type: {type(final_answer).__name__})")
-            print(f"📤 To: {submit_url}")
+            logger.info("Submitting answer: %s (type: %s) to %s", final_answer, type(final_answer).__name__, submit_url)
             
             try:
-                response = requests.post(
-                    submit_url, 
-                    json=submission_payload,
-                    headers={'Content-Type': 'application/json'},
-                    timeout=30
+                response_data = await deadline.run(
+                    "submit", post_answer(submit_url, submission_payload, deadline), reserve=0
                 )
-                
-                response_data = response.json()
                 is_correct = response_data.get('correct', False)
                 new_url = response_data.get('url')
                 reason = response_data.get('reason')
                 
                 if is_correct:
-                    print(f"✅ CORRECT!")
+                    QUIZZES_CORRECT.labels(task_type).inc()
+                    logger.info("Correct", extra={"response": response_data})
                 else:
-                    print(f"❌ INCORRECT")
-                    if reason:
-                        print(f"   Reason: {reason}")
-                
-                print(f"📊 Response: {json.dumps(response_data, indent=2)}")
+                    QUIZZES_INCORRECT.labels(task_type).inc()
+                    logger.info("Incorrect: %s", reason, extra={"response": response_data})
+                quiz_entry.update(
+                    status="correct" if is_correct else "incorrect",
+                    answer=final_answer,
+                    reason=reason,
+                    elapsed=deadline.elapsed()
+                )
 
                 if is_correct and new_url:
                     current_quiz_url = new_url
-                    print(f"➡️  Moving to next quiz: {new_url}")
+                    logger.info("Moving to next quiz: %s", new_url)
                 elif new_url:
                     # Incorrect but can skip to next
                     current_quiz_url = new_url
-                    print(f"⏭️  Skipping to next quiz: {new_url}")
+                    logger.info("Skipping to next quiz: %s", new_url)
                 else:
-                    print("🏁 No more quizzes. Stopping.")
+                    logger.info("No more quizzes. Stopping.")
                     break
 
-            except requests.exceptions.Timeout:
-                print("❌ Submission timed out.")
+            except (httpx.TimeoutException, StageTimeout):
+                logger.error("Submission timed out")
+                quiz_entry.update(status="failed", answer=final_answer, error="submission timed out")
+                QUIZZES_FAILED.labels("submit_timeout").inc()
                 break
             except Exception as e:
-                print(f"❌ Submission failed: {e}")
+                logger.error("Submission failed: %s", e)
+                quiz_entry.update(status="failed", answer=final_answer, error=f"submission failed: {e}")
+                QUIZZES_FAILED.labels("submit").inc()
                 break
         
         else:
-            print("❌ Failed to generate a final answer. Stopping.")
+            logger.error("Failed to generate a final answer. Stopping.")
+            quiz_entry.update(status="failed", error="no answer generated")
+            QUIZZES_FAILED.labels("no_answer").inc()
             break
 
-    total_time = time.time() - start_time
-    print(f"\n{'='*60}")
-    print(f"🏁 TASK COMPLETE")
-    print(f"⏱️  Total Time: {total_time:.2f} seconds")
-    print(f"📊 Quizzes Attempted: {quiz_count}")
-    print(f"{'='*60}\n")
+    total_time = deadline.elapsed()
+    logger.info("Task complete in %.2fs, %d quizzes attempted", total_time, quiz_count,
+                extra={"total_time": total_time, "quizzes_attempted": quiz_count})
     
     return {
         "status": "processing_complete", 
@@ -247,6 +640,95 @@ async def solve_quiz_task(task: QuizTask, request: Request):
         "final_url_attempted": current_quiz_url
     }
 
+# Several uvicorn workers share a cap on running chains and publish job states,
+# since a job's status may be polled through any of them
+JOB_MANAGER = JobManager(
+    profile_chains(record_chains(run_quiz_chain)),
+    slots=ProcessSemaphore("chains", GLOBAL_MAX_CHAINS) if WORKER_COUNT > 1 else None,
+    state_dir=os.path.join(SHARED_STATE_DIR, "jobs") if WORKER_COUNT > 1 else None,
+    # A chain's budget starts when it is received; past this it could not start a quiz
+    max_wait=QUIZ_TIME_BUDGET - NEW_QUIZ_MIN_REMAINING,
+)
+register_gauge("quiz_active_chains", "Quiz chains currently running", lambda: JOB_MANAGER.active)
+register_gauge("quiz_queued_chains", "Quiz chains waiting for a worker", lambda: JOB_MANAGER.stats()["queued"])
+register_gauge("browser_pool_size", "Maximum concurrent browser contexts", lambda: BROWSER_POOL.size)
+register_gauge("browser_pool_in_use", "Browser contexts currently checked out", lambda: BROWSER_POOL.stats()["in_use"])
+register_gauge("browser_pool_idle", "Idle browser contexts kept for reuse", lambda: BROWSER_POOL.stats()["idle"])
+register_gauge("quiz_warm", "1 once the startup warm-up has finished", lambda: 1 if WARMUP.state == "warm" else 0)
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = JOB_MANAGER.lookup(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown job id.")
+    return job
+
+@app.get("/llm-cache")
+def llm_cache_stats():
+    return LLM_CACHE.stats()
+
+def require_admin(request: Request):
+    """
+    Guards destructive endpoints: the caller must send ADMIN_TOKEN (or, when that
+    is not set, the student secret) in an X-Admin-Token header.
+    """
+    expected = ADMIN_TOKEN or STUDENT_SECRET
+    token = request.headers.get("x-admin-token", "")
+    if not expected or not secrets.compare_digest(token.encode("utf-8"), expected.encode("utf-8")):
+        logger.warning("Rejected unauthenticated admin request to %s", request.url.path)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or missing admin token.")
+
+@app.delete("/llm-cache/{key}")
+def invalidate_llm_cache_entry(key: str, request: Request):
+    require_admin(request)
+    if not LLM_CACHE.invalidate(key):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No cache entry for that key.")
+    return {"invalidated": key}
+
+@app.delete("/llm-cache")
+def clear_llm_cache(request: Request):
+    require_admin(request)
+    LLM_CACHE.clear()
+    return {"cleared": True}
+
+@app.get("/stage-stats")
+def get_stage_stats():
+    return stage_stats()
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of stage latencies, quiz outcomes and pool gauges."""
+    return Response(content=metrics_text(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/profiles")
+def get_profiles():
+    return {"profiles": list_profiles()}
+
+@app.get("/profiles/{job_id}")
+def get_profile(job_id: str):
+    """Summary of a profiled chain: top frames by wall time and allocation stats."""
+    path = profile_path(job_id, "json")
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No profile for that job (yet).")
+    return FileResponse(path, media_type="application/json")
+
+@app.get("/profiles/{job_id}/folded")
+def get_profile_folded(job_id: str):
+    """Folded stacks for flamegraph.pl, speedscope or inferno."""
+    path = profile_path(job_id, "folded")
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No profile for that job (yet).")
+    return FileResponse(path, media_type="text/plain", filename=f"{job_id}.folded")
+
+@app.get("/ready")
+def readiness():
+    """
+    Readiness, separate from /health: 503 until the startup warm-up has finished.
+    Reports warm/cold state, per-step warm-up timings and module import time.
+    """
+    body = {**WARMUP.status(), "import_seconds": IMPORT_SECONDS}
+    return JSONResponse(body, status_code=status.HTTP_200_OK if WARMUP.ready else status.HTTP_503_SERVICE_UNAVAILABLE)
+
 # --- Health Check ---
 @app.get("/health")
 def health_check():
@@ -254,7 +736,16 @@ def health_check():
         "status": "ok", 
         "email": STUDENT_EMAIL,
         "secret_configured": bool(STUDENT_SECRET),
-        "openai_key_configured": bool(os.getenv("OPENAI_API_KEY"))
+        "openai_key_configured": bool(os.getenv("OPENAI_API_KEY")),
+        "browser_pool": BROWSER_POOL.stats(),
+        "page_fetch": page_fetch_stats(),
+        "http": http_stats(),
+        "context_reducer": reducer_stats(),
+        "llm_hedging": hedging_stats(),
+        "jobs": JOB_MANAGER.stats(),
+        "worker": {"pid": os.getpid(), "workers": WORKER_COUNT},
+        "artifact_cache": ARTIFACT_CACHE.stats(),
+        "charts": chart_stats()
     }
 
 @app.get("/")
@@ -263,8 +754,14 @@ def root():
         "message": "LLM Quiz Solver API",
         "endpoints": {
             "health": "/health",
+            "ready": "/ready",
             "docs": "/docs",
-            "solve": "/solve-quiz (POST)"
+            "solve": "/solve-quiz (POST)",
+            "jobs": "/jobs/{job_id}",
+            "llm_cache": "/llm-cache",
+            "stage_stats": "/stage-stats",
+            "metrics": "/metrics",
+            "profiles": "/profiles/{job_id}"
         }
     }
 
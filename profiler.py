@@ -0,0 +1,297 @@
+# Opt-in per-chain profiling. A chain is profiled when its request asks for it
+# (`X-Profile: 1` header or `"profile": true` in the body) or when it is picked
+# by PROFILE_SAMPLE_RATE. While it runs, a sampler thread records the await
+# stack of every task the chain spawned (wall-clock, so time spent waiting on
+# the network, the browser or the LLM shows up, not only CPU time), and
+# allocation counters are compared before and after. The result is saved as
+# folded stacks (flamegraph.pl, speedscope, inferno) plus a JSON summary:
+#
+#     curl localhost:8000/profiles/<job_id>/folded > chain.folded
+#     flamegraph.pl chain.folded > chain.svg
+#
+# Chains that are not profiled only pay for one attribute check.
+
+import gc
+import os
+import sys
+import json
+import resource
+import time
+import random
+import asyncio
+import threading
+import contextvars
+import tracemalloc
+from collections import Counter
+from shared_state import SHARED_STATE_DIR, write_atomic
+from telemetry import get_logger
+
+logger = get_logger("profiler")
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(SHARED_STATE_DIR, "profiles"))
+# Set to a stack depth (e.g. 1) to also list the top allocation sites with tracemalloc.
+# Off by default: it slows allocation-heavy stages such as table parsing several
+# times over, which also skews the wall-clock profile.
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "0"))
+PROFILE_TOP_N = 25
+
+_ACTIVE: contextvars.ContextVar = contextvars.ContextVar("chain_profile", default=None)
+_LOCK = threading.Lock()
+_RUNNING: set = set()
+_PREVIOUS_FACTORY = None
+_STARTED_TRACEMALLOC = False
+
+
+def should_profile(requested: bool = False) -> bool:
+    return requested or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+
+def _allocation_counters() -> dict:
+    gc_stats = gc.get_stats()
+    return {
+        "allocated_blocks": sys.getallocatedblocks(),
+        "gc_collections": sum(g["collections"] for g in gc_stats),
+        "gc_collected": sum(g["collected"] for g in gc_stats),
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})".replace(";", ",")
+
+
+def _await_stack(coro) -> list[str]:
+    """Logical stack of a suspended coroutine, outermost first, following what each frame awaits."""
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            if isinstance(coro, asyncio.Future):
+                stack.append("<future>")
+            break
+        stack.append(_frame_label(frame))
+        if frame.f_code.co_name == "to_thread":
+            # Name the function the thread is running instead of an anonymous future
+            func = frame.f_locals.get("func")
+            stack.append(f"[thread] {getattr(func, '__qualname__', func)}")
+            break
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return stack
+
+
+def _creator_stack(frame, task) -> list[str]:
+    """Frames from `task`'s coroutine down to `frame`, for rooting the tasks it creates."""
+    root = getattr(task.get_coro(), "cr_frame", None)
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        if frame is root:
+            return [_frame_label(f) for f in reversed(frames)]
+        frame = frame.f_back
+    return []
+
+
+def _running_stack(thread_frame, coro) -> list[str] | None:
+    """Stack of the task currently executing on the loop thread, from its coroutine down to the leaf."""
+    root = getattr(coro, "cr_frame", None)
+    frames = []
+    frame = thread_frame
+    while frame is not None:
+        frames.append(frame)
+        if frame is root:
+            return [_frame_label(f) for f in reversed(frames)]
+        frame = frame.f_back
+    return None
+
+
+class ChainProfile:
+    """Samples the tasks of one chain until stopped, then writes the artifacts."""
+
+    def __init__(self, job_id: str, interval: float = PROFILE_INTERVAL):
+        self.job_id = job_id
+        self.interval = interval
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        # Task -> stack of the task that created it, so child tasks appear under their creator
+        self.tasks: dict = {}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = time.perf_counter()
+        self.duration = None
+        self.counters = _allocation_counters()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop, name=f"profiler-{job_id[:8]}", daemon=True)
+
+    def _sample_loop(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            # Weight by the real time since the last sample: ticks run late when the GIL is busy
+            now = time.perf_counter()
+            try:
+                self._sample(now - last)
+            except RuntimeError:
+                # The task dict changed mid-iteration; the next tick covers this one's time
+                continue
+            last = now
+
+    def add_task(self, task, creator=None):
+        prefix = []
+        if creator is not None and creator in self.tasks:
+            prefix = self.tasks[creator] + _creator_stack(sys._getframe(2), creator)
+        self.tasks[task] = prefix
+
+    def _sample(self, weight: float):
+        current = asyncio.current_task(self.loop)
+        thread_frame = sys._current_frames().get(self.loop_thread) if current in self.tasks else None
+        for task, prefix in list(self.tasks.items()):
+            if task.done():
+                continue
+            coro = task.get_coro()
+            stack = None
+            if task is current and thread_frame is not None:
+                stack = _running_stack(thread_frame, coro)
+            if stack is None:
+                stack = _await_stack(coro)
+            if stack:
+                self.stacks[";".join(prefix + stack)] += weight
+        self.samples += 1
+
+    def start(self):
+        self.add_task(asyncio.current_task())
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def folded(self) -> str:
+        """One "frame;frame;... count" line per distinct stack, counted in milliseconds."""
+        return "\n".join(f"{stack} {max(1, round(seconds * 1000))}" for stack, seconds in self.stacks.most_common()) + "\n"
+
+    def summary(self, allocations: dict) -> dict:
+        inclusive: Counter = Counter()
+        leaf: Counter = Counter()
+        for stack, seconds in self.stacks.items():
+            frames = stack.split(";")
+            leaf[frames[-1]] += seconds
+            for frame in set(frames):
+                inclusive[frame] += seconds
+        return {
+            "job_id": self.job_id,
+            "duration_seconds": round(self.duration, 3),
+            "interval_seconds": self.interval,
+            "samples": self.samples,
+            "tasks": len(self.tasks),
+            # Every live task of the chain is sampled, so concurrent work adds up to more than the wall time
+            "top_inclusive": [{"frame": f, "seconds": round(s, 3)} for f, s in inclusive.most_common(PROFILE_TOP_N)],
+            "top_leaf": [{"frame": f, "seconds": round(s, 3)} for f, s in leaf.most_common(PROFILE_TOP_N)],
+            "allocations": allocations,
+        }
+
+
+def _task_factory(loop, coro, **kwargs):
+    task = _PREVIOUS_FACTORY(loop, coro, **kwargs) if _PREVIOUS_FACTORY else asyncio.Task(coro, loop=loop, **kwargs)
+    # The new task runs in a copy of its creator's context, so it belongs to the creator's profile
+    context = kwargs.get("context")
+    profile = context.get(_ACTIVE) if context is not None else _ACTIVE.get()
+    if profile is not None:
+        profile.add_task(task, asyncio.current_task(loop))
+    return task
+
+
+def _begin(profile: ChainProfile):
+    global _PREVIOUS_FACTORY, _STARTED_TRACEMALLOC
+    with _LOCK:
+        if not _RUNNING:
+            _PREVIOUS_FACTORY = profile.loop.get_task_factory()
+            profile.loop.set_task_factory(_task_factory)
+            if PROFILE_TRACEMALLOC_FRAMES > 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+                _STARTED_TRACEMALLOC = True
+        _RUNNING.add(profile)
+
+
+def _end(profile: ChainProfile) -> dict:
+    global _PREVIOUS_FACTORY, _STARTED_TRACEMALLOC
+    end = _allocation_counters()
+    allocations = {
+        # Allocation counters are process-wide: concurrent chains share these numbers
+        "scope": "process",
+        "allocated_blocks_delta": end["allocated_blocks"] - profile.counters["allocated_blocks"],
+        "gc_collections": end["gc_collections"] - profile.counters["gc_collections"],
+        "gc_collected": end["gc_collected"] - profile.counters["gc_collected"],
+        "peak_rss_bytes": end["peak_rss_bytes"],
+        "peak_rss_growth_bytes": end["peak_rss_bytes"] - profile.counters["peak_rss_bytes"],
+    }
+    with _LOCK:
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:PROFILE_TOP_N]
+            allocations["tracemalloc"] = {
+                "current_bytes": current,
+                "peak_bytes": peak,
+                "top": [
+                    {"where": f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+                     "bytes": s.size, "count": s.count}
+                    for s in top
+                ],
+            }
+        _RUNNING.discard(profile)
+        if not _RUNNING:
+            profile.loop.set_task_factory(_PREVIOUS_FACTORY)
+            _PREVIOUS_FACTORY = None
+            if _STARTED_TRACEMALLOC:
+                tracemalloc.stop()
+                _STARTED_TRACEMALLOC = False
+    return allocations
+
+
+def _save(profile: ChainProfile, allocations: dict) -> str:
+    base = os.path.join(PROFILE_DIR, profile.job_id)
+    write_atomic(base + ".folded", profile.folded().encode("utf-8"))
+    write_atomic(base + ".json", json.dumps(profile.summary(allocations), indent=2).encode("utf-8"))
+    return base
+
+
+def profile_chains(runner):
+    """Wraps a JobManager runner so jobs with `profile` set are profiled."""
+
+    async def profiled(job) -> dict:
+        if not job.profile:
+            return await runner(job)
+        profile = ChainProfile(job.id)
+        _begin(profile)
+        token = _ACTIVE.set(profile)
+        profile.start()
+        try:
+            return await runner(job)
+        finally:
+            _ACTIVE.reset(token)
+            profile.stop()
+            allocations = _end(profile)
+            try:
+                path = await asyncio.to_thread(_save, profile, allocations)
+                logger.info("Saved profile of job %s (%d samples) to %s.*", job.id, profile.samples, path)
+            except OSError as e:
+                logger.warning("Could not save profile of job %s: %s", job.id, e)
+
+    return profiled
+
+
+def profile_path(job_id: str, kind: str) -> str | None:
+    """Path of a saved profile artifact ("folded" or "json"), or None."""
+    if kind not in ("folded", "json") or not all(c in "0123456789abcdef" for c in job_id):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{job_id}.{kind}")
+    return path if os.path.exists(path) else None
+
+
+def list_profiles() -> list[str]:
+    try:
+        return sorted(name[:-len(".json")] for name in os.listdir(PROFILE_DIR) if name.endswith(".json"))
+    except OSError:
+        return []
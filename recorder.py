@@ -0,0 +1,230 @@
+# Record/replay of quiz chains. With CHAIN_RECORD_DIR set, every external
+# interaction of a chain (quiz pages, downloaded files, LLM exchanges, submit
+# responses) is saved to one zip archive per job. Replaying an archive serves
+# those interactions back in place of the network, browser and LLM:
+#
+#     python recorder.py replay /tmp/quiz_recordings/<job_id>.zip [--timing strip]
+#     python recorder.py show /tmp/quiz_recordings/<job_id>.zip
+
+import os
+import sys
+import json
+import time
+import asyncio
+import zipfile
+import argparse
+import contextvars
+from collections import deque
+from telemetry import get_logger
+
+logger = get_logger("recorder")
+
+CHAIN_RECORD_DIR = os.getenv("CHAIN_RECORD_DIR", "")
+ARCHIVE_VERSION = 1
+
+_SESSION: contextvars.ContextVar = contextvars.ContextVar("chain_session", default=None)
+
+
+class ReplayMissError(Exception):
+    """Raised when a replayed chain makes a call the archive has no recording for."""
+
+
+class ReplayedError(Exception):
+    """Re-raises an error that the recorded call originally failed with."""
+
+
+class Recording:
+    """Collects the interactions of one chain and writes them out as a zip archive."""
+
+    def __init__(self, job_id: str, url: str):
+        self.job_id = job_id
+        self.url = url
+        self.started = time.time()
+        self.entries: list[dict] = []
+        self.blobs: dict[str, bytes] = {}
+
+    async def handle(self, kind: str, key: str, call, file_path: str | None):
+        entry = {"kind": kind, "key": key, "offset": round(time.time() - self.started, 4)}
+        started = time.perf_counter()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            # Kept so a replayed speculative call doesn't take a later call's recording
+            entry.update(duration=round(time.perf_counter() - started, 4), cancelled=True)
+            self.entries.append(entry)
+            raise
+        except Exception as e:
+            entry.update(duration=round(time.perf_counter() - started, 4), error=f"{type(e).__name__}: {e}")
+            self.entries.append(entry)
+            raise
+        entry.update(duration=round(time.perf_counter() - started, 4), result=result)
+        if file_path and result and os.path.exists(file_path):
+            entry["blob"] = f"files/{len(self.blobs):04d}"
+            with open(file_path, "rb") as f:
+                self.blobs[entry["blob"]] = f.read()
+        self.entries.append(entry)
+        return result
+
+    def save(self, directory: str, result: dict | None = None) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.job_id}.zip")
+        manifest = {
+            "version": ARCHIVE_VERSION,
+            "job_id": self.job_id,
+            "url": self.url,
+            "recorded_at": self.started,
+            "duration": time.time() - self.started,
+            "result": result,
+            "entries": self.entries,
+        }
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("manifest.json", json.dumps(manifest, default=str))
+            for name, data in self.blobs.items():
+                archive.writestr(name, data)
+        return path
+
+
+class Replay:
+    """
+    Serves a recorded chain's interactions back by (kind, key). Calls whose key
+    changed since recording (e.g. an edited prompt) get the next unused
+    recording of the same kind. With `preserve_timing` each call takes as long
+    as it originally did.
+    """
+
+    def __init__(self, path: str, preserve_timing: bool = True):
+        self.path = path
+        self.preserve_timing = preserve_timing
+        with zipfile.ZipFile(path) as archive:
+            self.manifest = json.loads(archive.read("manifest.json"))
+            self.blobs = {name: archive.read(name) for name in archive.namelist() if name.startswith("files/")}
+        self._by_key: dict[tuple[str, str], deque] = {}
+        self._by_kind: dict[str, deque] = {}
+        for entry in self.manifest["entries"]:
+            self._by_key.setdefault((entry["kind"], entry["key"]), deque()).append(entry)
+            self._by_kind.setdefault(entry["kind"], deque()).append(entry)
+        self._used: set[int] = set()
+        self.misses = 0
+
+    def _next(self, queue: deque | None) -> dict | None:
+        while queue:
+            entry = queue.popleft()
+            if id(entry) not in self._used:
+                self._used.add(id(entry))
+                return entry
+        return None
+
+    async def handle(self, kind: str, key: str, call, file_path: str | None):
+        entry = self._next(self._by_key.get((kind, key)))
+        if entry is None:
+            entry = self._next(self._by_kind.get(kind))
+            if entry is None:
+                raise ReplayMissError(f"No recorded {kind} call left for {key}")
+            self.misses += 1
+            logger.warning("No recorded %s call for %s, using the next recorded one (%s)", kind, key, entry["key"])
+        if entry.get("cancelled"):
+            # The original call never finished; wait until the orchestrator cancels it again
+            await asyncio.Event().wait()
+        if self.preserve_timing:
+            await asyncio.sleep(entry["duration"])
+        if "error" in entry:
+            raise ReplayedError(entry["error"])
+        if file_path and "blob" in entry:
+            with open(file_path, "wb") as f:
+                f.write(self.blobs[entry["blob"]])
+        return entry["result"]
+
+
+async def intercept(kind: str, key: str, call, file_path: str | None = None):
+    """
+    Awaits `call()` and records it when the current chain is being recorded,
+    or answers from the archive instead when it is being replayed. `file_path`
+    is a file the call writes, which is stored and restored along with it.
+    """
+    session = _SESSION.get()
+    if session is None:
+        return await call()
+    return await session.handle(kind, key, call, file_path)
+
+
+def record_chains(runner, directory: str = CHAIN_RECORD_DIR):
+    """Wraps a JobManager runner so every chain it runs is recorded into `directory`."""
+    if not directory:
+        return runner
+
+    async def recorded(job) -> dict:
+        recording = Recording(job.id, job.url)
+        token = _SESSION.set(recording)
+        result = None
+        try:
+            result = await runner(job)
+            return result
+        finally:
+            _SESSION.reset(token)
+            try:
+                path = await asyncio.to_thread(recording.save, directory, result)
+                logger.info("Recorded %d interactions to %s", len(recording.entries), path)
+            except OSError as e:
+                logger.warning("Could not save recording for job %s: %s", job.id, e)
+
+    return recorded
+
+
+async def replay_chain(path: str, preserve_timing: bool = True) -> dict:
+    """Runs the orchestrator over a recorded chain with no network access."""
+    os.environ.setdefault("OPENAI_API_KEY", "replay")
+    import main
+    from jobs import Job
+    from deadline import stage_stats
+
+    replay = Replay(path, preserve_timing=preserve_timing)
+    job = Job(replay.manifest["url"])
+    token = _SESSION.set(replay)
+    started = time.perf_counter()
+    try:
+        result = await main.run_quiz_chain(job)
+    finally:
+        _SESSION.reset(token)
+    return {
+        "archive": path,
+        "timing": "preserve" if preserve_timing else "strip",
+        "wall_seconds": time.perf_counter() - started,
+        "recorded_seconds": replay.manifest.get("duration"),
+        "replayed_calls": len(replay._used),
+        "recorded_calls": len(replay.manifest["entries"]),
+        "key_misses": replay.misses,
+        "result": result,
+        "recorded_result": replay.manifest.get("result"),
+        "quizzes": job.quizzes,
+        "stages": stage_stats(),
+    }
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Inspect or replay recorded quiz chains")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser("replay", help="run the orchestrator against a recording")
+    replay_parser.add_argument("archive")
+    replay_parser.add_argument("--timing", choices=["preserve", "strip"], default="preserve",
+                               help="sleep for each call's recorded duration, or answer immediately")
+    show_parser = commands.add_parser("show", help="list the interactions in a recording")
+    show_parser.add_argument("archive")
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        report = asyncio.run(replay_chain(args.archive, preserve_timing=args.timing == "preserve"))
+        print(json.dumps(report, indent=2, default=str))
+        return
+
+    with zipfile.ZipFile(args.archive) as archive:
+        manifest = json.loads(archive.read("manifest.json"))
+    print(f"Job {manifest['job_id']}: {manifest['url']} ({manifest['duration']:.2f}s)")
+    for entry in manifest["entries"]:
+        status = "error" if "error" in entry else "cancelled" if entry.get("cancelled") else "ok"
+        print(f"{entry['offset']:8.2f}s {entry['duration']:7.2f}s  {entry['kind']:<9}{status:<10}{entry['key'][:90]}")
+
+
+if __name__ == "__main__":
+    # Run through the imported module so the orchestrator and the CLI share one session variable
+    from recorder import cli as recorder_cli
+    sys.exit(recorder_cli())
@@ -0,0 +1,154 @@
+# Finds every file or sub-page a quiz refers to and fetches them side by side.
+# Each chain gets a ResourceCache, so an asset linked from several quiz steps is
+# fetched once; downloads live in the cache's scratch directory until the chain ends.
+# Downloaded files are also kept in the shared ARTIFACT_CACHE (see download_file).
+
+import os
+import re
+import shutil
+import asyncio
+import itertools
+from urllib.parse import urlsplit
+from browser_agent import download_file, get_page_text
+from telemetry import get_logger
+
+logger = get_logger("resources")
+
+RESOURCE_MAX_LINKS = int(os.getenv("RESOURCE_MAX_LINKS", "10"))
+RESOURCE_FETCH_CONCURRENCY = int(os.getenv("RESOURCE_FETCH_CONCURRENCY", "6"))
+# Follow same-site links to pages (not only data files)
+RESOURCE_FOLLOW_PAGES = os.getenv("RESOURCE_FOLLOW_PAGES", "true").lower() == "true"
+
+# Formats the solver can read; sniff_file_format maps tsv to csv and ndjson to json
+FILE_EXTENSIONS = {"pdf", "csv", "json", "ndjson", "xlsx", "txt", "tsv"}
+PAGE_EXTENSIONS = {"", "html", "htm", "php", "asp", "aspx"}
+TEXT_URL_PATTERN = re.compile(r"https?://[^\s\"'<>)\]]+")
+
+
+class Resource:
+    """A fetched file (saved under `path`) or sub-page (its visible `text`)."""
+
+    def __init__(self, url: str, kind: str):
+        self.url = url
+        self.kind = kind
+        self.format = None
+        self.path = None
+        self.text = None
+        self.links: list[str] = []
+        self.error = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def to_dict(self) -> dict:
+        return {"url": self.url, "kind": self.kind, "format": self.format, "error": self.error}
+
+
+def _extension(url: str) -> str:
+    path = urlsplit(url).path
+    name = path.rsplit("/", 1)[-1]
+    return name.rsplit(".", 1)[-1].lower() if "." in name else ""
+
+
+def extract_links(instructions: str, page_links: list[str], page_url: str,
+                  exclude: set[str] | None = None) -> list[tuple[str, str]]:
+    """
+    Every data file and same-site sub-page referenced by the quiz, as (url, kind)
+    with kind "file" or "page", deduplicated in order of appearance. URLs written
+    out in the text count as well as link targets from the page.
+    """
+    exclude = {u.rstrip("/") for u in (exclude or set()) if u}
+    exclude.add(page_url.rstrip("/"))
+    site = urlsplit(page_url).netloc
+    found: list[tuple[str, str]] = []
+    seen = set()
+
+    candidates = list(page_links) + [u.rstrip(".,;:") for u in TEXT_URL_PATTERN.findall(instructions)]
+    for url in candidates:
+        url = url.split("#", 1)[0]
+        key = url.rstrip("/")
+        if key in seen or key in exclude or not url.startswith(("http://", "https://")):
+            continue
+        seen.add(key)
+        extension = _extension(url)
+        if extension in FILE_EXTENSIONS:
+            found.append((url, "file"))
+        elif RESOURCE_FOLLOW_PAGES and extension in PAGE_EXTENSIONS and urlsplit(url).netloc == site:
+            found.append((url, "page"))
+
+    # Data files first: they are what DOWNLOAD quizzes are about
+    found.sort(key=lambda link: link[1] != "file")
+    if len(found) > RESOURCE_MAX_LINKS:
+        logger.info("Keeping %d of %d links", RESOURCE_MAX_LINKS, len(found))
+    return found[:RESOURCE_MAX_LINKS]
+
+
+class ResourceCache:
+    """Per-chain store of fetched resources; concurrent requests for one URL share a fetch."""
+
+    def __init__(self, scratch_dir: str):
+        self.scratch_dir = scratch_dir
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._names = itertools.count()
+        self.hits = 0
+        self.fetches = 0
+
+    def _path_for(self, url: str) -> str:
+        os.makedirs(self.scratch_dir, exist_ok=True)
+        extension = _extension(url) or "bin"
+        return os.path.join(self.scratch_dir, f"resource_{next(self._names)}.{extension}")
+
+    async def _fetch(self, url: str, kind: str, timeout: float) -> Resource:
+        resource = Resource(url, kind)
+        try:
+            if kind == "file":
+                resource.path = self._path_for(url)
+                resource.format = await download_file(url, resource.path, timeout=timeout)
+                if not resource.format:
+                    resource.error = "download failed"
+            else:
+                resource.text, resource.links = await get_page_text(url, timeout=timeout)
+                resource.format = "html"
+        except Exception as e:
+            resource.error = f"{type(e).__name__}: {e}"
+        return resource
+
+    def fetch(self, url: str, kind: str, timeout: float) -> asyncio.Task:
+        task = self._tasks.get(url)
+        # Reuse finished and in-flight fetches; cancelled or failed ones are tried again
+        if task is not None and not task.cancelled() and not (task.done() and not task.result().ok):
+            self.hits += 1
+            return task
+        self.fetches += 1
+        task = asyncio.create_task(self._fetch(url, kind, timeout))
+        self._tasks[url] = task
+        return task
+
+    def cleanup(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+
+    def stats(self) -> dict:
+        return {"fetches": self.fetches, "hits": self.hits}
+
+
+async def fetch_resources(links: list[tuple[str, str]], cache: ResourceCache, deadline) -> list[Resource]:
+    """
+    Fetches all links concurrently (at most RESOURCE_FETCH_CONCURRENCY at once,
+    and per host as limited by the shared HTTP client), each within what is
+    left of the deadline. Results keep the order of `links`; failures carry `error`.
+    """
+    semaphore = asyncio.Semaphore(RESOURCE_FETCH_CONCURRENCY)
+
+    async def one(url: str, kind: str) -> Resource:
+        async with semaphore:
+            return await cache.fetch(url, kind, deadline.timeout(60))
+
+    resources = await asyncio.gather(*(one(url, kind) for url, kind in links))
+    failed = [r for r in resources if not r.ok]
+    logger.info("Fetched %d resource(s), %d failed", len(resources) - len(failed), len(failed),
+                extra={"resources": [r.to_dict() for r in resources]})
+    return list(resources)
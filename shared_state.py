@@ -0,0 +1,223 @@
+# State shared by the worker processes of one host when the app runs under
+# several uvicorn workers (WEB_CONCURRENCY > 1): the worker count used to split
+# per-host budgets, a cross-process semaphore built on flock'ed slot files, an
+# on-disk artifact cache and collision-free per-job scratch directories.
+#
+#     WEB_CONCURRENCY=4 uvicorn main:app --host 0.0.0.0 --port 8000
+
+import os
+import json
+import time
+import fcntl
+import uuid
+import random
+import shutil
+import asyncio
+import hashlib
+import tempfile
+from contextlib import asynccontextmanager
+from telemetry import get_logger
+
+logger = get_logger("shared_state")
+
+# uvicorn reads the same variable as its default --workers; set it instead of passing --workers
+WORKER_COUNT = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", os.path.join(tempfile.gettempdir(), "quiz_shared"))
+SCRATCH_ROOT = os.getenv("SCRATCH_ROOT", tempfile.gettempdir())
+ARTIFACT_CACHE_TTL = float(os.getenv("ARTIFACT_CACHE_TTL", "600"))
+SLOT_POLL_INTERVAL = float(os.getenv("SLOT_POLL_INTERVAL", "0.05"))
+
+
+def per_worker(total: int) -> int:
+    """This process's share of a budget meant for the whole host (at least 1)."""
+    return max(1, total // WORKER_COUNT)
+
+
+def make_scratch_dir(job_id: str) -> str:
+    """A fresh private directory for one job, unique across workers and restarts."""
+    os.makedirs(SCRATCH_ROOT, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"quiz_job_{job_id}_", dir=SCRATCH_ROOT)
+
+
+def write_atomic(path: str, data: bytes):
+    """Writes `path` so that other processes see either the old or the complete new file."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ProcessSemaphore:
+    """
+    Counting semaphore shared by every process on the host: one lock file per
+    slot, held with a non-blocking flock. Waiters poll for a free slot (no FIFO
+    guarantee); the kernel releases the slots of a worker that dies.
+    """
+
+    def __init__(self, name: str, slots: int, directory: str = SHARED_STATE_DIR,
+                 poll_interval: float = SLOT_POLL_INTERVAL):
+        self.name = name
+        self.slots = max(1, slots)
+        self.directory = os.path.join(directory, "locks")
+        self.poll_interval = poll_interval
+        self.held = 0
+        self.waiting = 0
+        self.wait_seconds = 0.0
+
+    def _try_acquire(self) -> int | None:
+        os.makedirs(self.directory, exist_ok=True)
+        # Start at a random slot so workers don't all contend for slot 0
+        offset = random.randrange(self.slots)
+        for i in range(self.slots):
+            path = os.path.join(self.directory, f"{self.name}.{(offset + i) % self.slots}.lock")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    @asynccontextmanager
+    async def slot(self):
+        started = time.perf_counter()
+        fd = self._try_acquire()
+        if fd is None:
+            self.waiting += 1
+            try:
+                while fd is None:
+                    await asyncio.sleep(self.poll_interval)
+                    fd = self._try_acquire()
+            finally:
+                self.waiting -= 1
+        self.wait_seconds += time.perf_counter() - started
+        self.held += 1
+        try:
+            yield
+        finally:
+            self.held -= 1
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "slots": self.slots,
+            "held_by_this_worker": self.held,
+            "waiting_in_this_worker": self.waiting,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+class ArtifactCache:
+    """
+    Files shared by all workers, keyed by a string such as a URL, with a JSON
+    metadata sidecar. Entries are written atomically and expire after `ttl`
+    seconds; ttl <= 0 disables the cache.
+    """
+
+    def __init__(self, directory: str = os.path.join(SHARED_STATE_DIR, "artifacts"), ttl: float = ARTIFACT_CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, digest[:2], digest)
+        return base, base + ".json"
+
+    def get(self, key: str) -> tuple[str, dict] | None:
+        """Path of the cached file and its metadata, or None."""
+        if not self.enabled:
+            return None
+        path, meta_path = self._paths(key)
+        try:
+            if time.time() - os.path.getmtime(meta_path) > self.ttl:
+                self.misses += 1
+                return None
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path, meta
+
+    def put(self, key: str, source_path: str, meta: dict):
+        """
+        Links (or copies) `source_path` into the cache without reading it into
+        memory; the metadata goes last so readers never see half an entry.
+        """
+        if not self.enabled:
+            return
+        path, meta_path = self._paths(key)
+        tmp_path = os.path.join(os.path.dirname(path), f".tmp_{uuid.uuid4().hex}")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            copy_artifact(source_path, tmp_path)
+            os.replace(tmp_path, path)
+            write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        except OSError as e:
+            logger.warning("Could not cache artifact for %s: %s", key, e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def put_bytes(self, key: str, data: bytes, meta: dict):
+        """Stores small in-memory artifacts such as rendered chart URIs."""
+        if not self.enabled:
+            return
+        path, meta_path = self._paths(key)
+        try:
+            write_atomic(path, data)
+            write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        except OSError as e:
+            logger.warning("Could not cache artifact for %s: %s", key, e)
+
+    def prune(self) -> int:
+        """Removes expired entries. Returns how many were removed."""
+        removed = 0
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                meta_path = os.path.join(root, name)
+                try:
+                    if now - os.path.getmtime(meta_path) <= self.ttl:
+                        continue
+                    os.remove(meta_path)
+                    os.remove(meta_path[:-len(".json")])
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+ARTIFACT_CACHE = ArtifactCache()
+
+
+def copy_artifact(cached_path: str, target_path: str):
+    """Gives a job its own copy of a cached file (a hard link when the filesystem allows)."""
+    try:
+        os.link(cached_path, target_path)
+    except OSError:
+        shutil.copyfile(cached_path, target_path)
@@ -0,0 +1,103 @@
+import re
+
+# A bare first line only ends the value early if it is a whole scalar on its own
+BARE_SCALAR_PATTERN = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?|true|false|null", re.IGNORECASE)
+
+
+class IncrementalAnswerParser:
+    """
+    Consumes streamed completion text and reports as soon as one complete
+    value has arrived: a balanced JSON object/array, a quoted string, or a
+    bare number/true/false/null terminated by a newline. Any other bare text
+    ("Answer:", a multi-line reply) is read to the end of the stream. Leading
+    code fences are skipped.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.complete = False
+        self._start = None
+        self._end = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._scanned = 0
+        self._read_to_end = False
+
+    def feed(self, text: str) -> bool:
+        """Adds streamed text; returns True once a complete value is available."""
+        if self.complete:
+            return True
+        self.buffer += text
+        if self._start is None and not self._find_start():
+            return False
+        self._scan()
+        return self.complete
+
+    def _find_start(self) -> bool:
+        stripped = self.buffer.lstrip()
+        if not stripped:
+            return False
+        offset = len(self.buffer) - len(stripped)
+        if stripped.startswith("`"):
+            # Skip a ``` or ```json fence line once it's complete
+            newline = stripped.find("\n")
+            if newline == -1:
+                return False
+            rest = stripped[newline + 1:]
+            if not rest.lstrip():
+                return False
+            offset += newline + 1 + len(rest) - len(rest.lstrip())
+        self._start = offset
+        self._scanned = offset
+        return True
+
+    def _scan(self):
+        opener = self.buffer[self._start]
+        i = self._scanned
+        while i < len(self.buffer):
+            ch = self.buffer[i]
+            if opener in "{[":
+                if self._in_string:
+                    if self._escaped:
+                        self._escaped = False
+                    elif ch == "\\":
+                        self._escaped = True
+                    elif ch == '"':
+                        self._in_string = False
+                elif ch == '"':
+                    self._in_string = True
+                elif ch in "{[":
+                    self._depth += 1
+                elif ch in "}]":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._finish(i + 1)
+                        return
+            elif opener == '"' and i > self._start:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._finish(i + 1)
+                    return
+            elif opener not in "{[\"" and ch == "\n" and not self._read_to_end:
+                if BARE_SCALAR_PATTERN.fullmatch(self.buffer[self._start:i].strip()):
+                    self._finish(i)
+                    return
+                self._read_to_end = True
+            i += 1
+        self._scanned = i
+
+    def _finish(self, end: int):
+        self._end = end
+        self.complete = True
+
+    def value_text(self) -> str:
+        """The parsed value's text (everything received so far if the stream ended early)."""
+        if self._start is None:
+            return self.buffer.strip()
+        end = self._end if self._end is not None else len(self.buffer)
+        text = self.buffer[self._start:end].strip()
+        return text[:-3].rstrip() if text.endswith("```") else text
@@ -0,0 +1,131 @@
+# Structured logging, per-stage tracing spans and Prometheus metrics.
+# Every log line is one JSON object carrying the current trace context (job id,
+# quiz number, task type); LOG_FORMAT=off disables logging entirely.
+
+import os
+import json
+import time
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # json | text | off
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Log one line per finished span in addition to recording its metrics
+TRACE_LOG_SPANS = os.getenv("TRACE_LOG_SPANS", "true").lower() == "true"
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+_TRACE_CONTEXT: contextvars.ContextVar[dict] = contextvars.ContextVar("trace_context", default={})
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+STAGE_LATENCY = Histogram(
+    "quiz_stage_duration_seconds", "Time spent in each chain stage",
+    ["stage", "task_type", "outcome"], buckets=STAGE_BUCKETS
+)
+STAGE_TIMEOUTS = Counter("quiz_stage_timeouts_total", "Stages cut short by their time budget", ["stage"])
+QUIZZES_ATTEMPTED = Counter("quiz_attempted_total", "Quizzes started", ["task_type"])
+QUIZZES_CORRECT = Counter("quiz_correct_total", "Answers accepted as correct", ["task_type"])
+QUIZZES_INCORRECT = Counter("quiz_incorrect_total", "Answers rejected as incorrect", ["task_type"])
+QUIZZES_FAILED = Counter("quiz_failed_total", "Quizzes that ended without a submission response", ["reason"])
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **_TRACE_CONTEXT.get(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _configure():
+    root = logging.getLogger("quiz")
+    root.propagate = False
+    if LOG_FORMAT == "off":
+        # Calls below CRITICAL return after one integer comparison; message args are never formatted
+        root.setLevel(logging.CRITICAL + 1)
+        return
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "text":
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        handler.setFormatter(JsonFormatter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+
+_configure()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the shared "quiz" hierarchy; pass structured fields with `extra=`."""
+    return logging.getLogger(f"quiz.{name}")
+
+
+logger = get_logger("trace")
+
+
+def start_trace(**fields):
+    """Replaces the trace context for the current task (e.g. at the start of a job)."""
+    _TRACE_CONTEXT.set(dict(fields))
+
+
+def bind_trace(**fields):
+    """Adds fields to the trace context; tasks created afterwards inherit them."""
+    _TRACE_CONTEXT.set({**_TRACE_CONTEXT.get(), **fields})
+
+
+@contextmanager
+def span(stage: str, **tags):
+    """
+    Times the enclosed block as one stage. The outcome is "ok", "timeout",
+    "cancelled" or "error" depending on how the block exits; the yielded dict
+    can be updated with extra tags for the span's log line.
+    """
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield tags
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        task_type = tags.pop("task_type", None) or _TRACE_CONTEXT.get().get("task_type", "unknown")
+        STAGE_LATENCY.labels(stage, task_type, outcome).observe(duration)
+        if outcome == "timeout":
+            STAGE_TIMEOUTS.labels(stage).inc()
+        if TRACE_LOG_SPANS:
+            logger.info("span %s %s in %.3fs", stage, outcome, duration, extra={
+                "span": stage, "outcome": outcome, "duration": round(duration, 4),
+                "task_type": task_type, **tags,
+            })
+
+
+def register_gauge(name: str, documentation: str, read) -> Gauge:
+    """Gauge whose value is read from `read()` at scrape time."""
+    gauge = Gauge(name, documentation)
+    gauge.set_function(read)
+    return gauge
+
+
+def metrics_text() -> bytes:
+    return generate_latest()
@@ -0,0 +1,52 @@
+"""
+Tests for deciding whether a page can be read without a browser.
+Run with: python -m pytest test_browser_agent.py
+"""
+
+import base64
+
+from browser_agent import _render_static
+
+URL = "https://quiz.example.com/q/1"
+
+
+def _atob_page(inner_html: str) -> str:
+    payload = base64.b64encode(inner_html.encode("utf-8")).decode("ascii")
+    return f'<div id="result"></div><script>document.querySelector("#result").innerHTML = atob(`{payload}`);</script>'
+
+
+def test_static_page_is_read_with_its_links():
+    text, reason, links = _render_static(
+        '<h1>Q1</h1><p>Sum the <a href="/data.csv">data</a>.</p><p>Post your answer to https://x/submit</p>', URL
+    )
+    assert reason == ""
+    assert text.splitlines() == ["Q1", "Sum the data.", "Post your answer to https://x/submit"]
+    assert links == ["/data.csv"]
+
+
+def test_atob_injection_is_decoded():
+    text, reason, links = _render_static(_atob_page('<p>What is 2+2? <a href="/f.pdf">file</a></p>'), URL)
+    assert reason == ""
+    assert "What is 2+2?" in text
+    assert links == ["/f.pdf"]
+
+
+def test_other_dom_writes_need_the_browser():
+    page = '<div id="q"></div><script>document.getElementById("q").textContent = "What is 2+2?";</script>'
+    assert _render_static(page, URL) == (None, "script writes to the DOM", [])
+
+
+def test_dom_write_beside_atob_needs_the_browser():
+    page = _atob_page("<p>Q</p>").replace("</script>", "document.body.appendChild(x);</script>")
+    assert _render_static(page, URL)[:2] == (None, "script writes to the DOM")
+
+
+def test_external_scripts_need_the_browser_unless_blocked():
+    static = "<p>Post your answer to https://x/submit</p>"
+    assert _render_static(static + '<script src="/render-question.js"></script>', URL)[:2] == (None, "external scripts")
+    tracker = '<script src="https://www.googletagmanager.com/gtag/js"></script>'
+    assert _render_static(static + tracker, URL)[1] == ""
+
+
+def test_empty_body_needs_the_browser():
+    assert _render_static("<html><body><div id='app'></div></body></html>", URL)[:2] == (None, "empty body")
@@ -0,0 +1,66 @@
+"""
+Tests for operation specs run by the compute engine.
+Run with: python -m pytest test_compute_engine.py
+"""
+
+import pandas as pd
+import pytest
+
+from compute_engine import SpecError, execute_spec
+
+SALES = pd.DataFrame({
+    "region": ["north", "south", "north", "east", "south"],
+    "product": ["a", "b", "b", "a", "a"],
+    "amount": ["1,000", "250", "$300", "50", "400"],
+})
+
+
+def test_filters_and_sum_with_formatted_numbers():
+    spec = {"filters": [{"column": "region", "op": "==", "value": "north"}],
+            "aggregate": {"column": "amount", "func": "sum"}}
+    assert execute_spec(SALES, spec) == 1300
+
+
+def test_numeric_comparison_filter_counts_rows():
+    assert execute_spec(SALES, {"filters": [{"column": "amount", "op": ">", "value": 299}]}) == 3
+
+
+def test_group_by_returns_top_key():
+    spec = {"group_by": ["region"], "aggregate": {"column": "amount", "func": "sum"},
+            "sort": {"by": "value", "ascending": False}, "limit": 1, "return": "key"}
+    assert execute_spec(SALES, spec) == "north"
+
+
+def test_group_by_returns_mapping():
+    spec = {"group_by": ["product"], "aggregate": {"func": "count"}}
+    assert execute_spec(SALES, spec) == {"a": 3, "b": 2}
+
+
+def test_filter_matching_nothing():
+    spec = {"filters": [{"column": "region", "op": "==", "value": "west"}]}
+    assert execute_spec(SALES, spec) == 0
+    assert execute_spec(SALES, {**spec, "select": "product", "return": "column"}) == []
+
+
+def test_column_names_are_matched_loosely():
+    assert execute_spec(SALES, {"aggregate": {"column": " Region ", "func": "nunique"}}) == 3
+
+
+def test_unknown_column_and_op_are_rejected():
+    with pytest.raises(SpecError):
+        execute_spec(SALES, {"aggregate": {"column": "price", "func": "sum"}})
+    with pytest.raises(SpecError):
+        execute_spec(SALES, {"filters": [{"column": "region", "op": "~", "value": "x"}]})
+
+
+def test_chart_data_aggregates_and_sorts():
+    from compute_engine import chart_data
+    spec = {"type": "bar", "x": "region", "y": "amount", "aggregate": "sum", "sort": {"by": "y", "ascending": False}}
+    assert chart_data(SALES, spec) == {"labels": ["north", "south", "east"], "series": {"amount": [1300, 650, 50]}}
+
+
+def test_chart_data_from_inline_values():
+    from compute_engine import chart_data
+    spec = {"type": "line", "x": "year", "y": "value",
+            "data": {"columns": ["year", "value"], "rows": [["2020", "1"], ["2021", "3"]]}}
+    assert chart_data(None, spec) == {"labels": [2020, 2021], "series": {"value": [1, 3]}}
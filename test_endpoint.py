@@ -132,7 +132,7 @@ def test_demo_quiz():
         response = requests.post(
             f"{BASE_URL}/solve-quiz",
             json=payload,
-            timeout=180  # 3 minutes timeout
+            timeout=10
         )
         elapsed_time = time.time() - start_time
         
@@ -141,9 +141,23 @@ def test_demo_quiz():
         
         if response.status_code == 200:
             data = response.json()
+            job_id = data.get('job_id')
+            print_success(f"Quiz queued as job {job_id}")
+            
+            # Poll the job until the chain finishes
+            while True:
+                job = requests.get(f"{BASE_URL}/jobs/{job_id}", timeout=5).json()
+                if job.get('status') in ('completed', 'failed'):
+                    break
+                if time.time() - start_time > 180:
+                    print_error("Job did not finish within 3 minutes")
+                    return False
+                time.sleep(2)
+            
+            data = job.get('result') or {}
             print_success("Quiz processing completed")
-            print(f"\nResponse Data:")
-            print(json.dumps(data, indent=2))
+            print(f"\nJob Data:")
+            print(json.dumps(job, indent=2))
             
             if data.get('status') == 'processing_complete':
                 print_success(f"Processed {data.get('quizzes_attempted', 0)} quiz(es)")
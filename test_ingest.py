@@ -0,0 +1,47 @@
+"""
+Tests for streaming ingestion: results must not depend on how the file was chunked.
+Run with: python -m pytest test_ingest.py
+"""
+
+from compute_engine import execute_spec
+from ingest import ingest_file
+
+CSV = "name,score\nm,3\nz,1\na,4\nb,2\n"
+
+
+def _table(tmp_path, chunk_rows):
+    path = tmp_path / "table.csv"
+    path.write_text(CSV)
+    return ingest_file(str(path), "csv", chunk_rows=chunk_rows).to_dataframe()
+
+
+def test_sort_strings_across_chunks(tmp_path):
+    df = _table(tmp_path, chunk_rows=2)
+    assert execute_spec(df, {"sort": {"by": "name"}, "select": "name", "return": "column"}) == ["a", "b", "m", "z"]
+
+
+def test_max_of_strings_across_chunks(tmp_path):
+    df = _table(tmp_path, chunk_rows=2)
+    assert execute_spec(df, {"aggregate": {"column": "name", "func": "max"}}) == "z"
+    assert execute_spec(df, {"aggregate": {"column": "name", "func": "min"}}) == "a"
+
+
+def test_chunking_does_not_change_answers(tmp_path):
+    spec = {"sort": {"by": "name", "ascending": False}, "limit": 2, "return": "rows"}
+    assert execute_spec(_table(tmp_path, chunk_rows=1), spec) == execute_spec(_table(tmp_path, chunk_rows=100), spec)
+
+
+def test_json_object_wrapping_records_is_streamed(tmp_path, monkeypatch):
+    import ingest
+    monkeypatch.setattr(ingest, "JSON_READ_BLOCK", 16)
+    path = tmp_path / "wrapped.json"
+    path.write_text('{"meta": {"total": 12345}, "data": [' + ", ".join(f'{{"id": {i}}}' for i in range(30)) + "]}")
+    result = ingest_file(str(path), "json", chunk_rows=7)
+    assert result.rows == 30
+    assert result.to_dataframe()["id"].tolist() == list(range(30))
+
+
+def test_json_single_object_is_one_record(tmp_path):
+    path = tmp_path / "single.json"
+    path.write_text('{"a": 1, "b": "x"}')
+    assert ingest_file(str(path), "json").to_dataframe().to_dict(orient="records") == [{"a": 1, "b": "x"}]
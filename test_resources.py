@@ -0,0 +1,40 @@
+"""
+Tests for finding the files and sub-pages a quiz refers to.
+Run with: python -m pytest test_resources.py
+"""
+
+import resources
+from resources import extract_links
+
+PAGE = "https://quiz.example.com/q/1"
+
+
+def test_files_come_before_pages_and_duplicates_are_dropped():
+    links = extract_links(
+        "Use the data at https://cdn.example.org/data.csv.",
+        ["https://quiz.example.com/q/help", "https://quiz.example.com/files/table.json#top",
+         "https://quiz.example.com/files/table.json"],
+        PAGE,
+    )
+    assert links == [
+        ("https://quiz.example.com/files/table.json", "file"),
+        ("https://cdn.example.org/data.csv", "file"),
+        ("https://quiz.example.com/q/help", "page"),
+    ]
+
+
+def test_excluded_urls_other_sites_and_assets_are_skipped():
+    links = extract_links(
+        "Post your answer to https://quiz.example.com/submit",
+        ["https://quiz.example.com/submit", "https://elsewhere.example.net/page",
+         "https://quiz.example.com/q/1/", "https://quiz.example.com/logo.png", "mailto:someone@example.com"],
+        PAGE,
+        exclude={"https://quiz.example.com/submit"},
+    )
+    assert links == []
+
+
+def test_link_count_is_capped(monkeypatch):
+    monkeypatch.setattr(resources, "RESOURCE_MAX_LINKS", 2)
+    page_links = [f"https://quiz.example.com/files/part{i}.csv" for i in range(5)]
+    assert [url for url, _ in extract_links("", page_links, PAGE)] == page_links[:2]
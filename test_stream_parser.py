@@ -0,0 +1,42 @@
+"""
+Tests for the streamed answer parser: when it may stop reading and what value it returns.
+Run with: python -m pytest test_stream_parser.py
+"""
+
+from stream_parser import IncrementalAnswerParser
+
+
+def _parse(*pieces):
+    parser = IncrementalAnswerParser()
+    stopped = None
+    for i, piece in enumerate(pieces):
+        if parser.feed(piece):
+            stopped = i
+            break
+    return parser.value_text(), stopped
+
+
+def test_bare_number_stops_at_newline():
+    assert _parse("4", "2\n", "trailing explanation") == ("42", 1)
+
+
+def test_label_line_is_not_an_answer():
+    assert _parse("Answer:\n", "42") == ("Answer:\n42", None)
+    assert _parse("The result is\n42\n") == ("The result is\n42", None)
+
+
+def test_multi_line_text_is_kept_whole():
+    assert _parse("first line\nsecond line") == ("first line\nsecond line", None)
+
+
+def test_json_object_stops_when_balanced():
+    assert _parse('{"answer": {"a": [1, "}"]}', "}", " extra") == ('{"answer": {"a": [1, "}"]}}', 1)
+
+
+def test_quoted_string_with_escapes():
+    assert _parse('"say \\"hi\\""', " and more") == ('"say \\"hi\\""', 0)
+
+
+def test_code_fence_is_skipped():
+    assert _parse("```json\n", "[1, 2]\n```") == ("[1, 2]", 1)
+    assert _parse("```\n", "true\n", "```") == ("true", 1)
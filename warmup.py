@@ -0,0 +1,81 @@
+# Startup warm-up. Heavy libraries (openai, playwright, pypdf, pandas) are
+# imported on first use so the server binds its port quickly; the app lifespan
+# then runs the warm-up steps (browser launch, LLM connection, parser imports)
+# so the first quiz doesn't pay for them. /ready reports the outcome.
+
+import os
+import time
+import asyncio
+from telemetry import get_logger, span
+
+logger = get_logger("warmup")
+
+# background: serve immediately and warm up alongside; blocking: warm up before serving; off: stay lazy
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background").lower()
+WARMUP_STEP_TIMEOUT = float(os.getenv("WARMUP_STEP_TIMEOUT", "60"))
+
+
+class Warmup:
+    """Runs named warm-up steps concurrently and keeps their outcome and timings."""
+
+    def __init__(self, steps: dict, mode: str = STARTUP_WARMUP):
+        self.steps = steps
+        self.mode = mode
+        self.state = "off" if mode == "off" else "cold"
+        self.results: dict[str, dict] = {}
+        self.started_at = None
+        self.seconds = None
+        self._task: asyncio.Task | None = None
+
+    async def _step(self, name: str, step):
+        started = time.perf_counter()
+        entry = {"ok": True}
+        try:
+            with span("warmup", step=name):
+                await asyncio.wait_for(step(), WARMUP_STEP_TIMEOUT)
+        except Exception as e:
+            message = (str(e).splitlines() or [""])[0]
+            entry = {"ok": False, "error": f"{type(e).__name__}: {message}"}
+            logger.warning("Warm-up step %s failed, it will happen on first use instead: %s", name, message)
+        entry["seconds"] = round(time.perf_counter() - started, 3)
+        self.results[name] = entry
+
+    async def run(self):
+        self.state = "warming"
+        self.started_at = time.time()
+        started = time.perf_counter()
+        await asyncio.gather(*(self._step(name, step) for name, step in self.steps.items()))
+        self.seconds = round(time.perf_counter() - started, 3)
+        self.state = "warm"
+        logger.info("Warm-up finished in %.2fs", self.seconds, extra={"warmup": self.results})
+
+    async def start(self):
+        if self.mode == "off":
+            return
+        if self.mode == "blocking":
+            await self.run()
+        else:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    @property
+    def ready(self) -> bool:
+        """Ready once warm-up has finished (failed steps included) or when it is disabled."""
+        return self.state in ("warm", "off")
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "mode": self.mode,
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "steps": self.results,
+        }